@@ -0,0 +1,57 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from cache import MemoryCache
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+
+
+class PrincipalCache:
+    """
+    Short-lived cache of the users row behind a token subject, so
+    authenticated requests don't have to re-read it every time.
+
+    Entries remember when they were stored, and invalidating a user (on
+    profile update) makes everything cached for them up to then stale right
+    away. An invalidation only matters until those entries expire, so it is
+    forgotten after `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.cache = MemoryCache(max_size, ttl)
+        self.ttl = ttl
+        # user id -> when it was last invalidated, oldest first
+        self._invalidated: "OrderedDict[int, float]" = OrderedDict()
+
+    def get(self, subject: str) -> Optional[dict]:
+        entry = self.cache.get_nowait(subject)
+        if entry is None:
+            return None
+
+        user, cached_at = entry
+        invalidated_at = self._invalidated.get(user["id"])
+        if invalidated_at is not None and cached_at <= invalidated_at:
+            self.cache.delete_nowait(subject)
+            return None
+
+        return dict(user)
+
+    def put(self, subject: str, user: dict) -> None:
+        self.cache.set_nowait(subject, (dict(user), time.monotonic()))
+
+    def invalidate(self, user_id: int) -> None:
+        now = time.monotonic()
+        self._invalidated.pop(user_id, None)
+        self._invalidated[user_id] = now
+        # anything cached before these has expired by now
+        while True:
+            oldest = next(iter(self._invalidated.values()))
+            if oldest >= now - self.ttl:
+                break
+            self._invalidated.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
@@ -0,0 +1,725 @@
+"""
+Load-testing / benchmark harness for the API.
+
+Spins up main.app against a throwaway database (a temp SQLite file unless
+--database-url is given) with a fake TMDb behind httpx.MockTransport, seeds
+synthetic users / movies / reviews, then runs concurrent virtual users through
+a weighted mix of requests and prints throughput and latency percentiles as
+JSON, so runs can be diffed across commits.
+
+By default requests go through httpx.ASGITransport in-process; --server
+uvicorn starts a real uvicorn server on a free port instead.
+
+Examples:
+    python bench.py                                   # default mixed workload
+    python bench.py --concurrency 200 --duration 30 --output before.json
+    python bench.py --preset auth                     # /me only (auth overhead)
+    AUTH_CACHE_TTL=0 python bench.py --preset auth    # ... without the user cache
+    python bench.py --preset login-storm              # /me latency during a login burst
+    python bench.py --preset search --movies 100000  # /movies/search typeahead
+    python bench.py --preset likes --users 2000 --concurrency 2000   # one viral review
+    LIKE_FLUSH_SECONDS=0 python bench.py --preset likes ...          # ... with likes = likes + 1
+    python bench.py --preset posters --server uvicorn                # posters from the disk cache
+    POSTER_CACHE_MAX_BYTES=0 python bench.py --preset posters ...     # ... proxied to TMDb every time
+    python bench.py --mix list_reviews=1 --server uvicorn
+
+--scenario runs an A/B comparison instead of the workload and reports both
+sides:
+    python bench.py --scenario tmdb-client --calls 500 --tmdb-latency-ms 5
+    python bench.py --scenario leaderboard --movies 100000 --reviews-per-movie 100 --calls 20
+    python bench.py --scenario import --calls 500                  # TMDb budget as configured
+    TMDB_RATE_LIMIT=0 python bench.py --scenario import --calls 500  # ... without it
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+PRESETS = {
+    "mixed": "login=1,me=2,add_movie=1,post_review=2,update_review=2,list_reviews=6",
+    "auth": "me=1",
+    "login-storm": "login=1,me=1",
+    "reviews": "list_reviews=1",
+    "writes": "add_movie=1,post_review=1,update_review=1",
+    "search": "search=1",
+    "likes": "like=1",
+    "posters": "poster=1",
+}
+
+BENCH_PASSWORD = "bench-password"
+TMDB_ID_BASE = 100000
+
+TITLE_WORDS = [
+    "night", "city", "last", "love", "return", "dark", "river", "king", "secret", "summer",
+    "war", "house", "blue", "road", "storm", "dream", "star", "lost", "shadow", "island",
+    "heart", "fire", "winter", "ghost", "garden", "silent", "golden", "wild", "empire", "stranger",
+]
+
+
+def synthetic_title(tmdb_id: int) -> str:
+    # deterministic per id, so the fake TMDb and the seeded rows agree
+    rng = random.Random(tmdb_id)
+    return " ".join(rng.sample(TITLE_WORDS, rng.randint(1, 3))).title() + f" {tmdb_id}"
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--movies", type=int, default=1000)
+    p.add_argument("--reviews-per-movie", type=int, default=10)
+    p.add_argument("--concurrency", type=int, default=100)
+    p.add_argument("--duration", type=float, default=10.0, help="seconds to run the workload")
+    p.add_argument("--warmup", type=float, default=1.0, help="seconds of unrecorded warmup")
+    p.add_argument("--preset", choices=sorted(PRESETS), default="mixed")
+    p.add_argument("--mix", help="override the preset, e.g. me=3,list_reviews=5")
+    p.add_argument("--tmdb-latency-ms", type=float, default=50.0, help="fake TMDb response time")
+    p.add_argument("--database-url", help="default: a fresh SQLite file in a temp dir")
+    p.add_argument("--server", choices=["asgi", "uvicorn"], default="asgi")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--output", help="write the JSON report here as well as stdout")
+    p.add_argument("--scenario", choices=sorted(SCENARIOS), help="A/B comparison instead of the workload")
+    p.add_argument("--calls", type=int, default=500, help="calls per side of a --scenario")
+    return p.parse_args(argv)
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"unknown operation in mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# --------------------- FAKE TMDb ---------------------
+def fake_tmdb_payload(path: str) -> Dict[str, Any]:
+    movie_id = path.rstrip("/").rsplit("/", 1)[-1]
+    if not movie_id.isdigit():
+        return {"results": [], "page": 1, "total_pages": 1}
+    return {
+        "id": int(movie_id),
+        "title": synthetic_title(int(movie_id)),
+        "release_date": f"{1950 + int(movie_id) % 75}-01-01",
+        "poster_path": f"/{movie_id}.jpg",
+        "overview": "A synthetic movie used for benchmarking.",
+        "genres": [{"id": 18, "name": "Drama"}, {"id": 35, "name": "Comedy"}],
+    }
+
+
+def fake_tmdb_transport(latency_ms: float) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json=fake_tmdb_payload(request.url.path))
+
+    return httpx.MockTransport(handler)
+
+
+def fake_tmdb_app(latency_ms: float):
+    # the same fake as a real HTTP server, for when connection setup is what's measured
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        await asyncio.sleep(latency_ms / 1000)
+        body = json.dumps(fake_tmdb_payload(scope["path"])).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+def fake_image_transport(latency_ms: float) -> httpx.MockTransport:
+    # one real JPEG when Pillow is there (so thumbnails can be made), made
+    # unique per URL so the content-addressed cache doesn't fold them together
+    try:
+        import io
+        from PIL import Image
+        buf = io.BytesIO()
+        # fractal plus a little noise: ~65 KB, about a real w500 poster
+        fractal = Image.effect_mandelbrot((500, 750), (-2, -1.5, 1, 1.5), 60).convert("RGB")
+        Image.blend(fractal, Image.effect_noise((500, 750), 64).convert("RGB"), 0.07).save(buf, "JPEG", quality=85)
+        base = buf.getvalue()
+    except ImportError:
+        base = random.Random(0).randbytes(60000)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, content=base + request.url.path.encode(), headers={"Content-Type": "image/jpeg"})
+
+    return httpx.MockTransport(handler)
+
+
+# --------------------- SEEDING ---------------------
+def seed(args, engine, password_hash: str):
+    from sqlalchemy import text
+    from stats import RECOMPUTE_SELECT, STATS_COLUMNS
+    from genres import backfill_genres
+
+    rng = random.Random(args.seed)
+    with engine.begin() as conn:
+        # only the rows inserted here are paired up, so seeding works on a used database too
+        after_user = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM users;")).scalar()
+        after_movie = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM movies;")).scalar()
+        conn.execute(
+            text("""
+                INSERT INTO users (username, email, user_password, full_name)
+                VALUES (:username, :email, :user_password, :full_name);
+            """),
+            [
+                {
+                    "username": f"bench{i}",
+                    "email": f"bench{i}@example.com",
+                    "user_password": password_hash,
+                    "full_name": f"Bench User {i}",
+                }
+                for i in range(args.users)
+            ],
+        )
+        conn.execute(
+            text("""
+                INSERT INTO movies (external_id, title, year, overview, genres)
+                VALUES (:external_id, :title, :year, :overview, :genres);
+            """),
+            [
+                {
+                    "external_id": str(TMDB_ID_BASE + i),
+                    "title": synthetic_title(TMDB_ID_BASE + i),
+                    "year": 1950 + i % 75,
+                    "overview": "A synthetic movie used for benchmarking.",
+                    "genres": "Drama, Comedy",
+                }
+                for i in range(args.movies)
+            ],
+        )
+
+        user_ids = [row[0] for row in conn.execute(text("SELECT id FROM users WHERE id > :after;"), {"after": after_user})]
+        movie_ids = [row[0] for row in conn.execute(text("SELECT id FROM movies WHERE id > :after;"), {"after": after_movie})]
+
+        reviews = []
+        for movie_id in movie_ids:
+            for user_id in rng.sample(user_ids, min(args.reviews_per_movie, len(user_ids))):
+                reviews.append({
+                    "user_id": user_id,
+                    "movie_id": movie_id,
+                    "rating": rng.randint(1, 10),
+                    "comment": "synthetic review",
+                })
+        conn.execute(
+            text("""
+                INSERT INTO reviews (user_id, movie_id, rating, comment, likes)
+                VALUES (:user_id, :movie_id, :rating, :comment, 0);
+            """),
+            reviews,
+        )
+
+        # the same aggregates the review endpoints keep up to date
+        conn.execute(text(f"""
+            INSERT INTO movie_stats (movie_id, {", ".join(STATS_COLUMNS)})
+            SELECT movie_id, {RECOMPUTE_SELECT}
+            FROM reviews
+            WHERE movie_id > :after
+            GROUP BY movie_id;
+        """), {"after": after_movie})
+
+    # movie_genres rows, as adding the movies through the API would have written
+    backfill_genres(engine)
+
+    return movie_ids
+
+
+# --------------------- OPERATIONS ---------------------
+class VirtualUser:
+    def __init__(self, index: int, username: str, movie_ids: List[int], rng: random.Random):
+        self.index = index
+        self.username = username
+        self.movie_ids = movie_ids
+        self.rng = rng
+        self.headers: Dict[str, str] = {}
+        self.liked = False
+
+    def tmdb_id(self) -> int:
+        return TMDB_ID_BASE + self.rng.randrange(len(self.movie_ids))
+
+
+async def op_login(c: httpx.AsyncClient, u: VirtualUser):
+    resp = await c.post("/login", json={"username": u.username, "password": BENCH_PASSWORD})
+    if resp.status_code == 200:
+        u.headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+    return resp
+
+
+async def op_me(c, u):
+    return await c.get("/me", headers=u.headers)
+
+
+async def op_list_reviews(c, u):
+    return await c.get(f"/movies/tmdb/{u.tmdb_id()}/reviews", params={"limit": 20}, headers=u.headers)
+
+
+async def op_add_movie(c, u):
+    # half already in the catalog, half fetched from the fake TMDb
+    tmdb_id = TMDB_ID_BASE + u.rng.randrange(len(u.movie_ids) * 2)
+    return await c.post(f"/movies/{tmdb_id}", headers=u.headers)
+
+
+async def op_post_review(c, u):
+    body = {"movie_id": u.rng.choice(u.movie_ids), "rating": u.rng.randint(1, 10), "comment": "bench"}
+    return await c.post("/reviews", json=body, headers=u.headers)
+
+
+async def op_update_review(c, u):
+    movie_id = u.rng.choice(u.movie_ids)
+    body = {"movie_id": movie_id, "rating": u.rng.randint(1, 10), "comment": "bench update"}
+    return await c.put(f"/reviews/{movie_id}", json=body, headers=u.headers)
+
+
+async def op_search(c, u):
+    # typeahead: a prefix of a seeded title, cut mid-word
+    title = synthetic_title(u.tmdb_id())
+    q = title[: u.rng.randint(2, len(title))]
+    return await c.get("/movies/search", params={"q": q}, headers=u.headers)
+
+
+# every virtual user likes / unlikes the same review (set by bench())
+HOT_REVIEW_ID = 0
+
+
+async def op_like(c, u):
+    path = f"/reviews/{HOT_REVIEW_ID}/like"
+    resp = await (c.delete(path, headers=u.headers) if u.liked else c.post(path, headers=u.headers))
+    if resp.status_code == 200:
+        u.liked = resp.json()["liked"]
+    return resp
+
+
+async def op_poster(c, u):
+    # mostly list thumbnails, some detail-page posters
+    size = "w185" if u.rng.random() < 0.8 else "w500"
+    return await c.get(f"/posters/{size}/{u.tmdb_id()}.jpg")
+
+
+OPERATIONS: Dict[str, Callable] = {
+    "login": op_login,
+    "me": op_me,
+    "list_reviews": op_list_reviews,
+    "add_movie": op_add_movie,
+    "post_review": op_post_review,
+    "update_review": op_update_review,
+    "search": op_search,
+    "like": op_like,
+    "poster": op_poster,
+}
+
+
+# --------------------- RUNNER ---------------------
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[i]
+
+
+def summarize(
+    samples: Dict[str, List[float]],
+    errors: Dict[str, int],
+    statuses: Dict[str, Dict[str, int]],
+    elapsed: float,
+) -> Dict[str, Any]:
+    def block(latencies: List[float], errs: int, status_counts: Dict[str, int]) -> Dict[str, Any]:
+        s = sorted(latencies)
+        return {
+            "requests": len(s),
+            "errors": errs,
+            "statuses": dict(sorted(status_counts.items())),
+            "rps": round(len(s) / elapsed, 1),
+            "mean_ms": round(sum(s) / len(s) * 1000, 3) if s else 0.0,
+            "p50_ms": round(percentile(s, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(s, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(s, 0.99) * 1000, 3),
+            "max_ms": round(s[-1] * 1000, 3) if s else 0.0,
+        }
+
+    out = {
+        name: block(lat, errors.get(name, 0), statuses[name])
+        for name, lat in sorted(samples.items())
+    }
+    totals: Dict[str, int] = {}
+    for counts in statuses.values():
+        for status, n in counts.items():
+            totals[status] = totals.get(status, 0) + n
+    out["total"] = block([x for lat in samples.values() for x in lat], sum(errors.values()), totals)
+    return out
+
+
+async def run_workload(client: httpx.AsyncClient, args, mix: Dict[str, float], movie_ids: List[int]):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+
+    samples: Dict[str, List[float]] = {n: [] for n in names}
+    errors: Dict[str, int] = {}
+    # 4xx is expected here (duplicate review, editing a review that doesn't exist)
+    statuses: Dict[str, Dict[str, int]] = {n: {} for n in names}
+    recording = False
+
+    async def worker(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        u = VirtualUser(index, f"bench{index % args.users}", movie_ids, rng)
+        await op_login(client, u)
+
+        while not stop.is_set():
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                resp = await OPERATIONS[name](client, u)
+                status = f"{resp.status_code // 100}xx"
+            except Exception:
+                status = "exception"
+            failed = status in ("5xx", "exception")
+            elapsed = time.perf_counter() - start
+
+            if recording:
+                samples[name].append(elapsed)
+                statuses[name][status] = statuses[name].get(status, 0) + 1
+                if failed:
+                    errors[name] = errors.get(name, 0) + 1
+
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(worker(i)) for i in range(args.concurrency)]
+
+    await asyncio.sleep(args.warmup)
+    recording = True
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    recording = False
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return summarize(samples, errors, statuses, elapsed)
+
+
+# --------------------- A/B SCENARIOS ---------------------
+async def timed_calls(call: Callable, n: int, concurrency: int) -> Dict[str, Any]:
+    """Await call(i) for i in range(n), `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - started
+    s = sorted(latencies)
+    return {
+        "calls": n,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "calls_per_second": round(n / elapsed, 1),
+        "mean_ms": round(sum(s) / len(s) * 1000, 3) if s else 0.0,
+        "p50_ms": round(percentile(s, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(s, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(s, 0.99) * 1000, 3),
+    }
+
+
+async def scenario_tmdb_client(client, args, movie_ids) -> Dict[str, Any]:
+    """
+    The old adding_movie opened a new httpx client per TMDb call; TMDbClient
+    keeps one pooled client for the process. Both sides hit a fake TMDb on a
+    real localhost socket, so each new client pays a TCP connect. That is a
+    lower bound: the real api.themoviedb.org adds DNS, TLS and a WAN round
+    trip on every new connection.
+    """
+    from tmdb import RequestBudget, TMDbClient
+
+    server, thread, base_url = start_uvicorn(fake_tmdb_app(args.tmdb_latency_ms))
+    # no rate limit and straight to .get(), so the cache / budget don't hide the client cost
+    unlimited = RequestBudget(rate=0)
+    pooled = TMDbClient(api_key="bench-key", base_url=base_url, budget=unlimited)
+
+    async def per_request_call(i: int):
+        one_off = TMDbClient(api_key="bench-key", base_url=base_url, budget=unlimited)
+        try:
+            await one_off.get(f"/movie/{TMDB_ID_BASE + i}")
+        finally:
+            await one_off.aclose()
+
+    async def pooled_call(i: int):
+        await pooled.get(f"/movie/{TMDB_ID_BASE + i}")
+
+    try:
+        return {
+            "per_request_client": await timed_calls(per_request_call, args.calls, args.concurrency),
+            "pooled_client": await timed_calls(pooled_call, args.calls, args.concurrency),
+        }
+    finally:
+        await pooled.aclose()
+        server.should_exit = True
+        thread.join()
+
+
+async def scenario_leaderboard(client, args, movie_ids) -> Dict[str, Any]:
+    """
+    Top 10 from the in-memory leaderboards against the SQL that would
+    otherwise compute them per request. The SQL scans and groups all of
+    reviews: Bayesian average for top rated, and this week's review count for
+    trending (a plain count, simpler than the decayed score it stands in for).
+    """
+    from sqlalchemy import text
+    from database import ReadSessionLocal
+    from leaderboard import Leaderboards
+
+    import main
+
+    # let the app's own startup rebuild finish so the two aren't timed together
+    deadline = time.monotonic() + 600
+    while not len(main.leaderboards.trending) and movie_ids and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    boards = Leaderboards()
+    started = time.perf_counter()
+    async with ReadSessionLocal() as db:
+        await boards.rebuild(db)
+    rebuild_seconds = time.perf_counter() - started
+
+    top_rated_sql = text("""
+        SELECT movie_id, (:c * :m + SUM(rating)) / (:c + COUNT(*)) AS score
+        FROM reviews
+        GROUP BY movie_id
+        ORDER BY score DESC
+        LIMIT 10;
+    """)
+    trending_sql = text("""
+        SELECT movie_id, COUNT(*) AS recent
+        FROM reviews
+        WHERE created_at >= :since
+        GROUP BY movie_id
+        ORDER BY recent DESC
+        LIMIT 10;
+    """)
+    top_params = {"c": boards.prior_weight, "m": boards.prior_mean}
+    since = (datetime.utcnow() - timedelta(days=7)).replace(microsecond=0)
+
+    def sql_call(sql, params):
+        async def call(i: int):
+            async with ReadSessionLocal() as db:
+                (await db.execute(sql, params)).all()
+        return call
+
+    async def memory_top_rated(i: int):
+        boards.top_rated_list(10)
+
+    async def memory_trending(i: int):
+        boards.trending_list(10)
+
+    # memory and SQL agree on top rated; trending differs only by the decay
+    async with ReadSessionLocal() as db:
+        sql_top = [row[0] for row in (await db.execute(top_rated_sql, top_params)).all()]
+    agrees = sql_top == [entry["movie_id"] for entry in boards.top_rated_list(10)]
+
+    return {
+        "rebuild_seconds": round(rebuild_seconds, 3),
+        "top_rated_matches_sql": agrees,
+        "top_rated_memory": await timed_calls(memory_top_rated, args.calls, args.concurrency),
+        "top_rated_sql": await timed_calls(sql_call(top_rated_sql, top_params), args.calls, args.concurrency),
+        "trending_memory": await timed_calls(memory_trending, args.calls, args.concurrency),
+        "trending_sql": await timed_calls(sql_call(trending_sql, {"since": since}), args.calls, args.concurrency),
+    }
+
+
+BATCH_IMPORT_MAX = 500  # schemas.MovieBatchImport
+
+
+async def scenario_import(client, args, movie_ids) -> Dict[str, Any]:
+    """
+    --calls movies added one POST /movies/{id} at a time against the same
+    number through POST /movies/batch. Each side gets its own ids, none of
+    them in the catalog yet, so every movie costs a (fake) TMDb fetch on
+    both. TMDb's request budget applies to both, as it would in production.
+    """
+    import main
+
+    u = VirtualUser(0, "bench0", movie_ids, random.Random(args.seed))
+    await op_login(client, u)
+    first_new = TMDB_ID_BASE + len(movie_ids)
+    one_at_a_time_ids = [first_new + i for i in range(args.calls)]
+    batch_ids = [first_new + args.calls + i for i in range(args.calls)]
+    added = {"one_at_a_time": 0, "batch": 0}
+
+    async def add_one(i: int):
+        resp = await client.post(f"/movies/{one_at_a_time_ids[i]}", headers=u.headers)
+        resp.raise_for_status()
+        added["one_at_a_time"] += 1
+
+    async def add_batch(i: int):
+        chunk = batch_ids[i * BATCH_IMPORT_MAX:(i + 1) * BATCH_IMPORT_MAX]
+        resp = await client.post("/movies/batch", json={"tmdb_ids": chunk}, headers=u.headers)
+        resp.raise_for_status()
+        added["batch"] += sum(result["status"] == "added" for result in resp.json())
+
+    one_at_a_time = await timed_calls(add_one, args.calls, 1)
+    batches = -(-args.calls // BATCH_IMPORT_MAX)
+    batch = await timed_calls(add_batch, batches, 1)
+    return {
+        "tmdb_rate_limit": main.app.state.tmdb.budget.rate,
+        "one_at_a_time": {**one_at_a_time, "movies_added": added["one_at_a_time"],
+                          "movies_per_second": round(added["one_at_a_time"] / one_at_a_time["seconds"], 1)},
+        "batch": {**batch, "movies_added": added["batch"],
+                  "movies_per_second": round(added["batch"] / batch["seconds"], 1)},
+    }
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "tmdb-client": scenario_tmdb_client,
+    "leaderboard": scenario_leaderboard,
+    "import": scenario_import,
+}
+
+
+def start_uvicorn(app):
+    import socket
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def wait_for_search_index(main, mix, timeout: float = 300.0):
+    # the index loads in the background at startup; don't time the DB fallback
+    if "search" not in mix or main.SEARCH_BACKEND != "memory":
+        return
+    deadline = time.monotonic() + timeout
+    while not main.search_index.ready and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def bench(args):
+    tmpdir = tempfile.mkdtemp(prefix="movie-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("TMDB_API_KEY", "bench-key")
+    # seeded movies have no refreshed_at; don't let the refresher re-fetch them mid-run
+    os.environ.setdefault("CATALOG_REFRESH", "false")
+    os.environ.setdefault("PROFILE_DIR", os.path.join(tmpdir, "profiles"))
+    os.environ.setdefault("POSTER_CACHE_DIR", os.path.join(tmpdir, "posters"))
+
+    # the app reads its configuration at import time
+    import main
+    from sqlalchemy import text
+    from database import engine
+    from migrations import migrate
+    from passwords import pwd_context
+    from tmdb import TMDbClient
+    from posters import PosterCache
+
+    migrate(engine)
+    t0 = time.perf_counter()
+    movie_ids = seed(args, engine, pwd_context.hash(BENCH_PASSWORD))
+    seed_seconds = time.perf_counter() - t0
+
+    global HOT_REVIEW_ID
+    with engine.connect() as conn:
+        HOT_REVIEW_ID = conn.execute(text("SELECT MIN(id) FROM reviews;")).scalar() or 0
+
+    mix = parse_mix(args.mix or PRESETS[args.preset])
+    if args.scenario:
+        scenario = SCENARIOS[args.scenario]
+        run = lambda client, args, mix, movie_ids: scenario(client, args, movie_ids)
+    else:
+        run = run_workload
+    fake_tmdb = lambda: TMDbClient(api_key="bench-key", transport=fake_tmdb_transport(args.tmdb_latency_ms))
+    fake_posters = lambda: PosterCache(transport=fake_image_transport(args.tmdb_latency_ms))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.server == "uvicorn":
+        server, thread, base_url = start_uvicorn(main.app)
+        main.app.state.tmdb = fake_tmdb()
+        main.app.state.posters = fake_posters()
+        await wait_for_search_index(main, mix)
+        try:
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                results = await run(client, args, mix, movie_ids)
+        finally:
+            server.should_exit = True
+            thread.join()
+    else:
+        async with main.app.router.lifespan_context(main.app):
+            main.app.state.tmdb = fake_tmdb()
+            main.app.state.posters = fake_posters()
+            await wait_for_search_index(main, mix)
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                results = await run(client, args, mix, movie_ids)
+
+    report = {
+        "commit": git_commit(),
+        "config": {**vars(args), "mix": mix, "database_url": os.environ["DATABASE_URL"]},
+        "seed_seconds": round(seed_seconds, 2),
+        "results": results,
+    }
+    if "poster" in mix:
+        report["poster_cache"] = main.app.state.posters.stats()
+    if "like" in mix:
+        # after shutdown's final flush the cached count has to match the rows
+        with engine.connect() as conn:
+            report["hot_review"] = {
+                "likes": conn.execute(
+                    text("SELECT likes FROM reviews WHERE id = :id;"), {"id": HOT_REVIEW_ID}
+                ).scalar(),
+                "review_likes_rows": conn.execute(
+                    text("SELECT COUNT(*) FROM review_likes WHERE review_id = :id;"), {"id": HOT_REVIEW_ID}
+                ).scalar(),
+            }
+    return report
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(bench(args))
+    text_report = json.dumps(report, indent=2)
+    print(text_report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text_report + "\n")
+    sys.exit(0)
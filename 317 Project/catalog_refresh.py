@@ -0,0 +1,326 @@
+"""
+Background TMDb refresh and prefetch for the movies catalog.
+
+Catalog rows are copied from TMDb once, when the first user adds the film,
+and that user waits on TMDb. CatalogRefresher, started from the app
+lifespan, works on both from the background:
+
+refresh:   every CATALOG_REFRESH_SECONDS it re-fetches up to
+           CATALOG_REFRESH_BATCH movies not checked for CATALOG_MAX_AGE_DAYS,
+           oldest first. Rows whose metadata changed are rewritten and get a
+           new updated_at (hashed into the movie-detail ETags); the rest only
+           get a new refreshed_at.
+prefetch:  every CATALOG_PREFETCH_SECONDS it reads TMDb's popular and
+           trending lists and queues the movies we don't have yet; each
+           refresh round inserts a batch of them, so adding one later is a
+           plain catalog hit.
+
+Its TMDb calls are background calls: they draw on the client's
+RequestBudget but never below TMDB_BACKGROUND_RESERVE, which stays free for
+user requests.
+
+Every worker with CATALOG_REFRESH on runs one. With several workers turn it
+on in only one of them, or run it as its own process:
+
+    python catalog_refresh.py           loop forever
+    python catalog_refresh.py --once    one prefetch + refresh round (cron)
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, List, Set
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import insert_ignore
+from genres import GenreIndex, parse_genres
+from tmdb import TMDbClient, TMDbError, movie_from_tmdb
+
+CATALOG_REFRESH = os.getenv("CATALOG_REFRESH", "true").lower() in ("1", "true", "yes")
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+CATALOG_REFRESH_BATCH = int(os.getenv("CATALOG_REFRESH_BATCH", "50"))
+CATALOG_MAX_AGE_DAYS = float(os.getenv("CATALOG_MAX_AGE_DAYS", "7"))
+CATALOG_PREFETCH_SECONDS = float(os.getenv("CATALOG_PREFETCH_SECONDS", "3600"))
+CATALOG_PREFETCH_LISTS = [
+    path.strip()
+    for path in os.getenv("CATALOG_PREFETCH_LISTS", "/movie/popular,/trending/movie/day").split(",")
+    if path.strip()
+]
+CATALOG_PREFETCH_PAGES = int(os.getenv("CATALOG_PREFETCH_PAGES", "2"))
+# TMDb fetches in flight at once; the request budget still sets the pace
+CATALOG_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", "4"))
+# stale_movies is counted up to this many
+STALE_COUNT_CAP = 10000
+
+MOVIE_FIELDS = ["title", "year", "poster_url", "overview", "genres"]
+
+
+def _utcnow() -> datetime:
+    # naive UTC, like the other timestamps we write
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def _age_seconds(value: Any, now: datetime) -> float:
+    if value is None:
+        return 0.0
+    dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (now - dt).total_seconds()
+
+
+class CatalogRefresher:
+    def __init__(self, genre_index: GenreIndex, interval: float = CATALOG_REFRESH_SECONDS):
+        self.genre_index = genre_index
+        self.interval = interval
+        self._prefetch: Deque[str] = deque()
+        self._queued: Set[str] = set()
+
+        self.stale_movies = 0
+        self.lag_seconds = 0.0
+        self.refreshed = 0
+        self.changed = 0
+        self.prefetched = 0
+        self.not_found = 0
+        self.errors = 0
+        self.last_round_seconds = 0.0
+
+    async def _fetch_all(self, tmdb: TMDbClient, external_ids: List[str]) -> List[Any]:
+        semaphore = asyncio.Semaphore(CATALOG_CONCURRENCY)
+
+        async def fetch(external_id: str):
+            async with semaphore:
+                return await tmdb.get_movie(external_id, language="en-US", background=True)
+
+        return await asyncio.gather(*(fetch(e) for e in external_ids), return_exceptions=True)
+
+    # --------------------- REFRESH ---------------------
+    async def refresh_batch(self, db: AsyncSession, tmdb: TMDbClient, limit: int = CATALOG_REFRESH_BATCH) -> int:
+        """Re-fetch the stalest movies; returns how many were checked."""
+        now = _utcnow()
+        cutoff = now - timedelta(days=CATALOG_MAX_AGE_DAYS)
+        columns = "id, external_id, title, year, poster_url, overview, genres, refreshed_at"
+
+        # two index range scans rather than one OR, which most planners can't order by
+        rows = list((await db.execute(
+            text(f"SELECT {columns} FROM movies WHERE refreshed_at IS NULL LIMIT :limit;"),
+            {"limit": limit},
+        )).mappings().all())
+        if len(rows) < limit:
+            rows += (await db.execute(
+                text(f"""
+                    SELECT {columns}
+                    FROM movies
+                    WHERE refreshed_at < :cutoff
+                    ORDER BY refreshed_at
+                    LIMIT :limit;
+                """),
+                {"cutoff": cutoff, "limit": limit - len(rows)},
+            )).mappings().all()
+
+        if len(rows) < limit:
+            self.stale_movies = len(rows)
+        else:
+            self.stale_movies = (await db.execute(
+                text("""
+                    SELECT COUNT(*) FROM (
+                        SELECT 1 FROM movies
+                        WHERE refreshed_at IS NULL OR refreshed_at < :cutoff
+                        LIMIT :cap
+                    ) stale;
+                """),
+                {"cutoff": cutoff, "cap": STALE_COUNT_CAP},
+            )).scalar()
+        oldest = [row["refreshed_at"] for row in rows if row["refreshed_at"] is not None]
+        self.lag_seconds = max(_age_seconds(oldest[0], cutoff), 0.0) if oldest else 0.0
+        if not rows:
+            return 0
+
+        fetched = await self._fetch_all(tmdb, [row["external_id"] for row in rows])
+        changed: List[Dict[str, Any]] = []
+        genres_changed: List[Dict[str, Any]] = []  # the changed movies whose genres changed
+        checked: List[int] = []
+        for row, result in zip(rows, fetched):
+            if isinstance(result, TMDbError) and result.status_code == 404:
+                # gone from TMDb: keep our copy, stop asking every round
+                self.not_found += 1
+                checked.append(row["id"])
+            elif isinstance(result, Exception):
+                # left stale, so the next round tries again
+                self.errors += 1
+                print("Catalog refresh error:", row["external_id"], result)
+            else:
+                movie = movie_from_tmdb(row["external_id"], result)
+                if any(movie[field] != row[field] for field in MOVIE_FIELDS):
+                    changed.append({**movie, "id": row["id"]})
+                    if movie["genres"] != row["genres"]:
+                        genres_changed.append(changed[-1])
+                else:
+                    checked.append(row["id"])
+
+        new_genres: Dict[str, int] = {}
+        if changed:
+            await db.execute(
+                text(f"""
+                    UPDATE movies
+                    SET {", ".join(f"{field} = :{field}" for field in MOVIE_FIELDS)},
+                        refreshed_at = :now,
+                        updated_at = :now
+                    WHERE id = :id;
+                """),
+                [{**movie, "now": now} for movie in changed],
+            )
+        if genres_changed:
+            # link() only adds; genres TMDb dropped have to go first
+            await db.execute(
+                text("DELETE FROM movie_genres WHERE movie_id IN :ids;").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": [movie["id"] for movie in genres_changed]},
+            )
+            new_genres = await self.genre_index.link(db, genres_changed)
+        if checked:
+            await db.execute(
+                text("UPDATE movies SET refreshed_at = :now WHERE id IN :ids;").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"now": now, "ids": checked},
+            )
+        await db.commit()
+        self.genre_index.remember(new_genres)
+        ids_by_name = self.genre_index.ids_by_name
+        for movie in genres_changed:
+            names = [name.lower() for name in parse_genres(movie["genres"])]
+            self.genre_index.set_genres(movie["id"], [ids_by_name[n] for n in names if n in ids_by_name])
+
+        self.refreshed += len(changed) + len(checked)
+        self.changed += len(changed)
+        return len(changed) + len(checked)
+
+    # --------------------- PREFETCH ---------------------
+    async def discover(self, db: AsyncSession, tmdb: TMDbClient) -> int:
+        """Queue popular / trending movies that aren't in the catalog yet."""
+        found: List[str] = []
+        for path in CATALOG_PREFETCH_LISTS:
+            for page in range(1, CATALOG_PREFETCH_PAGES + 1):
+                data = await tmdb.get(path, {"page": page}, background=True)
+                found += [str(item["id"]) for item in data.get("results") or [] if item.get("id")]
+                if page >= (data.get("total_pages") or 1):
+                    break
+
+        found = [e for e in dict.fromkeys(found) if e not in self._queued]
+        if not found:
+            return 0
+        known_sql = text("SELECT external_id FROM movies WHERE external_id IN :external_ids;").bindparams(
+            bindparam("external_ids", expanding=True)
+        )
+        known = set((await db.execute(known_sql, {"external_ids": found})).scalars())
+        missing = [e for e in found if e not in known]
+        self._prefetch.extend(missing)
+        self._queued.update(missing)
+        return len(missing)
+
+    async def prefetch_batch(self, db: AsyncSession, tmdb: TMDbClient, limit: int = CATALOG_REFRESH_BATCH) -> int:
+        """Insert up to `limit` queued movies; returns how many were added."""
+        external_ids = [self._prefetch.popleft() for _ in range(min(limit, len(self._prefetch)))]
+        if not external_ids:
+            return 0
+        self._queued.difference_update(external_ids)
+
+        now = _utcnow()
+        movies = []
+        for external_id, result in zip(external_ids, await self._fetch_all(tmdb, external_ids)):
+            if isinstance(result, TMDbError) and result.status_code == 404:
+                self.not_found += 1
+            elif isinstance(result, Exception):
+                self.errors += 1
+                print("Catalog prefetch error:", external_id, result)
+            else:
+                movies.append({**movie_from_tmdb(external_id, result), "refreshed_at": now})
+        if not movies:
+            return 0
+
+        # a user may have added one meanwhile; theirs wins
+        await db.execute(
+            text(insert_ignore(db, """
+                movies (external_id, title, year, poster_url, overview, genres, refreshed_at)
+                VALUES (:external_id, :title, :year, :poster_url, :overview, :genres, :refreshed_at)
+            """)),
+            movies,
+        )
+        ids_sql = text("SELECT id, external_id FROM movies WHERE external_id IN :external_ids;").bindparams(
+            bindparam("external_ids", expanding=True)
+        )
+        rows = (await db.execute(ids_sql, {"external_ids": [m["external_id"] for m in movies]})).all()
+        ids = {external_id: movie_id for movie_id, external_id in rows}
+        new_genres = await self.genre_index.link(db, [
+            {**movie, "id": ids[movie["external_id"]]} for movie in movies if movie["external_id"] in ids
+        ])
+        await db.commit()
+        self.genre_index.remember(new_genres)
+
+        self.prefetched += len(movies)
+        return len(movies)
+
+    # --------------------- LOOP ---------------------
+    async def run_once(self, session_factory, tmdb: TMDbClient, discover: bool = True):
+        start = time.perf_counter()
+        async with session_factory() as db:
+            if discover:
+                await self.discover(db, tmdb)
+            await self.prefetch_batch(db, tmdb)
+            await self.refresh_batch(db, tmdb)
+        self.last_round_seconds = time.perf_counter() - start
+
+    async def run(self, session_factory, tmdb: TMDbClient):
+        # started from the app lifespan; new movies reach the search and genre
+        # indexes through their own catch-up loops
+        next_discover = 0.0
+        while True:
+            discover = time.monotonic() >= next_discover
+            if discover:
+                next_discover = time.monotonic() + CATALOG_PREFETCH_SECONDS
+            try:
+                await self.run_once(session_factory, tmdb, discover)
+            except Exception as e:
+                self.errors += 1
+                print("Catalog refresh error:", e)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stale_movies": self.stale_movies,
+            "prefetch_queue": len(self._prefetch),
+            "lag_seconds": round(self.lag_seconds, 1),
+            "refreshed": self.refreshed,
+            "changed": self.changed,
+            "prefetched": self.prefetched,
+            "not_found": self.not_found,
+            "errors": self.errors,
+            "last_round_ms": round(self.last_round_seconds * 1000, 3),
+        }
+
+
+async def _main(once: bool):
+    from database import AsyncSessionLocal
+
+    tmdb = TMDbClient()
+    if not tmdb.configured:
+        sys.exit("TMDB_API_KEY is not set")
+    refresher = CatalogRefresher(GenreIndex())
+    try:
+        if once:
+            await refresher.run_once(AsyncSessionLocal, tmdb)
+            print(refresher.stats())
+        else:
+            await refresher.run(AsyncSessionLocal, tmdb)
+    finally:
+        await tmdb.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main("--once" in sys.argv))
@@ -0,0 +1,43 @@
+"""
+Strong ETags and If-None-Match for the read endpoints.
+
+Tags are hashed from cheap version markers (the movie_stats.version /
+review_count pair, the cached profile dict), never from the response body,
+so a matching request is answered with 304 before any rows are loaded or
+any schema is built. Version markers must be read before the data they
+describe: a write landing in between then yields an older tag on newer
+data, which only costs the client one extra 200 later.
+"""
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+# per-user data: browsers may keep it but must revalidate every time
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def matches(request: Request, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 asks for GETs)."""
+    header: Optional[str] = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # "*" is left to fall through to a 200: it is for conditional writes
+    candidates = (tag.strip() for tag in header.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
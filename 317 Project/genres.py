@@ -0,0 +1,304 @@
+"""
+Normalized genres: the genres / movie_genres tables and an in-memory genre
+bitmap for multi-genre filtering.
+
+movies.genres stays as the display string TMDb gave us ("Drama, Comedy");
+filtering goes through movie_genres, which has an index per direction.
+
+GenreIndex keeps one 64-bit genre mask per movie, in movie id order, plus the
+same bits transposed: one Python int per genre whose bit n is set when the
+movie in slot n has that genre. "Horror AND Comedy" is then a single AND of
+two big ints, newest movies first, with no SQL at all. It's rebuilt from the
+database at startup and catches up on new movies every
+GENRE_INDEX_REFRESH_SECONDS.
+"""
+import asyncio
+import bisect
+import os
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Base, insert_ignore
+import models
+
+GENRE_INDEX_REFRESH_SECONDS = float(os.getenv("GENRE_INDEX_REFRESH_SECONDS", "30"))
+# catch-up only reads ids above the newest one seen; a full rebuild also
+# picks up rows that committed out of id order
+GENRE_INDEX_REBUILD_SECONDS = float(os.getenv("GENRE_INDEX_REBUILD_SECONDS", "3600"))
+MASK_BITS = 64
+
+
+def parse_genres(value: Optional[str]) -> List[str]:
+    """ "Drama, Comedy" -> ["Drama", "Comedy"] (order kept, duplicates dropped)"""
+    if not value:
+        return []
+    names = (name.strip() for name in value.split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+class GenreIndex:
+    def __init__(self):
+        self.ids_by_name: Dict[str, int] = {}  # lowercased name -> genre id
+        self._bit: Dict[int, int] = {}         # genre id -> bit in the masks
+
+        self._movie_ids = array("i")  # slot -> movie id, ascending
+        self._years = array("h")      # slot -> release year, 0 if unknown
+        self._masks = array("Q")      # slot -> genre bits
+        self._bitsets: Dict[int, int] = {}  # bit -> int with bit `slot` set per movie
+
+        self.max_movie_id = 0
+        self.ready = False
+
+    # --------------------- GENRE IDS ---------------------
+    async def _load_names(self, db: AsyncSession):
+        rows = (await db.execute(text("SELECT id, name FROM genres;"))).all()
+        self.ids_by_name = {name.lower(): genre_id for genre_id, name in rows}
+
+    async def resolve(self, db: AsyncSession, names: List[str]) -> List[int]:
+        """Genre ids for `names` (case-insensitive); 400 if one doesn't exist."""
+        if any(name.lower() not in self.ids_by_name for name in names):
+            await self._load_names(db)
+
+        ids = []
+        for name in names:
+            genre_id = self.ids_by_name.get(name.lower())
+            if genre_id is None:
+                raise HTTPException(status_code=400, detail=f"Unknown genre: {name}")
+            ids.append(genre_id)
+        return ids
+
+    async def link(self, db: AsyncSession, movies: Iterable[Mapping[str, Any]]) -> Dict[str, int]:
+        """
+        Write movie_genres rows for new catalog movies (each needs id and the
+        genres string), creating genre rows the first time a name shows up.
+        Runs in the caller's transaction; safe to repeat.
+
+        Ids of genres created (or first seen) here are returned rather than
+        cached: the transaction may still roll back. Pass them to remember()
+        once it has committed.
+        """
+        pairs = [(movie["id"], name) for movie in movies for name in parse_genres(movie.get("genres"))]
+        if not pairs:
+            return {}
+
+        ids_by_name = self.ids_by_name
+        new_names = list(dict.fromkeys(n for _, n in pairs if n.lower() not in ids_by_name))
+        if new_names:
+            await db.execute(
+                text(insert_ignore(db, "genres (name) VALUES (:name)")),
+                [{"name": name} for name in new_names],
+            )
+            rows = (await db.execute(text("SELECT id, name FROM genres;"))).all()
+            ids_by_name = {name.lower(): genre_id for genre_id, name in rows}
+
+        await db.execute(
+            text(insert_ignore(db, "movie_genres (movie_id, genre_id) VALUES (:movie_id, :genre_id)")),
+            [
+                {"movie_id": movie_id, "genre_id": ids_by_name[name.lower()]}
+                for movie_id, name in dict.fromkeys(pairs)
+            ],
+        )
+        return {name.lower(): ids_by_name[name.lower()] for name in new_names}
+
+    def remember(self, ids_by_name: Mapping[str, int]):
+        """Cache genre ids returned by link(), after its transaction committed."""
+        self.ids_by_name = {**self.ids_by_name, **ids_by_name}
+
+    # --------------------- BITMAP ---------------------
+    def _append(self, movies: List[Tuple[int, int, List[int]]]):
+        """Add (movie_id, year, genre_ids) rows; ids must be above max_movie_id."""
+        start = len(self._movie_ids)
+        n = len(movies)
+        # the new slots' bits, one bytearray per genre, shifted into place at the end
+        chunks: Dict[int, bytearray] = {}
+        for i, (movie_id, year, genre_ids) in enumerate(movies):
+            mask = 0
+            for genre_id in genre_ids:
+                bit = self._bit.get(genre_id)
+                if bit is None:
+                    if len(self._bit) >= MASK_BITS:
+                        continue  # no room; queries on this genre go to SQL
+                    bit = self._bit[genre_id] = len(self._bit)
+                mask |= 1 << bit
+                chunk = chunks.get(bit)
+                if chunk is None:
+                    chunk = chunks[bit] = bytearray((n + 7) // 8)
+                chunk[i >> 3] |= 1 << (i & 7)
+            self._movie_ids.append(movie_id)
+            self._years.append(year or 0)
+            self._masks.append(mask)
+
+        for bit, chunk in chunks.items():
+            self._bitsets[bit] = self._bitsets.get(bit, 0) | (int.from_bytes(chunk, "little") << start)
+        if movies:
+            self.max_movie_id = movies[-1][0]
+
+    def set_genres(self, movie_id: int, genre_ids: List[int]):
+        """Replace the genres of a movie already in the index (e.g. after a TMDb refresh)."""
+        slot = bisect.bisect_left(self._movie_ids, movie_id)
+        if slot == len(self._movie_ids) or self._movie_ids[slot] != movie_id:
+            return  # not loaded yet; the catch-up reads its current rows
+        mask = 0
+        for genre_id in genre_ids:
+            bit = self._bit.get(genre_id)
+            if bit is None:
+                if len(self._bit) >= MASK_BITS:
+                    continue
+                bit = self._bit[genre_id] = len(self._bit)
+            mask |= 1 << bit
+        old = self._masks[slot]
+        for bit in range(MASK_BITS):
+            if (old ^ mask) >> bit & 1:
+                self._bitsets[bit] = self._bitsets.get(bit, 0) ^ (1 << slot)
+        self._masks[slot] = mask
+
+    def covers(self, genre_ids: List[int]) -> bool:
+        return self.ready and all(g in self._bit for g in genre_ids)
+
+    def genres_of(self, movie_id: int) -> List[int]:
+        slot = bisect.bisect_left(self._movie_ids, movie_id)
+        if slot == len(self._movie_ids) or self._movie_ids[slot] != movie_id:
+            return []
+        mask = self._masks[slot]
+        return [genre_id for genre_id, bit in self._bit.items() if mask >> bit & 1]
+
+    def movies_with_all(
+        self,
+        genre_ids: List[int],
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> List[int]:
+        """Ids of movies having every genre in `genre_ids`, highest id first."""
+        end = len(self._movie_ids)
+        if before_id is not None:
+            end = bisect.bisect_left(self._movie_ids, before_id)
+
+        matched = (1 << end) - 1
+        for genre_id in genre_ids:
+            matched &= self._bitsets.get(self._bit[genre_id], 0)
+        if not matched:
+            return []
+
+        # walk 64-bit words from the top; empty words cost one comparison
+        words = array("Q")
+        words.frombytes(matched.to_bytes((end + 63) // 64 * 8, "little"))
+        years = self._years
+        out = []
+        for w in range(len(words) - 1, -1, -1):
+            word = words[w]
+            while word:
+                b = word.bit_length() - 1
+                word ^= 1 << b
+                slot = w * 64 + b
+                year = years[slot]
+                if year_from is not None and (not year or year < year_from):
+                    continue
+                if year_to is not None and (not year or year > year_to):
+                    continue
+                out.append(self._movie_ids[slot])
+                if len(out) == limit:
+                    return out
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "movies": len(self._movie_ids),
+            "genres": len(self._bit),
+            "bytes": (
+                self._movie_ids.itemsize * len(self._movie_ids)
+                + self._years.itemsize * len(self._years)
+                + self._masks.itemsize * len(self._masks)
+                + sum((b.bit_length() + 7) // 8 for b in self._bitsets.values())
+            ),
+            "ready": self.ready,
+        }
+
+    # --------------------- LOADING ---------------------
+    async def load_since(self, db: AsyncSession, after_id: int = 0) -> int:
+        sql = text("""
+            SELECT m.id, m.year, mg.genre_id
+            FROM movies m
+            LEFT JOIN movie_genres mg ON mg.movie_id = m.id
+            WHERE m.id > :after_id
+            ORDER BY m.id;
+        """)
+        result = await db.stream(sql, {"after_id": after_id})
+
+        # one entry per movie; its rows arrive next to each other
+        movies: List[Tuple[int, int, List[int]]] = []
+        async for rows in result.partitions(5000):
+            for movie_id, year, genre_id in rows:
+                if not movies or movies[-1][0] != movie_id:
+                    movies.append((movie_id, year, []))
+                if genre_id is not None:
+                    movies[-1][2].append(genre_id)
+            # the last movie may continue in the next partition
+            done, movies = movies[:-1], movies[-1:]
+            self._append(done)
+            await asyncio.sleep(0)
+        self._append(movies)
+        return len(self._movie_ids)
+
+    async def rebuild(self, db: AsyncSession):
+        fresh = GenreIndex()
+        await fresh._load_names(db)
+        await fresh.load_since(db)
+        fresh.ready = True
+        # swap everything at once so queries never see a half-built index
+        self.__dict__.update(fresh.__dict__)
+
+    async def run(self, session_factory, interval: float = GENRE_INDEX_REFRESH_SECONDS):
+        # started from the app lifespan
+        last_rebuild: Optional[float] = None
+        while True:
+            try:
+                async with session_factory() as db:
+                    if last_rebuild is None or time.monotonic() - last_rebuild >= GENRE_INDEX_REBUILD_SECONDS:
+                        start = time.perf_counter()
+                        await self.rebuild(db)
+                        last_rebuild = time.monotonic()
+                        print(
+                            f"Genre index rebuilt: {len(self._movie_ids)} movies, "
+                            f"{len(self._bit)} genres in {time.perf_counter() - start:.1f}s"
+                        )
+                    else:
+                        await self.load_since(db, self.max_movie_id)
+            except Exception as e:
+                print("Genre index refresh error:", e)
+            await asyncio.sleep(interval)
+
+
+# --------------------- BACKFILL ---------------------
+def backfill_genres(engine):
+    """Migration 5: genres / movie_genres from the existing movies.genres strings."""
+    Base.metadata.create_all(bind=engine, tables=[models.Genre.__table__, models.MovieGenre.__table__])
+
+    with engine.begin() as conn:
+        rows = conn.execute(text("SELECT id, genres FROM movies WHERE genres IS NOT NULL;")).all()
+        pairs = [(movie_id, name) for movie_id, value in rows for name in parse_genres(value)]
+
+        ids = {name.lower(): genre_id for genre_id, name in conn.execute(text("SELECT id, name FROM genres;"))}
+        new_names = list(dict.fromkeys(n for _, n in pairs if n.lower() not in ids))
+        # case variants of one name ("Sci-Fi" / "sci-fi") share a row
+        new_names = list({n.lower(): n for n in reversed(new_names)}.values())
+        if new_names:
+            conn.execute(text("INSERT INTO genres (name) VALUES (:name);"), [{"name": n} for n in new_names])
+            ids = {name.lower(): genre_id for genre_id, name in conn.execute(text("SELECT id, name FROM genres;"))}
+
+        existing = {tuple(row) for row in conn.execute(text("SELECT movie_id, genre_id FROM movie_genres;"))}
+        links = list(dict.fromkeys((movie_id, ids[name.lower()]) for movie_id, name in pairs))
+        links = [pair for pair in links if pair not in existing]
+        if links:
+            conn.execute(
+                text("INSERT INTO movie_genres (movie_id, genre_id) VALUES (:movie_id, :genre_id);"),
+                [{"movie_id": m, "genre_id": g} for m, g in links],
+            )
+
+    print(f"  {len(ids)} genres, {len(links)} movie/genre links backfilled from {len(rows)} movies")
@@ -0,0 +1,228 @@
+"""
+In-memory "top rated" and "trending" leaderboards.
+
+Both are kept as sorted lists of (-score, movie_id) and updated in place on
+every review write, so reading the top N is just a slice.
+
+top rated: Bayesian average (C * m + sum) / (C + n), where m is the global
+           mean rating taken at rebuild time and C is LEADERBOARD_PRIOR_WEIGHT.
+trending:  exponentially decayed review count. Each review adds
+           exp(lambda * (t - t0)) with a fixed t0, which ranks the same as
+           exp(-lambda * (now - t)) but never has to be recomputed as time
+           passes.
+"""
+import asyncio
+import bisect
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+LEADERBOARD_PRIOR_WEIGHT = float(os.getenv("LEADERBOARD_PRIOR_WEIGHT", "10"))
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "84"))  # 3.5 days
+TRENDING_WINDOW_DAYS = float(os.getenv("TRENDING_WINDOW_DAYS", "14"))
+# rebuilding also picks up writes made by other workers
+LEADERBOARD_REBUILD_SECONDS = float(os.getenv("LEADERBOARD_REBUILD_SECONDS", "300"))
+LEADERBOARD_STREAM_ROWS = 10000
+DEFAULT_PRIOR_MEAN = 5.0
+
+
+class RankedList:
+    """Scores keyed by movie id, kept sorted high to low."""
+
+    def __init__(self):
+        self._scores: Dict[int, float] = {}
+        self._sorted: List[Tuple[float, int]] = []
+
+    def set(self, movie_id: int, score: Optional[float]):
+        old = self._scores.pop(movie_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self._sorted, (-old, movie_id))
+            del self._sorted[i]
+
+        if score is not None:
+            self._scores[movie_id] = score
+            bisect.insort(self._sorted, (-score, movie_id))
+
+    def get(self, movie_id: int) -> Optional[float]:
+        return self._scores.get(movie_id)
+
+    def top(self, n: int) -> List[Tuple[int, float]]:
+        return [(movie_id, -neg) for neg, movie_id in self._sorted[:n]]
+
+    def load(self, scores: Dict[int, float]):
+        self._scores = dict(scores)
+        self._sorted = sorted((-score, movie_id) for movie_id, score in scores.items())
+
+    def __len__(self):
+        return len(self._sorted)
+
+
+_UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def _timestamp(value: Any) -> float:
+    if value is None:
+        return time.time()
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value))
+    if dt.tzinfo is None:
+        # stored values are naive UTC; subtracting skips a tz-aware copy per row
+        return (dt - _UNIX_EPOCH).total_seconds()
+    return dt.timestamp()
+
+
+class Leaderboards:
+    def __init__(
+        self,
+        prior_weight: float = LEADERBOARD_PRIOR_WEIGHT,
+        half_life_hours: float = TRENDING_HALF_LIFE_HOURS,
+    ):
+        self.prior_weight = prior_weight
+        self.prior_mean = DEFAULT_PRIOR_MEAN
+        self.decay = math.log(2) / (half_life_hours * 3600)
+        self.epoch = time.time()
+        # reviews older than this were never added to trending
+        self.window_start = self.epoch - TRENDING_WINDOW_DAYS * 86400
+        self._replay: Optional[List[Tuple[int, Optional[float], Optional[float], Any]]] = None  # writes during a rebuild
+
+        # movie_id -> [review_count, rating_sum]
+        self._totals: Dict[int, List[float]] = {}
+        self.top_rated = RankedList()
+        self.trending = RankedList()
+
+    # --------------------- SCORES ---------------------
+    def bayesian(self, count: float, total: float) -> Optional[float]:
+        if count <= 0:
+            return None
+        return (self.prior_weight * self.prior_mean + total) / (self.prior_weight + count)
+
+    def _weight(self, ts: float) -> float:
+        return math.exp(self.decay * (ts - self.epoch))
+
+    def trending_score(self, raw: float) -> float:
+        # back to "decayed reviews as of now", for display only
+        return raw / self._weight(time.time())
+
+    # --------------------- INCREMENTAL UPDATES ---------------------
+    def record(
+        self,
+        movie_id: int,
+        removed: Optional[float] = None,
+        added: Optional[float] = None,
+        created_at: Any = None,
+    ):
+        """
+        Same arguments as stats.apply_rating_change; created_at is the
+        review's timestamp, used to take it back out of trending on delete.
+        """
+        if self._replay is not None:
+            self._replay.append((movie_id, removed, added, created_at))
+        totals = self._totals.setdefault(movie_id, [0, 0.0])
+        totals[0] += (added is not None) - (removed is not None)
+        totals[1] += (added or 0) - (removed or 0)
+
+        if totals[0] <= 0:
+            del self._totals[movie_id]
+            self.top_rated.set(movie_id, None)
+        else:
+            self.top_rated.set(movie_id, self.bayesian(*totals))
+
+        # a rating edit doesn't change review velocity
+        if (added is None) != (removed is None):
+            ts = _timestamp(created_at)
+            if added is None and ts < self.window_start:
+                return
+            weight = self._weight(ts)
+            raw = (self.trending.get(movie_id) or 0) + (weight if added is not None else -weight)
+            self.trending.set(movie_id, raw if raw > 1e-12 else None)
+
+    # --------------------- REBUILD ---------------------
+    async def rebuild(self, db: AsyncSession):
+        fresh = Leaderboards(self.prior_weight)
+        fresh.decay = self.decay
+        replay = self._replay = []
+        try:
+            await fresh._load(db)
+            # reviews this worker wrote meanwhile may have missed the scan
+            for args in replay:
+                fresh.record(*args)
+        finally:
+            self._replay = None
+        # swap everything at once so reads never see a half-built board
+        self.__dict__.update(fresh.__dict__)
+
+        print(f"Leaderboards rebuilt: {len(self.top_rated)} rated, {len(self.trending)} trending")
+
+    async def _load(self, db: AsyncSession):
+        self.epoch = time.time()
+        self.window_start = self.epoch - TRENDING_WINDOW_DAYS * 86400
+
+        totals_sql = text("""
+            SELECT movie_id, review_count, rating_sum
+            FROM movie_stats
+            WHERE review_count > 0;
+        """)
+        rows = (await db.execute(totals_sql)).all()
+
+        self._totals = {movie_id: [count, total] for movie_id, count, total in rows}
+        all_count = sum(count for count, _ in self._totals.values())
+        all_sum = sum(total for _, total in self._totals.values())
+        self.prior_mean = (all_sum / all_count) if all_count else DEFAULT_PRIOR_MEAN
+
+        self.top_rated.load({
+            movie_id: self.bayesian(count, total)
+            for movie_id, (count, total) in self._totals.items()
+        })
+
+        # naive UTC, like the stored created_at values
+        since = datetime.fromtimestamp(
+            self.window_start, tz=timezone.utc
+        ).replace(tzinfo=None, microsecond=0)
+        recent_sql = text("""
+            SELECT movie_id, created_at
+            FROM reviews
+            WHERE created_at >= :since;
+        """)
+        trending: Dict[int, float] = {}
+        result = await db.stream(recent_sql, {"since": since})
+        # a partition per await: row by row, the async hop costs more than the sum
+        async for rows in result.partitions(LEADERBOARD_STREAM_ROWS):
+            for movie_id, created_at in rows:
+                trending[movie_id] = trending.get(movie_id, 0) + self._weight(_timestamp(created_at))
+        self.trending.load(trending)
+
+    async def run(self, session_factory, interval: float = LEADERBOARD_REBUILD_SECONDS):
+        # started from the app lifespan; rebuilds now and then every `interval` seconds
+        while True:
+            try:
+                async with session_factory() as db:
+                    await self.rebuild(db)
+            except Exception as e:
+                print("Leaderboard rebuild error:", e)
+            await asyncio.sleep(interval)
+
+    # --------------------- READS ---------------------
+    def top_rated_list(self, n: int) -> List[Dict[str, Any]]:
+        out = []
+        for movie_id, score in self.top_rated.top(n):
+            count, total = self._totals[movie_id]
+            out.append({
+                "movie_id": movie_id,
+                "score": score,
+                "review_count": count,
+                "average_rating": total / count,
+            })
+        return out
+
+    def trending_list(self, n: int) -> List[Dict[str, Any]]:
+        return [
+            {"movie_id": movie_id, "score": self.trending_score(raw)}
+            for movie_id, raw in self.trending.top(n)
+        ]
@@ -0,0 +1,158 @@
+"""
+Review likes without a hot row.
+
+review_likes (one row per user and review) is the source of truth, and
+liking or unliking only touches the caller's own row in it. reviews.likes
+is a cached count that LikeBuffer brings up to date every
+LIKE_FLUSH_SECONDS. The buffer collects the ids of reviews that changed and
+recounts each one from review_likes in a single UPDATE per batch, so a
+review getting thousands of likes a second takes one write per flush
+instead of one locked `likes = likes + 1` per like.
+
+Flushes set absolute counts rather than adding deltas, so they are
+idempotent and several workers can flush the same review without double
+counting. Each flush also bumps movie_stats.version for the reviews'
+movies, since the counts show up in their (ETagged) review lists. A crash
+only loses the list of changed reviews. reconcile() recounts every review
+whose cache disagrees with review_likes. That scans all of reviews, so it
+is run by hand after a crash:
+
+    python likes.py --reconcile
+
+or at startup, in the background, with LIKE_RECONCILE_ON_STARTUP=true.
+
+LIKE_FLUSH_SECONDS=0 switches buffering off and writes likes = likes + 1
+in the request's transaction. That is the baseline for
+`python bench.py --preset likes`, where every virtual user likes one review.
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+LIKE_FLUSH_SECONDS = float(os.getenv("LIKE_FLUSH_SECONDS", "1"))
+LIKE_FLUSH_BATCH = int(os.getenv("LIKE_FLUSH_BATCH", "500"))
+LIKE_RECONCILE_ON_STARTUP = os.getenv("LIKE_RECONCILE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+RECOUNT_SQL = text("""
+    UPDATE reviews
+    SET likes = (SELECT COUNT(*) FROM review_likes rl WHERE rl.review_id = reviews.id)
+    WHERE id IN :ids;
+""").bindparams(bindparam("ids", expanding=True))
+
+BUMP_VERSIONS_SQL = text("""
+    UPDATE movie_stats
+    SET version = version + 1
+    WHERE movie_id IN (SELECT movie_id FROM reviews WHERE id IN :ids);
+""").bindparams(bindparam("ids", expanding=True))
+
+DRIFTED_SQL = text("""
+    SELECT id
+    FROM reviews
+    WHERE likes <> (SELECT COUNT(*) FROM review_likes rl WHERE rl.review_id = reviews.id);
+""")
+
+
+class LikeBuffer:
+    def __init__(self, interval: float = LIKE_FLUSH_SECONDS):
+        self.interval = interval
+        # review id -> net likes since the last flush (for responses only;
+        # the flush recounts from review_likes)
+        self._pending: Dict[int, int] = {}
+
+        self.recorded = 0
+        self.flushes = 0
+        self.flushed_reviews = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def record(self, review_id: int, delta: int):
+        # call after the review_likes change has committed
+        self._pending[review_id] = self._pending.get(review_id, 0) + delta
+        self.recorded += 1
+
+    def pending(self, review_id: int) -> int:
+        return self._pending.get(review_id, 0)
+
+    async def flush(self, db: AsyncSession) -> int:
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        ids = list(pending)
+        start = time.perf_counter()
+        try:
+            for i in range(0, len(ids), LIKE_FLUSH_BATCH):
+                batch = {"ids": ids[i:i + LIKE_FLUSH_BATCH]}
+                await db.execute(RECOUNT_SQL, batch)
+                await db.execute(BUMP_VERSIONS_SQL, batch)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            # keep them for the next round, merged with anything newer
+            for review_id, delta in pending.items():
+                self._pending[review_id] = self._pending.get(review_id, 0) + delta
+            self.flush_errors += 1
+            raise
+
+        self.flushes += 1
+        self.flushed_reviews += len(ids)
+        self.last_flush_seconds = time.perf_counter() - start
+        return len(ids)
+
+    async def run(self, session_factory):
+        # started from the app lifespan; the lifespan flushes once more on shutdown
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with session_factory() as db:
+                    await self.flush(db)
+            except Exception as e:
+                print("Like flush error:", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_reviews": len(self._pending),
+            "recorded": self.recorded,
+            "flushes": self.flushes,
+            "flushed_reviews": self.flushed_reviews,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 3),
+        }
+
+
+async def reconcile_in_background(engine):
+    # startup: don't hold up the first requests for a full recount
+    try:
+        await asyncio.to_thread(reconcile, engine)
+    except Exception as e:
+        print("Like reconcile error:", e)
+
+
+def reconcile(engine) -> int:
+    """Recount every review whose cached likes disagree with review_likes."""
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        ids = [review_id for review_id, in conn.execute(DRIFTED_SQL)]
+        for i in range(0, len(ids), LIKE_FLUSH_BATCH):
+            batch = {"ids": ids[i:i + LIKE_FLUSH_BATCH]}
+            conn.execute(RECOUNT_SQL, batch)
+            conn.execute(BUMP_VERSIONS_SQL, batch)
+    print(f"Like counts reconciled: {len(ids)} reviews fixed in {time.perf_counter() - start:.1f}s")
+    return len(ids)
+
+
+if __name__ == "__main__":
+    if "--reconcile" in sys.argv:
+        from database import engine
+        reconcile(engine)
+    else:
+        print(__doc__)
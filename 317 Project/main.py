@@ -1,10 +1,11 @@
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from fastapi import Depends
-from sqlalchemy.orm import Session
 from sqlalchemy import text
 import os
-import httpx
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -16,26 +17,108 @@ from fastapi import (
     HTTPException,
     status,
     Request,
+    Response,
     Query,
 )
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, bindparam, Integer, Float, Text
+from sqlalchemy.exc import IntegrityError
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from dotenv import load_dotenv  
 
-from database import Base, engine, get_db
+from database import (
+    engine,
+    get_async_db,
+    get_read_db,
+    AsyncSessionLocal,
+    ReadSessionLocal,
+    async_engine,
+    replica_engines,
+    sqlite_reader_engine,
+    use_primary,
+    note_write,
+    wrote_recently,
+    pool_stats,
+    TIMESTAMP,
+    for_update,
+    insert_ignore,
+    insert_returning_id,
+    is_unique_violation,
+    supports_returning,
+)
 import schemas
 import models  
+from tmdb import TMDbClient, TMDbError, movie_from_tmdb
+from auth_cache import PrincipalCache
+from passwords import PasswordHasher
+from pagination import encode_cursor, decode_cursor, keyset_condition, KEYSET_CONDITION
+from export import export_table, EXPORT_COLUMNS, EXPORT_MEDIA_TYPES
+from stats import apply_rating_change, check_movie_stats, stats_to_read, STATS_COLUMNS
+from leaderboard import Leaderboards
+from search import SearchIndex, SEARCH_BACKEND, search_database
+from genres import GenreIndex, parse_genres
+from likes import LikeBuffer, LIKE_RECONCILE_ON_STARTUP, BUMP_VERSIONS_SQL, reconcile_in_background
+import etags
+from catalog_refresh import CatalogRefresher, CATALOG_REFRESH
+from posters import PosterCache, media_type
+import metrics
+from profiling import SamplingProfiler
 
 load_dotenv()
 
 
-app = FastAPI(title="Movie Review API with JWT + TMDb")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        from migrations import migrate
+        await asyncio.to_thread(migrate, engine)
+
+    # one pooled TMDb client shared by every request
+    app.state.tmdb = TMDbClient()
+    app.state.posters = PosterCache()
+    if app.state.posters.enabled:
+        await asyncio.to_thread(app.state.posters.load)
+    leaderboard_task = asyncio.create_task(leaderboards.run(ReadSessionLocal))
+    genre_task = asyncio.create_task(genre_index.run(ReadSessionLocal))
+    like_task = asyncio.create_task(like_buffer.run(AsyncSessionLocal)) if like_buffer.enabled else None
+    reconcile_task = None
+    if LIKE_RECONCILE_ON_STARTUP:
+        reconcile_task = asyncio.create_task(reconcile_in_background(engine))
+    search_task = None
+    if SEARCH_BACKEND == "memory":
+        search_task = asyncio.create_task(search_index.run(ReadSessionLocal))
+    refresh_task = None
+    if CATALOG_REFRESH and app.state.tmdb.configured:
+        refresh_task = asyncio.create_task(catalog_refresher.run(AsyncSessionLocal, app.state.tmdb))
+    try:
+        yield
+    finally:
+        leaderboard_task.cancel()
+        genre_task.cancel()
+        if like_task:
+            like_task.cancel()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await like_buffer.flush(db)
+            except Exception as e:
+                print("Like flush error on shutdown:", e)
+        if reconcile_task:
+            reconcile_task.cancel()
+        if search_task:
+            search_task.cancel()
+        if refresh_task:
+            refresh_task.cancel()
+        await app.state.tmdb.aclose()
+        await app.state.posters.aclose()
+        password_hasher.shutdown()
+
+
+app = FastAPI(title="Movie Review API with JWT + TMDb", lifespan=lifespan)
 
 # --------------------- CORS ---------------------
 app.add_middleware(
@@ -44,10 +127,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
-# Create tables if not exist
-Base.metadata.create_all(bind=engine)
+# --------------------- SQL INSTRUMENTATION ---------------------
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+for replica in replica_engines:
+    metrics.instrument_engine(replica.sync_engine)
+if sqlite_reader_engine is not None:
+    metrics.instrument_engine(sqlite_reader_engine.sync_engine)
+
+
+# per-route latency histograms, in-flight gauge, error counts, 1-in-N profiling
+profiler = SamplingProfiler()
+app.add_middleware(metrics.RequestMetricsMiddleware, profiler=profiler)
+
+
+@app.middleware("http")
+async def sql_timing_middleware(request: Request, call_next):
+    # query count / DB time for this request, sent back as Server-Timing
+    stats = metrics.start_request(request.url.path)
+    response = await call_next(request)
+    response.headers["Server-Timing"] = stats.server_timing()
+    return response
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+if replica_engines:
+    @app.middleware("http")
+    async def read_your_writes_middleware(request: Request, call_next):
+        # a user who just wrote reads from the primary until replicas catch up
+        response = await call_next(request)
+        username = getattr(request.state, "username", None)
+        if username and request.method not in SAFE_METHODS and response.status_code < 400:
+            note_write(username)
+        return response
+
+# Schema changes are a deploy step: `python migrations.py` once per deploy,
+# so starting a worker does no schema work at all. AUTO_MIGRATE=true applies
+# pending migrations at startup instead, for dev and the tests; migrate()
+# takes a cross-process lock, so workers booting together don't race.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
 
 
 # --------------------- JWT CONFIG ---------------------
@@ -58,17 +180,38 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# put the immutable user id in tokens so hot endpoints can skip the users lookup
+JWT_EMBED_USER_ID = os.getenv("JWT_EMBED_USER_ID", "true").lower() in ("1", "true", "yes")
+
+# /metrics and /debug/*: users with these ids (not usernames: those can be
+# changed with PUT /me), or a scraper sending INTERNAL_API_TOKEN as its bearer
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+
+principal_cache = PrincipalCache()
+
+leaderboards = Leaderboards()
+
+search_index = SearchIndex()
+
+genre_index = GenreIndex()
+
+like_buffer = LikeBuffer()
+
+catalog_refresher = CatalogRefresher(genre_index)
+
 security = HTTPBearer(auto_error=False)
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# pbkdf2 runs on a worker pool, not on the event loop
+password_hasher = PasswordHasher()
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
 def create_access_token(
@@ -86,18 +229,27 @@ def create_access_token(
     return encoded_jwt
 
 
-# --------------------- TMDb CONFIG ---------------------
-TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-TMDB_IMAGE_BASE = "https://image.tmdb.org/t/p/w500"
+# --------------------- TMDb CLIENT ---------------------
+# how many TMDb fetches one batch import runs at once
+TMDB_BATCH_CONCURRENCY = int(os.getenv("TMDB_BATCH_CONCURRENCY", "8"))
+
+
+def get_tmdb(request: Request) -> TMDbClient:
+    return request.app.state.tmdb
+
+
+def get_posters(request: Request) -> PosterCache:
+    return request.app.state.posters
 
 
 # --------------------- AUTH HELPERS ---------------------
-async def get_current_user(
+CREDENTIALS_EXCEPTION_DETAIL = "Could not validate credentials"
+
+
+def decode_access_token(
     request: Request,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-):
+    credentials: Optional[HTTPAuthorizationCredentials],
+) -> Dict[str, Any]:
     token = None
     if credentials:
         token = credentials.credentials
@@ -114,7 +266,7 @@ async def get_current_user(
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+        detail=CREDENTIALS_EXCEPTION_DETAIL,
         headers={"WWW-Authenticate": "Bearer"},
     )
 
@@ -126,33 +278,104 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
+    request.state.username = username
+    return payload
+
+
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_read_db),
+):
+    payload = decode_access_token(request, credentials)
+    username = payload["sub"]
+    if wrote_recently(username):
+        use_primary(db)
+
+    cached = principal_cache.get(username)
+    if cached is not None:
+        return cached
+
     sql = text("""
         SELECT id, username, email, full_name, bio, profile_picture, created_at
         FROM users
         WHERE username = :username
         LIMIT 1;
     """)
-    row = db.execute(sql, {"username": username}).mappings().first()
+    row = (await db.execute(sql, {"username": username})).mappings().first()
+
+    if not row and replica_engines and not db.info.get("primary"):
+        # just signed up: the replica may not have the row yet
+        use_primary(db)
+        row = (await db.execute(sql, {"username": username})).mappings().first()
 
     if not row:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=CREDENTIALS_EXCEPTION_DETAIL,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-    return dict(row)
+    user = dict(row)
+    principal_cache.put(username, user)
+    return user
+
+
+async def get_current_principal(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Only id + username, for endpoints that don't need the full profile.
+    Tokens carrying the user id skip the users lookup entirely.
+    """
+    payload = decode_access_token(request, credentials)
+    if wrote_recently(payload["sub"]):
+        use_primary(db)
+
+    if payload.get("uid") is not None:
+        return {"id": payload["uid"], "username": payload["sub"]}
+
+    return await get_current_user(request, credentials, db)
+
+
+async def require_admin(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_read_db),
+) -> Optional[dict]:
+    """Operators only: an ADMIN_USER_IDS user, or the INTERNAL_API_TOKEN bearer."""
+    if INTERNAL_API_TOKEN and credentials and hmac.compare_digest(credentials.credentials, INTERNAL_API_TOKEN):
+        return None
+
+    principal = await get_current_principal(request, credentials, db)
+    if principal["id"] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return principal
+
+
+def token_claims(user_id: int, username: str) -> Dict[str, Any]:
+    claims: Dict[str, Any] = {"sub": username}
+    if JWT_EMBED_USER_ID:
+        # user ids never change, so it's safe to trust them from the token
+        claims["uid"] = user_id
+    return claims
 
 
 # --------------------- AUTH ROUTES ---------------------
 @app.post("/signup")
-async def signup(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup(user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     try:
         check_sql = text("""
             SELECT id FROM users
             WHERE username = :username OR email = :email
             LIMIT 1;
         """)
-        existing = db.execute(
+        existing = (await db.execute(
             check_sql,
             {"username": user_in.username, "email": user_in.email},
-        ).first()
+        )).first()
 
         if existing:
             raise HTTPException(
@@ -165,18 +388,18 @@ async def signup(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
             VALUES (:username, :email, :user_password, :full_name, :bio, :profile_picture);
         """)
 
-        db.execute(
+        await db.execute(
             insert_sql,
             {
                 "username": user_in.username,
                 "email": user_in.email,
-                "user_password": hash_password(user_in.password),
+                "user_password": await hash_password(user_in.password),
                 "full_name": user_in.full_name,
                 "bio": user_in.bio,
                 "profile_picture": str(user_in.profile_picture) if user_in.profile_picture else None,
             },
         )
-        db.commit()
+        await db.commit()
 
         return {"message": "User created successfully!"}
 
@@ -186,25 +409,139 @@ async def signup(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
         print("Signup Error:", e)
         raise HTTPException(status_code=500, detail="Signup failed")
 
-# //to get the all the data from the db
-@app.get("/debug/all")
-async def debug_users(db: Session = Depends(get_db)):
-    users = db.execute(text("SELECT * FROM users")).mappings().all()
-    
-    # Fetch movies
-    movies = db.execute(text("SELECT * FROM movies")).mappings().all()
-    
-    # Fetch reviews
-    reviews = db.execute(text("SELECT * FROM reviews")).mappings().all()
-
-    return {
-        "users": [dict(u) for u in users],
-        "movies": [dict(m) for m in movies],
-        "reviews": [dict(r) for r in reviews],
-    }
+
+# --------------------- BULK EXPORT ---------------------
+@app.get("/export/{table}")
+async def export_data(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since_id: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_principal),
+):
+    """
+    Streams a whole table as NDJSON or CSV (allow-listed columns only).
+    Use since_id to pick up an interrupted or incremental export.
+    """
+    if table not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Unknown table")
+
+    return StreamingResponse(
+        export_table(table, format, since_id),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def prometheus_metrics(
+    tmdb: TMDbClient = Depends(get_tmdb),
+    posters: PosterCache = Depends(get_posters),
+):
+    out = metrics.PrometheusText()
+    metrics.add_sql_metrics(out)
+    metrics.add_route_metrics(out)
+
+    tmdb_stats = tmdb.stats()
+    for name, value in tmdb_stats["cache"].items():
+        out.add("tmdb_cache", "gauge", value, "TMDb response cache counters", {"stat": name})
+    out.add("tmdb_upstream_calls_total", "counter", tmdb_stats["upstream_calls"])
+    out.add("tmdb_coalesced_total", "counter", tmdb_stats["coalesced"])
+    out.add("tmdb_rate_limited_total", "counter", tmdb_stats["rate_limited"])
+    for name, value in tmdb_stats["budget"].items():
+        out.add("tmdb_budget", "gauge", value, "TMDb request budget (token bucket)", {"stat": name})
+
+    for name, value in catalog_refresher.stats().items():
+        out.add("catalog_refresh", "gauge", value, "Background TMDb refresh / prefetch", {"stat": name})
+
+    for name, value in posters.stats().items():
+        out.add("poster_cache", "gauge", int(value), "Poster disk cache", {"stat": name})
+
+    for name, value in principal_cache.stats().items():
+        out.add("auth_cache", "gauge", value, "Authenticated-user cache counters", {"stat": name})
+
+    for name, value in password_hasher.stats().items():
+        out.add("password_hashing", "gauge", value, "Password hashing pool", {"stat": name})
+
+    for name, value in like_buffer.stats().items():
+        out.add("review_likes_buffer", "gauge", value, "Buffered review like counts", {"stat": name})
+
+    for pool in pool_stats():
+        name = pool.pop("pool")
+        for stat, value in pool.items():
+            out.add("db_pool", "gauge", value, "Connection pool usage", {"pool": name, "stat": stat})
+
+    return out.render()
+
+
+@app.get("/debug/latency", dependencies=[Depends(require_admin)])
+async def debug_latency():
+    # p50 / p95 / p99 per route, estimated from the histograms
+    return metrics.latency_summary()
+
+
+@app.post("/debug/profiler", dependencies=[Depends(require_admin)])
+async def debug_profiler(every: int = Query(..., ge=0)):
+    # profile 1 in `every` requests; 0 switches it off
+    profiler.configure(every)
+    return profiler.stats()
+
+
+@app.get("/debug/tmdb-cache", dependencies=[Depends(require_admin)])
+async def debug_tmdb_cache(tmdb: TMDbClient = Depends(get_tmdb)):
+    # hit / miss / eviction counters for sizing the TMDb cache
+    return tmdb.stats()
+
+
+@app.get("/debug/search-index", dependencies=[Depends(require_admin)])
+async def debug_search_index():
+    # size of the in-memory search index and whether the startup load is done
+    return {"backend": SEARCH_BACKEND, **search_index.stats()}
+
+
+@app.get("/debug/genre-index", dependencies=[Depends(require_admin)])
+async def debug_genre_index():
+    # size of the in-memory genre bitmap
+    return genre_index.stats()
+
+
+@app.get("/debug/review-likes", dependencies=[Depends(require_admin)])
+async def debug_review_likes():
+    # like buffer backlog and flush counters
+    return like_buffer.stats()
+
+
+@app.get("/debug/catalog-refresh", dependencies=[Depends(require_admin)])
+async def debug_catalog_refresh():
+    # stale / queued movies, lag behind CATALOG_MAX_AGE_DAYS, refresh counters
+    return catalog_refresher.stats()
+
+
+@app.get("/debug/poster-cache", dependencies=[Depends(require_admin)])
+async def debug_poster_cache(posters: PosterCache = Depends(get_posters)):
+    # disk usage, hit / miss / eviction counters for sizing POSTER_CACHE_MAX_BYTES
+    return posters.stats()
+
+@app.get("/debug/movie-stats/check", dependencies=[Depends(require_admin)])
+async def debug_check_movie_stats(db: AsyncSession = Depends(get_async_db)):
+    # recompute movie_stats from reviews and report drift (read only)
+    drift = await check_movie_stats(db)
+    return {"drifted": len(drift), "fixed": False, "movies": drift}
+
+
+@app.post("/debug/movie-stats/fix", dependencies=[Depends(require_admin)])
+async def debug_fix_movie_stats(db: AsyncSession = Depends(get_async_db)):
+    # rewrite the drifted movie_stats rows from reviews
+    drift = await check_movie_stats(db, fix=True)
+    return {"drifted": len(drift), "fixed": True, "movies": drift}
+
+
+@app.get("/debug/password-hashing", dependencies=[Depends(require_admin)])
+async def debug_password_hashing():
+    # worker pool queue depth / throughput
+    return password_hasher.stats()
 
 @app.post("/login", response_model=schemas.Token)
-async def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login(user_in: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
     try:
         sql = text("""
             SELECT id, username, email, user_password
@@ -212,7 +549,7 @@ async def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
             WHERE username = :username
             LIMIT 1;
         """)
-        result = db.execute(sql, {"username": user_in.username})
+        result = await db.execute(sql, {"username": user_in.username})
         row = result.mappings().first()
 
         if not row:
@@ -221,15 +558,29 @@ async def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
                 detail="Incorrect username or password",
             )
 
-        if not verify_password(user_in.password, row["user_password"]):
+        ok, new_hash = await verify_password(user_in.password, row["user_password"])
+        if not ok:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Incorrect username or password",
             )
 
+        if new_hash:
+            # hashing cost changed since this password was stored
+            rehash_sql = text("""
+                UPDATE users
+                SET user_password = :user_password
+                WHERE id = :user_id;
+            """)
+            await db.execute(
+                rehash_sql,
+                {"user_password": new_hash, "user_id": row["id"]},
+            )
+            await db.commit()
+
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": row["username"]},
+            data=token_claims(row["id"], row["username"]),
             expires_delta=access_token_expires,
         )
 
@@ -246,111 +597,230 @@ async def login(user_in: schemas.UserLogin, db: Session = Depends(get_db)):
 
 
 @app.get("/me", response_model=schemas.UserRead)
-async def read_profile(current_user: dict = Depends(get_current_user)):
+async def read_profile(
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+):
+    # the profile is already in hand (and usually cached): tag it as it is
+    etag = etags.make_etag("me", sorted(current_user.items()))
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    etags.set_etag(response, etag)
     return schemas.UserRead(**current_user)
 
 
 # --------------------- MOVIE ROUTES ---------------------
+# declared before /movies/{tmdb_movie_id} so "batch" isn't parsed as an id
+@app.post("/movies/batch", response_model=List[schemas.MovieImportResult])
+async def import_movies(
+    batch: schemas.MovieBatchImport,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+    tmdb: TMDbClient = Depends(get_tmdb),
+):
+    """
+    Add many TMDb movies to the current user's list at once. Missing movies
+    are fetched from TMDb concurrently and everything is written in one
+    transaction. Returns one result per id.
+    """
+    tmdb_ids = list(dict.fromkeys(batch.tmdb_ids))
+    external_ids = [str(i) for i in tmdb_ids]
+    failed: Dict[str, str] = {}
+
+    # 1) Which ones are already in the catalog / this user's list
+    find_movies_query = text("""
+        SELECT m.id, m.external_id, um.user_id
+        FROM movies m
+        LEFT JOIN user_movies um
+          ON um.movie_id = m.id
+         AND um.user_id = :user_id
+        WHERE m.external_id IN :external_ids;
+    """).bindparams(bindparam("external_ids", expanding=True))
+    find_params = {"user_id": current_user["id"], "external_ids": external_ids}
+
+    rows = (await db.execute(find_movies_query, find_params)).mappings().all()
+    known = {row["external_id"]: row for row in rows}
+
+    # 2) Fetch the rest from TMDb, a bounded number at a time
+    missing = [e for e in external_ids if e not in known]
+    if missing and not tmdb.configured:
+        raise HTTPException(
+            status_code=500,
+            detail="TMDb API key not configured",
+        )
+
+    semaphore = asyncio.Semaphore(TMDB_BATCH_CONCURRENCY)
+
+    async def fetch(external_id: str):
+        async with semaphore:
+            data = await tmdb.get_movie(external_id, language="en-US")
+        return movie_from_tmdb(external_id, data)
+
+    fetched = await asyncio.gather(*(fetch(e) for e in missing), return_exceptions=True)
+
+    new_movies = []
+    for external_id, result in zip(missing, fetched):
+        if isinstance(result, TMDbError):
+            failed[external_id] = f"TMDb API error ({result.status_code})"
+        elif isinstance(result, Exception):
+            print("TMDb batch error:", external_id, result)
+            failed[external_id] = "TMDb request failed"
+        else:
+            new_movies.append(result)
+
+    new_genres: Dict[str, int] = {}
+    try:
+        # 3) One multi-row insert for the new catalog rows
+        if new_movies:
+            insert_sql = text(insert_ignore(db, """
+                movies (external_id, title, year, poster_url, overview, genres, refreshed_at)
+                VALUES (:external_id, :title, :year, :poster_url, :overview, :genres, :refreshed_at)
+            """))
+            refreshed_at = datetime.utcnow().replace(microsecond=0)
+            await db.execute(insert_sql, [{**movie, "refreshed_at": refreshed_at} for movie in new_movies])
+
+            rows = (await db.execute(find_movies_query, find_params)).mappings().all()
+            known = {row["external_id"]: row for row in rows}
+
+            new_genres = await genre_index.link(db, [
+                {**movie, "id": known[movie["external_id"]]["id"]}
+                for movie in new_movies
+                if movie["external_id"] in known
+            ])
+
+        # 4) One multi-row insert into the user's list
+        to_save = [
+            {"user_id": current_user["id"], "movie_id": row["id"]}
+            for row in known.values()
+            if row["user_id"] is None
+        ]
+        if to_save:
+            watchlist_sql = text(insert_ignore(db, """
+                user_movies (user_id, movie_id)
+                VALUES (:user_id, :movie_id)
+            """))
+            await db.execute(watchlist_sql, to_save)
+
+        await db.commit()
+
+    except Exception as e:
+        await db.rollback()
+        print("Error importing movies:", e)
+        raise HTTPException(status_code=500, detail="Failed to import movies")
+
+    genre_index.remember(new_genres)
+    if SEARCH_BACKEND == "memory":
+        for movie in new_movies:
+            row = known.get(movie["external_id"])
+            if row is not None:
+                search_index.add(row["id"], movie)
+
+    results = []
+    for tmdb_id, external_id in zip(tmdb_ids, external_ids):
+        row = known.get(external_id)
+        if row is None:
+            results.append({
+                "tmdb_id": tmdb_id,
+                "status": "failed",
+                "detail": failed.get(external_id, "Movie not found"),
+            })
+        else:
+            results.append({
+                "tmdb_id": tmdb_id,
+                "status": "added" if row["user_id"] is None else "already_saved",
+                "movie_id": row["id"],
+            })
+
+    return results
+
+
 @app.post("/movies/{tmdb_movie_id}", response_model=schemas.MovieRead)
 async def adding_movie(
     tmdb_movie_id: int,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+    tmdb: TMDbClient = Depends(get_tmdb),
 ):
     external_id = str(tmdb_movie_id)
 
-    # Check if this user already saved this movie
+    # Look up the shared catalog row, and whether this user already saved it
     find_movie_query = text("""
-        SELECT id, external_id, title, year, poster_url, overview, genres, user_id
-        FROM movies
-        WHERE user_id = :user_id
-          AND external_id = :external_id
+        SELECT m.id, m.external_id, m.title, m.year, m.poster_url, m.overview, m.genres,
+               um.user_id
+        FROM movies m
+        LEFT JOIN user_movies um
+          ON um.movie_id = m.id
+         AND um.user_id = :user_id
+        WHERE m.external_id = :external_id
         LIMIT 1;
     """)
+    find_params = {
+        "user_id": current_user["id"],
+        "external_id": external_id,
+    }
 
-    find_movie = db.execute(
-        find_movie_query,
-        {
-            "user_id": current_user["id"],
-            "external_id": external_id,
-        },
-    ).mappings().first()
+    find_movie = (await db.execute(find_movie_query, find_params)).mappings().first()
 
-    if find_movie:
+    if find_movie and find_movie["user_id"] is not None:
         # movie already in this user's list
         return schemas.MovieRead(**find_movie)
 
-    # Fetch from TMDb since user doesn't have it
-    if not TMDB_API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="TMDb API key not configured",
-        )
-
-    tmdb_url = f"{TMDB_BASE_URL}/movie/{external_id}"
-    params = {
-        "api_key": TMDB_API_KEY,    # expecting v3 key here
-        "language": "en-US",
-    }
-
+    new_movie = None
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(tmdb_url, params=params)
-        data = resp.json()
-
-        if resp.status_code != 200:
-            print("TMDb movie error:", data)
-            raise HTTPException(status_code=500, detail="TMDb API error")
-
-        title = data.get("title") or data.get("name") or "Unknown"
+        if not find_movie:
+            # Nobody has added this film yet: fetch it from TMDb into the catalog
+            if not tmdb.configured:
+                raise HTTPException(
+                    status_code=500,
+                    detail="TMDb API key not configured",
+                )
 
-        year = None
-        if data.get("release_date"):
             try:
-                year = int(data["release_date"].split("-")[0])
-            except Exception:
-                year = None
-
-        poster = (
-            f"{TMDB_IMAGE_BASE}{data.get('poster_path')}"
-            if data.get("poster_path")
-            else None
-        )
-
-        overview = data.get("overview") or ""
-
-        genres_list = data.get("genres") or []
-        genres = ", ".join(g["name"] for g in genres_list if g.get("name"))
-
-        # Insert movie for this user
-        insert_sql = text("""
-            INSERT INTO movies (external_id, title, year, poster_url, overview, genres, user_id)
-            VALUES (:external_id, :title, :year, :poster_url, :overview, :genres, :user_id);
-        """)
-
-        db.execute(
-            insert_sql,
+                data = await tmdb.get_movie(external_id, language="en-US")
+            except TMDbError as e:
+                print("TMDb movie error:", e.data)
+                raise HTTPException(status_code=500, detail="TMDb API error")
+
+            # Insert the catalog row (shared by every user)
+            insert_sql = """
+                INSERT INTO movies (external_id, title, year, poster_url, overview, genres, refreshed_at)
+                VALUES (:external_id, :title, :year, :poster_url, :overview, :genres, :refreshed_at)
+            """
+
+            movie = movie_from_tmdb(external_id, data)
+            refreshed_at = datetime.utcnow().replace(microsecond=0)
+            try:
+                async with db.begin_nested():
+                    movie_id = await insert_returning_id(db, insert_sql, {**movie, "refreshed_at": refreshed_at})
+                find_movie = new_movie = {**movie, "id": movie_id}
+            except IntegrityError:
+                # another user added the same film at the same time
+                find_movie = (await db.execute(find_movie_query, find_params)).mappings().first()
+
+            if new_movie:
+                new_genres = await genre_index.link(db, [new_movie])
+
+        # Add it to this user's watchlist (no-op if a parallel request beat us)
+        watchlist_sql = text(insert_ignore(db, """
+            user_movies (user_id, movie_id)
+            VALUES (:user_id, :movie_id)
+        """))
+        await db.execute(
+            watchlist_sql,
             {
-                "external_id": external_id,
-                "title": title,
-                "year": year,
-                "poster_url": poster,
-                "overview": overview,
-                "genres": genres,
                 "user_id": current_user["id"],
+                "movie_id": find_movie["id"],
             },
         )
-        db.commit()
+        await db.commit()
 
-        movie = db.execute(
-            find_movie_query,
-            {
-                "user_id": current_user["id"],
-                "external_id": external_id,
-            },
-        ).mappings().first()
+        if new_movie:
+            genre_index.remember(new_genres)
+        if new_movie and SEARCH_BACKEND == "memory":
+            search_index.add(new_movie["id"], new_movie)
 
-        return schemas.MovieRead(**movie)
+        return schemas.MovieRead(**{**find_movie, "user_id": current_user["id"]})
 
     except HTTPException:
         raise
@@ -362,149 +832,621 @@ async def adding_movie(
 @app.get("/movies/tmdb/{tmdb_movie_id}/reviews", response_model=List[schemas.ReviewRead])
 async def get_movie_reviews_by_tmdb(
     tmdb_movie_id: int,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
 ):
+    """
+    Reviews for a movie, newest first, one page at a time.
+    Pass the X-Next-Cursor header of a page as ?cursor= to get the next one.
+    format=ndjson streams every remaining review instead.
+    Answers If-None-Match with 304 while the movie's reviews are unchanged.
+    """
     external_id = str(tmdb_movie_id)
 
+    # reviews from every user live on the one catalog row; its stats row
+    # carries the version the ETag is built from
     find_movie_query = text("""
-        SELECT id
-        FROM movies
-        WHERE user_id = :user_id
-          AND external_id = :external_id
+        SELECT m.id, s.review_count, s.version
+        FROM movies m
+        LEFT JOIN movie_stats s ON s.movie_id = m.id
+        WHERE m.external_id = :external_id
         LIMIT 1;
     """)
-    movie_row = db.execute(
+    movie_row = (await db.execute(
         find_movie_query,
-        {
-            "user_id": current_user["id"],
-            "external_id": external_id,
-        },
-    ).mappings().first()
+        {"external_id": external_id},
+    )).mappings().first()
 
     if not movie_row:
         raise HTTPException(
             status_code=404,
-            detail="Movie not found for this user. Add it first.",
+            detail="Movie not found. Add it first.",
         )
 
     movie_id = movie_row["id"]
 
-    reviews_sql = text("""
+    etag = etags.make_etag(
+        "reviews", movie_id, movie_row["review_count"], movie_row["version"], limit, cursor, format,
+    )
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+
+    after = decode_cursor(cursor)
+    params: Dict[str, Any] = {"movie_id": movie_id}
+    keyset = ""
+    if after:
+        keyset = KEYSET_CONDITION
+        params["cursor_created_at"], params["cursor_id"] = after
+
+    # newest first; (movie_id, created_at, id) index backs both the filter and the order
+    reviews_sql = f"""
         SELECT id, user_id, movie_id, rating, comment, likes, created_at
         FROM reviews
         WHERE movie_id = :movie_id
-        ORDER BY created_at DESC;
-    """)
-    rows = db.execute(
-        reviews_sql,
-        {"movie_id": movie_id},
-    ).mappings().all()
+        {keyset}
+        ORDER BY created_at DESC, id DESC
+    """
+
+    if format == "ndjson":
+        stream = StreamingResponse(
+            stream_reviews_ndjson(text(reviews_sql + ";"), params, db.info.get("primary", False)),
+            media_type="application/x-ndjson",
+        )
+        etags.set_etag(stream, etag)
+        return stream
+
+    etags.set_etag(response, etag)
+    params["limit"] = limit + 1
+    rows = (await db.execute(
+        text(reviews_sql + " LIMIT :limit;"),
+        params,
+    )).mappings().all()
+
+    # one extra row tells us whether there is a next page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
 
     return [schemas.ReviewRead(**row) for row in rows]
 
 
-# --------------------- REVIEW ROUTES ---------------------
-@app.post("/reviews", response_model=schemas.ReviewRead)
-async def add_review(
-    review_in: schemas.ReviewCreate,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+async def stream_reviews_ndjson(sql, params: Dict[str, Any], primary: bool = False):
+    # own session: the request's session may be closed before the body is sent
+    async with ReadSessionLocal() as stream_db:
+        if primary:
+            use_primary(stream_db)
+        result = await stream_db.stream(sql, params)
+        async for row in result.mappings():
+            yield schemas.ReviewRead(**row).model_dump_json() + "\n"
+
+
+# --------------------- MOVIE DETAIL ---------------------
+DETAIL_MOVIE_COLUMNS = ["id", "external_id", "title", "year", "poster_url", "overview", "genres", "user_id"]
+
+
+async def load_movie_details(
+    db: AsyncSession,
+    external_ids: List[str],
+    user_id: int,
+    reviews_limit: int,
+) -> List[schemas.MovieDetail]:
+    """
+    Movies with their stats and first page of reviews, in the order asked
+    for. Always two statements, however many movies.
+    """
+    movies_sql = text(f"""
+        SELECT m.id, m.external_id, m.title, m.year, m.poster_url, m.overview, m.genres,
+               um.user_id,
+               {", ".join("s." + col for col in STATS_COLUMNS)}
+        FROM movies m
+        LEFT JOIN user_movies um
+          ON um.movie_id = m.id
+         AND um.user_id = :user_id
+        LEFT JOIN movie_stats s ON s.movie_id = m.id
+        WHERE m.external_id IN :external_ids;
+    """).bindparams(bindparam("external_ids", expanding=True))
+    rows = (await db.execute(
+        movies_sql,
+        {"user_id": user_id, "external_ids": external_ids},
+    )).mappings().all()
+
+    reviews: Dict[int, List[Any]] = {row["id"]: [] for row in rows}
+    if reviews and reviews_limit:
+        # one LIMITed range scan of (movie_id, created_at, id) per movie, in a
+        # single statement; a window function would read every review instead
+        params: Dict[str, Any] = {"limit": reviews_limit + 1}
+        parts = []
+        for i, movie_id in enumerate(reviews):
+            params[f"movie_id_{i}"] = movie_id
+            parts.append(f"""
+                SELECT * FROM (
+                    SELECT id, user_id, movie_id, rating, comment, likes, created_at
+                    FROM reviews
+                    WHERE movie_id = :movie_id_{i}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT :limit
+                ) r{i}
+            """)
+        review_rows = (await db.execute(text(" UNION ALL ".join(parts) + ";"), params)).mappings().all()
+        for review in review_rows:
+            reviews[review["movie_id"]].append(review)
+
+    by_external_id = {row["external_id"]: row for row in rows}
+    details = []
+    for external_id in dict.fromkeys(external_ids):
+        row = by_external_id.get(external_id)
+        if row is None:
+            continue
+
+        # UNION ALL keeps no order across its parts
+        page = sorted(reviews[row["id"]], key=lambda r: (r["created_at"], r["id"]), reverse=True)
+        next_cursor = None
+        if len(page) > reviews_limit:
+            page = page[:reviews_limit]
+            next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["id"])
+
+        details.append(schemas.MovieDetail(
+            **{col: row[col] for col in DETAIL_MOVIE_COLUMNS},
+            stats=stats_to_read(row["id"], row),
+            reviews=[schemas.ReviewRead(**review) for review in page],
+            next_reviews_cursor=next_cursor,
+        ))
+    return details
+
+
+async def movie_details_etag(
+    db: AsyncSession,
+    external_ids: List[str],
+    user_id: int,
+    reviews_limit: int,
+) -> str:
+    """ETag for load_movie_details(), from version markers only."""
+    versions_sql = text("""
+        SELECT m.external_id, m.id, m.updated_at, s.review_count, s.version, um.user_id
+        FROM movies m
+        LEFT JOIN user_movies um
+          ON um.movie_id = m.id
+         AND um.user_id = :user_id
+        LEFT JOIN movie_stats s ON s.movie_id = m.id
+        WHERE m.external_id IN :external_ids;
+    """).bindparams(bindparam("external_ids", expanding=True))
+    rows = (await db.execute(
+        versions_sql,
+        {"user_id": user_id, "external_ids": external_ids},
+    )).all()
+    return etags.make_etag("detail", external_ids, reviews_limit, sorted(tuple(row) for row in rows))
+
+
+@app.get("/movies/details", response_model=List[schemas.MovieDetail])
+async def get_movie_details_batch(
+    request: Request,
+    response: Response,
+    tmdb_ids: List[int] = Query(..., min_length=1, max_length=100),
+    reviews_limit: int = Query(5, ge=0, le=50),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    # 1) Make sure the movie exists in movies table
-    movie_check_sql = text("""
-        SELECT id 
-        FROM movies 
-        WHERE id = :movie_id
+    """
+    Detail for many movies at once (?tmdb_ids=550&tmdb_ids=603), same shape
+    as /movies/tmdb/{id}. Movies not in the catalog are left out.
+    """
+    external_ids = [str(i) for i in tmdb_ids]
+    etag = await movie_details_etag(db, external_ids, current_user["id"], reviews_limit)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+
+    etags.set_etag(response, etag)
+    return await load_movie_details(db, external_ids, current_user["id"], reviews_limit)
+
+
+@app.get("/movies/tmdb/{tmdb_movie_id}", response_model=schemas.MovieDetail)
+async def get_movie_detail_by_tmdb(
+    tmdb_movie_id: int,
+    request: Request,
+    response: Response,
+    reviews_limit: int = Query(20, ge=0, le=200),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    The movie, its rating stats and its newest reviews in one response.
+    user_id is set when the movie is in the current user's list; continue
+    the reviews with next_reviews_cursor on /movies/tmdb/{id}/reviews.
+    """
+    external_ids = [str(tmdb_movie_id)]
+    etag = await movie_details_etag(db, external_ids, current_user["id"], reviews_limit)
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+
+    details = await load_movie_details(db, external_ids, current_user["id"], reviews_limit)
+    if not details:
+        raise HTTPException(
+            status_code=404,
+            detail="Movie not found. Add it first.",
+        )
+    etags.set_etag(response, etag)
+    return details[0]
+
+
+@app.get("/movies/tmdb/{tmdb_movie_id}/stats", response_model=schemas.MovieStatsRead)
+async def get_movie_stats_by_tmdb(
+    tmdb_movie_id: int,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Review count, average rating and rating histogram, read from the
+    precomputed movie_stats row (no scan of reviews).
+    """
+    stats_sql = text(f"""
+        SELECT m.id AS movie_id, {", ".join("s." + col for col in STATS_COLUMNS)}
+        FROM movies m
+        LEFT JOIN movie_stats s ON s.movie_id = m.id
+        WHERE m.external_id = :external_id
         LIMIT 1;
     """)
-    movie_row = db.execute(
-        movie_check_sql, {"movie_id": review_in.movie_id}
-    ).mappings().first()
+    row = (await db.execute(
+        stats_sql,
+        {"external_id": str(tmdb_movie_id)},
+    )).mappings().first()
 
-    if not movie_row:
+    if not row:
         raise HTTPException(
             status_code=404,
-            detail="Movie not found — add the movie first.",
+            detail="Movie not found. Add it first.",
         )
 
-    # 2) Check if THIS USER already reviewed THIS MOVIE
-    review_check_sql = text("""
-        SELECT id, user_id, movie_id, rating, comment, likes, created_at
-        FROM reviews
-        WHERE user_id = :user_id
-          AND movie_id = :movie_id
-        LIMIT 1;
+    return stats_to_read(row["movie_id"], row)
+
+
+# --------------------- POSTERS ---------------------
+# content-addressed, so a URL's bytes never change
+POSTER_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@app.get("/posters/{size}/{filename}")
+async def get_poster(
+    size: str,
+    filename: str,
+    request: Request,
+    posters: PosterCache = Depends(get_posters),
+):
+    """
+    A TMDb poster from the local cache: size is w92 ... w500, w780 or
+    original, filename the last part of poster_url. No token needed, since
+    <img> tags can't send one.
+    """
+    if not posters.enabled:
+        data = await posters.fetch(size, filename)
+        return Response(content=data, media_type=media_type(filename), headers={"Cache-Control": POSTER_CACHE_CONTROL})
+
+    path, digest = await posters.get(size, filename)
+    headers = {"Cache-Control": POSTER_CACHE_CONTROL, "ETag": f'"{digest[:32]}"'}
+    if etags.matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type(filename), headers=headers)
+
+
+# --------------------- SEARCH ---------------------
+@app.get("/movies/search", response_model=List[schemas.MovieSearchResult])
+async def search_movies(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=50),
+    prefix: bool = Query(True, description="Treat the last word as a prefix (typeahead)"),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Catalog search over title, overview and genres, best match first. Ranked
+    from the in-memory index; until it has finished loading at startup (or
+    with SEARCH_BACKEND=database) the database's full-text index answers.
+    """
+    if SEARCH_BACKEND == "memory" and search_index.ready:
+        hits = search_index.search(q, limit=limit, prefix=prefix)
+    else:
+        hits = await search_database(db, q, limit=limit, prefix=prefix)
+    if not hits:
+        return []
+
+    movies_sql = text("""
+        SELECT id, external_id, title, year, poster_url, overview, genres
+        FROM movies
+        WHERE id IN :ids;
+    """).bindparams(bindparam("ids", expanding=True))
+    rows = (await db.execute(movies_sql, {"ids": [movie_id for movie_id, _ in hits]})).mappings().all()
+    by_id = {row["id"]: row for row in rows}
+
+    return [
+        schemas.MovieSearchResult(**by_id[movie_id], score=round(score, 4))
+        for movie_id, score in hits
+        if movie_id in by_id
+    ]
+
+
+# --------------------- FILTERS ---------------------
+def genre_filter_sql(genre_ids: List[int], params: Dict[str, Any], movie_column: str) -> Tuple[str, List[str]]:
+    """
+    JOIN for the first genre and EXISTS for the rest: every one is a lookup on
+    movie_genres' (genre_id, movie_id) or (movie_id, genre_id) index.
+    """
+    if not genre_ids:
+        return "", []
+
+    params["genre_id"] = genre_ids[0]
+    join = f"JOIN movie_genres mg ON mg.movie_id = {movie_column} AND mg.genre_id = :genre_id"
+    conditions = []
+    for i, genre_id in enumerate(genre_ids[1:], 1):
+        params[f"genre_id_{i}"] = genre_id
+        conditions.append(f"""EXISTS (
+            SELECT 1 FROM movie_genres mg{i}
+            WHERE mg{i}.movie_id = {movie_column} AND mg{i}.genre_id = :genre_id_{i}
+        )""")
+    return join, conditions
+
+
+def year_filter_sql(year_from: Optional[int], year_to: Optional[int], params: Dict[str, Any]) -> List[str]:
+    conditions = []
+    if year_from is not None:
+        params["year_from"] = year_from
+        conditions.append("m.year >= :year_from")
+    if year_to is not None:
+        params["year_to"] = year_to
+        conditions.append("m.year <= :year_to")
+    return conditions
+
+
+FILTER_MOVIE_COLUMNS = """
+    m.id, m.external_id, m.title, m.year, m.poster_url, m.overview, m.genres,
+    s.review_count, s.rating_sum
+"""
+
+
+def movie_filter_result(row) -> schemas.MovieFilterResult:
+    count = row["review_count"] or 0
+    return schemas.MovieFilterResult(
+        **{k: row[k] for k in ("id", "external_id", "title", "year", "poster_url", "overview", "genres")},
+        review_count=count,
+        average_rating=(row["rating_sum"] / count) if count else None,
+    )
+
+
+@app.get("/movies/filter", response_model=List[schemas.MovieFilterResult])
+async def filter_movies(
+    response: Response,
+    genres: Optional[str] = Query(None, description="Comma-separated; a movie must have all of them"),
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    min_rating: Optional[float] = Query(None, ge=0, le=10, description="Minimum average review rating"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = Query(None, description="X-Next-Cursor of the previous page"),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Catalog movies by genre, release year and average rating, newest first.
+    Several genres are intersected in the in-memory genre bitmap; everything
+    else (and movies added in the last GENRE_INDEX_REFRESH_SECONDS) comes
+    from indexed SQL.
+    """
+    genre_ids = await genre_index.resolve(db, parse_genres(genres))
+
+    params: Dict[str, Any] = {}
+    conditions = []
+    if min_rating is not None:
+        params["min_rating"] = min_rating
+        conditions.append("s.review_count > 0 AND s.rating_sum >= :min_rating * s.review_count")
+
+    if len(genre_ids) > 1 and genre_index.covers(genre_ids):
+        by_ids_sql = text(f"""
+            SELECT {FILTER_MOVIE_COLUMNS}
+            FROM movies m
+            LEFT JOIN movie_stats s ON s.movie_id = m.id
+            WHERE m.id IN :ids
+            {"".join(" AND " + c for c in conditions)}
+            ORDER BY m.id DESC;
+        """).bindparams(bindparam("ids", expanding=True))
+
+        # the rating filter is applied in SQL, so ask the bitmap for a few pages' worth
+        chunk = limit + 1 if min_rating is None else (limit + 1) * 4
+        rows = []
+        before = cursor
+        while len(rows) <= limit:
+            ids = genre_index.movies_with_all(genre_ids, year_from, year_to, before, chunk)
+            if not ids:
+                break
+            rows += (await db.execute(by_ids_sql, {**params, "ids": ids})).mappings().all()
+            before = ids[-1]
+            if len(ids) < chunk:
+                break
+    else:
+        join, genre_conditions = genre_filter_sql(genre_ids, params, "m.id")
+        conditions += genre_conditions + year_filter_sql(year_from, year_to, params)
+        if cursor is not None:
+            params["cursor"] = cursor
+            conditions.append("m.id < :cursor")
+        params["limit"] = limit + 1
+
+        filter_sql = text(f"""
+            SELECT {FILTER_MOVIE_COLUMNS}
+            FROM movies m
+            {join}
+            LEFT JOIN movie_stats s ON s.movie_id = m.id
+            WHERE 1 = 1
+            {"".join(" AND " + c for c in conditions)}
+            ORDER BY m.id DESC
+            LIMIT :limit;
+        """)
+        rows = (await db.execute(filter_sql, params)).mappings().all()
+
+    # one extra row tells us whether there is a next page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+
+    return [movie_filter_result(row) for row in rows]
+
+
+@app.get("/reviews/filter", response_model=List[schemas.ReviewRead])
+async def filter_reviews(
+    response: Response,
+    genres: Optional[str] = Query(None, description="Comma-separated; the movie must have all of them"),
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    min_rating: Optional[float] = Query(None, ge=0, le=10, description="Minimum rating of the review"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Reviews of movies matching the genre / release year filters, newest
+    first, e.g. every review of a Horror movie. Paged like a movie's reviews.
+    """
+    genre_ids = await genre_index.resolve(db, parse_genres(genres))
+
+    params: Dict[str, Any] = {"limit": limit + 1}
+    join, conditions = genre_filter_sql(genre_ids, params, "r.movie_id")
+    conditions += year_filter_sql(year_from, year_to, params)
+    if min_rating is not None:
+        params["min_rating"] = min_rating
+        conditions.append("r.rating >= :min_rating")
+
+    after = decode_cursor(cursor)
+    keyset = ""
+    if after:
+        keyset = keyset_condition("r")
+        params["cursor_created_at"], params["cursor_id"] = after
+
+    # movies is only needed for the year filter
+    movies_join = "JOIN movies m ON m.id = r.movie_id" if year_from is not None or year_to is not None else ""
+
+    reviews_sql = text(f"""
+        SELECT r.id, r.user_id, r.movie_id, r.rating, r.comment, r.likes, r.created_at
+        FROM reviews r
+        {join}
+        {movies_join}
+        WHERE 1 = 1
+        {"".join(" AND " + c for c in conditions)}
+        {keyset}
+        ORDER BY r.created_at DESC, r.id DESC
+        LIMIT :limit;
     """)
+    rows = (await db.execute(reviews_sql, params)).mappings().all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+
+    return [schemas.ReviewRead(**row) for row in rows]
+
+
+# --------------------- LEADERBOARDS ---------------------
+@app.get("/leaderboards/top-rated", response_model=List[schemas.LeaderboardEntry])
+async def top_rated_movies(limit: int = Query(10, ge=1, le=100)):
+    # Bayesian-average ranking, served from memory
+    return leaderboards.top_rated_list(limit)
 
-    existing = db.execute(
-        review_check_sql,
-        {
-            "user_id": current_user["id"],
-            "movie_id": review_in.movie_id,
-        },
-    ).mappings().first()
 
-    if existing:
+@app.get("/leaderboards/trending", response_model=List[schemas.LeaderboardEntry])
+async def trending_movies(limit: int = Query(10, ge=1, le=100)):
+    # time-decayed review velocity, served from memory
+    return leaderboards.trending_list(limit)
+
+
+# --------------------- REVIEW ROUTES ---------------------
+# PostgreSQL can't infer types for parameters in an INSERT ... SELECT list
+REVIEW_INSERT_TYPES = {"user_id": Integer, "rating": Float, "comment": Text, "created_at": TIMESTAMP}
+
+@app.post("/reviews", response_model=schemas.ReviewRead)
+async def add_review(
+    review_in: schemas.ReviewCreate,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # One statement does all three checks: the SELECT only yields a row if the
+    # movie exists, and uq_user_movie_review rejects a second review
+    created_at = datetime.utcnow().replace(microsecond=0)
+    insert_sql = """
+        INSERT INTO reviews (user_id, movie_id, rating, comment, likes, created_at)
+        SELECT :user_id, id, :rating, :comment, 0, :created_at
+        FROM movies
+        WHERE id = :movie_id
+    """
+    params = {
+        "user_id": current_user["id"],
+        "movie_id": review_in.movie_id,
+        "rating": review_in.rating,
+        "comment": review_in.comment,
+        "created_at": created_at,
+    }
+
+    try:
+        review_id = await insert_returning_id(db, insert_sql, params, types=REVIEW_INSERT_TYPES)
+    except IntegrityError as e:
+        await db.rollback()
+        if not is_unique_violation(e):
+            raise
         raise HTTPException(
             status_code=400,
             detail="You already reviewed this movie.",
         )
 
-    # 3) Insert new review
-    insert_sql = text("""
-        INSERT INTO reviews (user_id, movie_id, rating, comment, likes)
-        VALUES (:user_id, :movie_id, :rating, :comment, 0);
-    """)
+    if review_id is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Movie not found — add the movie first.",
+        )
 
-    db.execute(
-        insert_sql,
-        {
-            "user_id": current_user["id"],
-            "movie_id": review_in.movie_id,
-            "rating": review_in.rating,
-            "comment": review_in.comment,
-        },
+    await apply_rating_change(db, review_in.movie_id, added=review_in.rating)
+    await db.commit()
+    leaderboards.record(review_in.movie_id, added=review_in.rating)
+
+    return schemas.ReviewRead(
+        id=review_id,
+        user_id=current_user["id"],
+        movie_id=review_in.movie_id,
+        rating=review_in.rating,
+        comment=review_in.comment,
+        likes=0,
+        created_at=str(created_at),
     )
-    db.commit()
-
-    new_review = db.execute(
-        review_check_sql,
-        {
-            "user_id": current_user["id"],
-            "movie_id": review_in.movie_id,
-        },
-    ).mappings().first()
-
-    return schemas.ReviewRead(**new_review)
 
 
 @app.put("/reviews/{movie_id}", response_model=schemas.ReviewRead)
 async def update_review(
     movie_id: int,
     review_in: schemas.ReviewCreate,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Update the current user's review for a specific movie.
     """
 
-    review_check_sql = text("""
+    # row lock so concurrent updates see each other's old rating (for movie_stats)
+    review_check_sql = text(f"""
         SELECT id, user_id, movie_id, rating, comment, likes, created_at
         FROM reviews
         WHERE user_id = :user_id
           AND movie_id = :movie_id
-        LIMIT 1;
+        LIMIT 1
+        {for_update(db)};
     """)
 
-    existing = db.execute(
+    existing = (await db.execute(
         review_check_sql,
         {
             "user_id": current_user["id"],
             "movie_id": movie_id,
         },
-    ).mappings().first()
+    )).mappings().first()
 
     if not existing:
         raise HTTPException(
@@ -519,7 +1461,7 @@ async def update_review(
         WHERE id = :id;
     """)
 
-    db.execute(
+    await db.execute(
         update_sql,
         {
             "rating": review_in.rating,
@@ -527,44 +1469,71 @@ async def update_review(
             "id": existing["id"],
         },
     )
-    db.commit()
-
-    updated = db.execute(
-        review_check_sql,
-        {
-            "user_id": current_user["id"],
-            "movie_id": movie_id,
-        },
-    ).mappings().first()
+    await apply_rating_change(db, movie_id, removed=existing["rating"], added=review_in.rating)
+    await db.commit()
+    leaderboards.record(movie_id, removed=existing["rating"], added=review_in.rating)
 
-    return schemas.ReviewRead(**updated)
+    return schemas.ReviewRead(**{
+        **existing,
+        "rating": review_in.rating,
+        "comment": review_in.comment,
+    })
 
 
 @app.delete("/reviews/{movie_id}")
 async def delete_review(
     movie_id: int,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Delete the current user's review for this movie.
     """
+    review_params = {
+        "user_id": current_user["id"],
+        "movie_id": movie_id,
+    }
 
-    review_check_sql = text("""
-        SELECT id
-        FROM reviews
-        WHERE user_id = :user_id
-          AND movie_id = :movie_id
-        LIMIT 1;
+    # its likes have to go first (foreign key)
+    likes_sql = text("""
+        DELETE FROM review_likes
+        WHERE review_id IN (
+            SELECT id FROM reviews
+            WHERE user_id = :user_id
+              AND movie_id = :movie_id
+        );
     """)
+    await db.execute(likes_sql, review_params)
+
+    if supports_returning(db, "delete"):
+        # delete and get the old rating back in one round-trip
+        delete_sql = text("""
+            DELETE FROM reviews
+            WHERE user_id = :user_id
+              AND movie_id = :movie_id
+            RETURNING id, rating, created_at;
+        """)
+        review_row = (await db.execute(delete_sql, review_params)).mappings().first()
+    else:
+        review_check_sql = text(f"""
+            SELECT id, rating, created_at
+            FROM reviews
+            WHERE user_id = :user_id
+              AND movie_id = :movie_id
+            LIMIT 1
+            {for_update(db)};
+        """)
+        review_row = (await db.execute(review_check_sql, review_params)).mappings().first()
 
-    review_row = db.execute(
-        review_check_sql,
-        {
-            "user_id": current_user["id"],
-            "movie_id": movie_id,
-        },
-    ).mappings().first()
+        if review_row:
+            delete_sql = text("""
+                DELETE FROM reviews
+                WHERE id = :review_id;
+            """)
+            await db.execute(
+                delete_sql,
+                {"review_id": review_row["id"]},
+            )
 
     if not review_row:
         raise HTTPException(
@@ -572,18 +1541,80 @@ async def delete_review(
             detail="You have not reviewed this movie yet.",
         )
 
+    await apply_rating_change(db, movie_id, removed=review_row["rating"])
+    await db.commit()
+    leaderboards.record(movie_id, removed=review_row["rating"], created_at=review_row["created_at"])
+
+    return {"detail": "Review deleted successfully."}
+
+
+# --------------------- REVIEW LIKES ---------------------
+async def finish_like_change(db: AsyncSession, review_id: int, delta: int) -> int:
+    """Commit a like / unlike and return the review's like count."""
+    if delta and not like_buffer.enabled:
+        # LIKE_FLUSH_SECONDS=0: the old hot-row update, in this transaction
+        await db.execute(
+            text("UPDATE reviews SET likes = likes + :delta WHERE id = :review_id;"),
+            {"delta": delta, "review_id": review_id},
+        )
+        await db.execute(BUMP_VERSIONS_SQL, {"ids": [review_id]})
+
+    likes = (await db.execute(
+        text("SELECT likes FROM reviews WHERE id = :review_id;"),
+        {"review_id": review_id},
+    )).scalar()
+    if likes is None:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Review not found.")
+    await db.commit()
+
+    if delta and like_buffer.enabled:
+        like_buffer.record(review_id, delta)
+    # reviews.likes lags by up to one flush; add what this worker hasn't flushed
+    return likes + like_buffer.pending(review_id)
+
+
+@app.post("/reviews/{review_id}/like", response_model=schemas.ReviewLikeRead)
+async def like_review(
+    review_id: int,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Like a review. Liking it again is a no-op.
+    """
+    # only the caller's own review_likes row is written; reviews.likes is
+    # recounted in batches by the like buffer
+    insert_sql = text(insert_ignore(db, """
+        review_likes (review_id, user_id)
+        SELECT id, :user_id
+        FROM reviews
+        WHERE id = :review_id
+    """)).bindparams(bindparam("user_id", type_=Integer))
+    result = await db.execute(insert_sql, {"review_id": review_id, "user_id": current_user["id"]})
+
+    likes = await finish_like_change(db, review_id, 1 if result.rowcount else 0)
+    return schemas.ReviewLikeRead(review_id=review_id, liked=True, likes=likes)
+
+
+@app.delete("/reviews/{review_id}/like", response_model=schemas.ReviewLikeRead)
+async def unlike_review(
+    review_id: int,
+    current_user: dict = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Take back a like. A no-op if the review wasn't liked.
+    """
     delete_sql = text("""
-        DELETE FROM reviews
-        WHERE id = :review_id;
+        DELETE FROM review_likes
+        WHERE review_id = :review_id
+          AND user_id = :user_id;
     """)
+    result = await db.execute(delete_sql, {"review_id": review_id, "user_id": current_user["id"]})
 
-    db.execute(
-        delete_sql,
-        {"review_id": review_row["id"]},
-    )
-    db.commit()
-
-    return {"detail": "Review deleted successfully."}
+    likes = await finish_like_change(db, review_id, -1 if result.rowcount else 0)
+    return schemas.ReviewLikeRead(review_id=review_id, liked=False, likes=likes)
 
 
 # --------------------- PROFILE UPDATE ROUTE ---------------------
@@ -591,7 +1622,7 @@ async def delete_review(
 async def update_profile_all(
     payload: schemas.UserUpdateProfile,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Single endpoint to update username, full_name, bio, profile_picture.
@@ -600,91 +1631,70 @@ async def update_profile_all(
     """
 
     try:
-        new_username = current_user["username"]
-        new_full_name = current_user["full_name"]
-        new_bio = current_user["bio"]
-        new_profile_picture = current_user["profile_picture"]
-
-        # Overwrite only if user sent a new value
+        # only the fields that were sent: current_user may come from another
+        # worker's cache and be up to 30s old, so its other values could be stale
+        changes: Dict[str, Any] = {}
         if payload.username is not None:
-            new_username = payload.username.strip()
-
-        if payload.full_name is not None:
-            new_full_name = payload.full_name
-
-        if payload.bio is not None:
-            new_bio = payload.bio
-
-        if payload.profile_picture is not None:
-            new_profile_picture = str(payload.profile_picture)
-
-        username_changed = new_username != current_user["username"]
-
-        if username_changed:
-            if not new_username:
+            changes["username"] = payload.username.strip()
+            if not changes["username"]:
                 raise HTTPException(
                     status_code=400,
                     detail="Username cannot be empty",
                 )
 
-            check_sql = text("""
-                SELECT id
-                FROM users
-                WHERE username = :username
-                LIMIT 1;
-            """)
-            existing = db.execute(
-                check_sql,
-                {"username": new_username},
-            ).mappings().first()
-
-            if existing and existing["id"] != current_user["id"]:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Username already taken",
-                )
+        if payload.full_name is not None:
+            changes["full_name"] = payload.full_name
 
-        update_sql = text("""
-            UPDATE users
-            SET username = :username,
-                full_name = :full_name,
-                bio = :bio,
-                profile_picture = :profile_picture
-            WHERE id = :user_id;
-        """)
+        if payload.bio is not None:
+            changes["bio"] = payload.bio
 
-        db.execute(
-            update_sql,
-            {
-                "username": new_username,
-                "full_name": new_full_name,
-                "bio": new_bio,
-                "profile_picture": new_profile_picture,
-                "user_id": current_user["id"],
-            },
-        )
-        db.commit()
+        if payload.profile_picture is not None:
+            changes["profile_picture"] = str(payload.profile_picture)
 
-        fetch_sql = text("""
-            SELECT id, username, email, full_name, bio, profile_picture, created_at
+        user_columns = "id, username, email, full_name, bio, profile_picture, created_at"
+        select_sql = text(f"""
+            SELECT {user_columns}
             FROM users
-            WHERE id = :user_id
-            LIMIT 1;
+            WHERE id = :user_id;
         """)
 
-        row = db.execute(
-            fetch_sql,
-            {"user_id": current_user["id"]},
-        ).mappings().first()
+        # the unique index on username catches a taken name; no pre-check needed
+        row = None
+        try:
+            if changes:
+                returning = f" RETURNING {user_columns}" if supports_returning(db, "update") else ""
+                update_sql = text(f"""
+                    UPDATE users
+                    SET {", ".join(f"{column} = :{column}" for column in changes)}
+                    WHERE id = :user_id{returning};
+                """)
+                result = await db.execute(update_sql, {**changes, "user_id": current_user["id"]})
+                if returning:
+                    row = result.mappings().first()
+            if row is None:
+                # the row as it is now on the primary, for the response
+                row = (await db.execute(select_sql, {"user_id": current_user["id"]})).mappings().first()
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            if not is_unique_violation(e):
+                raise
+            raise HTTPException(
+                status_code=400,
+                detail="Username already taken",
+            )
+        principal_cache.invalidate(current_user["id"])
 
         user_out = schemas.UserRead(**row)
+        new_username = row["username"]
+        username_changed = new_username != current_user["username"]
 
         new_token = None
         token_type = None
         if username_changed:
             access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
             new_token = create_access_token(
-                data={"sub": new_username},
+                data=token_claims(current_user["id"], new_username),
                 expires_delta=access_token_expires,
             )
             token_type = "bearer"
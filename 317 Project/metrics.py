@@ -0,0 +1,380 @@
+"""
+Per-request SQL instrumentation and per-route latency metrics.
+
+SQLAlchemy cursor events time every statement. The numbers go into a
+per-request record (held in a ContextVar, set by the middleware in main.py)
+and into process-wide counters that /metrics exposes in Prometheus text
+format. Statements slower than SLOW_QUERY_MS are written to the
+"slow_query" logger as one JSON object per line.
+
+RequestMetricsMiddleware keeps a latency histogram, an in-flight gauge and
+error counters per route template, and hands 1-in-N requests to the
+sampling profiler when it's switched on.
+
+Measure the per-request and per-statement overhead with:  python metrics.py
+"""
+import bisect
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+slow_query_log = logging.getLogger("slow_query")
+
+
+class RequestSQLStats:
+    __slots__ = ("path", "count", "total", "slowest", "slowest_statement")
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.total * 1000:.2f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest * 1000:.2f}"
+        )
+
+
+_current: ContextVar[Optional[RequestSQLStats]] = ContextVar("request_sql_stats", default=None)
+
+
+def start_request(path: str) -> RequestSQLStats:
+    stats = RequestSQLStats(path)
+    _current.set(stats)
+    return stats
+
+
+def current_request() -> Optional[RequestSQLStats]:
+    return _current.get()
+
+
+# --------------------- PROCESS-WIDE COUNTERS ---------------------
+db_queries_total = 0
+db_query_seconds_total = 0.0
+db_slow_queries_total = 0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global db_queries_total, db_query_seconds_total, db_slow_queries_total
+
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_queries_total += 1
+    db_query_seconds_total += elapsed
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total += elapsed
+        if elapsed > stats.slowest:
+            stats.slowest = elapsed
+            stats.slowest_statement = statement
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        db_slow_queries_total += 1
+        # parameters are left out on purpose: they can hold password hashes
+        slow_query_log.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(elapsed * 1000, 2),
+            "path": stats.path if stats else None,
+            "executemany": executemany,
+            "statement": " ".join(statement.split()),
+        }))
+
+
+def _handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute; drop its start
+    # time so the next statement on this pooled connection isn't timed
+    # against it and the stack doesn't grow for the connection's lifetime
+    conn = exception_context.connection
+    if conn is None:
+        return
+    starts = conn.info.get("query_start")
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    # works for sync engines and for AsyncEngine.sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# --------------------- PROMETHEUS TEXT FORMAT ---------------------
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class PrometheusText:
+    def __init__(self):
+        self.lines: List[str] = []
+        self._seen = set()
+
+    def add(
+        self,
+        name: str,
+        kind: str,
+        value: float,
+        help: str = "",
+        labels: Optional[Dict[str, Any]] = None,
+        family: Optional[str] = None,
+    ):
+        # histogram samples (x_bucket, x_sum, x_count) go under one family "x"
+        family = family or name
+        if family not in self._seen:
+            self._seen.add(family)
+            if help:
+                self.lines.append(f"# HELP {family} {help}")
+            self.lines.append(f"# TYPE {family} {kind}")
+        self.lines.append(f"{name}{_labels(labels or {})} {value}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def add_sql_metrics(out: PrometheusText):
+    out.add("db_queries_total", "counter", db_queries_total, "SQL statements executed")
+    out.add("db_query_seconds_total", "counter", round(db_query_seconds_total, 6), "Time spent in SQL statements")
+    out.add("db_slow_queries_total", "counter", db_slow_queries_total, f"Statements slower than {SLOW_QUERY_MS:g} ms")
+
+
+# --------------------- ROUTE LATENCY ---------------------
+# seconds; upper bounds of the histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+]
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate from the buckets, interpolating linearly inside one."""
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return LATENCY_BUCKETS[-1]
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "errors", "statuses")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.statuses: Dict[str, int] = {}
+
+
+route_metrics: Dict[str, RouteMetrics] = {}
+requests_in_flight = 0
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task hop) so the per-request
+    cost stays a couple of dict lookups and a bisect.
+    """
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        global requests_in_flight
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sampler = self.profiler.maybe_start() if self.profiler else None
+        requests_in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight -= 1
+
+            # the route is only known after routing, so count per route here
+            route = _route_template(scope)
+            m = route_metrics.get(route)
+            if m is None:
+                m = route_metrics[route] = RouteMetrics()
+            m.latency.observe(elapsed)
+            status_class = f"{status_code // 100}xx"
+            m.statuses[status_class] = m.statuses.get(status_class, 0) + 1
+            if status_code >= 500:
+                m.errors += 1
+
+            if sampler is not None:
+                await self.profiler.finish(sampler, route, elapsed)
+
+
+def latency_summary() -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for route, m in sorted(route_metrics.items()):
+        out[route] = {
+            "count": m.latency.count,
+            "errors": m.errors,
+            "p50_ms": _ms(m.latency.quantile(0.50)),
+            "p95_ms": _ms(m.latency.quantile(0.95)),
+            "p99_ms": _ms(m.latency.quantile(0.99)),
+        }
+    return out
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def add_route_metrics(out: PrometheusText):
+    out.add("http_requests_in_flight", "gauge", requests_in_flight, "Requests being handled right now")
+
+    family = "http_request_duration_seconds"
+    for route, m in sorted(route_metrics.items()):
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + [float("inf")], m.latency.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            out.add(
+                f"{family}_bucket", "histogram", cumulative,
+                "Request latency by route", {"route": route, "le": le}, family=family,
+            )
+        out.add(f"{family}_sum", "histogram", round(m.latency.sum, 6), labels={"route": route}, family=family)
+        out.add(f"{family}_count", "histogram", m.latency.count, labels={"route": route}, family=family)
+
+    for route, m in sorted(route_metrics.items()):
+        for status_class, n in sorted(m.statuses.items()):
+            out.add(
+                "http_requests_total", "counter", n,
+                "Requests by route and status class", {"route": route, "status": status_class},
+            )
+
+
+# --------------------- BENCHMARK ---------------------
+def _per_call_us(runners: Dict[str, Any], n: int, rounds: int = 7) -> Dict[str, float]:
+    # interleaved and best-of, so machine noise hits every variant alike
+    best = {label: float("inf") for label in runners}
+    for _ in range(rounds):
+        for label, run in runners.items():
+            start = time.perf_counter()
+            run(n)
+            best[label] = min(best[label], time.perf_counter() - start)
+    return {label: seconds / n * 1e6 for label, seconds in best.items()}
+
+
+def _benchmark(n: int = 20000):
+    import asyncio
+    import tempfile
+    from sqlalchemy import create_engine, text
+    from profiling import SamplingProfiler
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    def asgi_runner(app):
+        scope = {"type": "http", "method": "GET", "path": "/bench", "headers": []}
+
+        async def run(n):
+            for _ in range(n):
+                await app(scope, receive, send)
+
+        return lambda n: asyncio.run(run(n))
+
+    profile_dir = tempfile.mkdtemp(prefix="profiles-")
+    results = _per_call_us({
+        "ASGI request, no middleware": asgi_runner(endpoint),
+        "+ RequestMetricsMiddleware, sampling off": asgi_runner(
+            RequestMetricsMiddleware(endpoint, profiler=SamplingProfiler(0, profile_dir))
+        ),
+        "+ RequestMetricsMiddleware, 1 in 100 sampled": asgi_runner(
+            RequestMetricsMiddleware(endpoint, profiler=SamplingProfiler(100, profile_dir))
+        ),
+    }, n)
+
+    select_1 = text("SELECT 1")
+
+    def select_runner(engine):
+        def run(n):
+            with engine.connect() as conn:
+                for _ in range(n):
+                    conn.execute(select_1).scalar()
+        return run
+
+    plain, noop, timed = create_engine("sqlite://"), create_engine("sqlite://"), create_engine("sqlite://")
+    event.listen(noop, "before_cursor_execute", lambda *args: None)
+    event.listen(noop, "after_cursor_execute", lambda *args: None)
+    instrument_engine(timed)
+    start_request("/bench")
+    results.update(_per_call_us({
+        "SQLite SELECT 1": select_runner(plain),
+        "+ empty cursor listeners": select_runner(noop),
+        "+ instrument_engine()": select_runner(timed),
+    }, n))
+
+    baseline = None
+    for label, us in results.items():
+        if not label.startswith("+"):
+            baseline = us
+            print(f"{label:46} {us:7.2f} us")
+        else:
+            print(f"  {label:44} {us:7.2f} us  ({us - baseline:+.2f})")
+
+
+if __name__ == "__main__":
+    _benchmark()
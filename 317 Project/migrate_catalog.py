@@ -0,0 +1,103 @@
+"""
+One-off migration from per-user movie rows to the shared catalog.
+
+Before: movies had a user_id column, one row per (user, TMDb id).
+After:  one movies row per TMDb id, watchlists live in user_movies.
+
+Applied as migration 2 by migrations.py. `python migrate_catalog.py` is
+kept for old deploy scripts: it runs migrations.migrate(), which records the
+version and takes the migration lock, rather than applying this step alone.
+"""
+from sqlalchemy import inspect, text
+
+from database import engine
+import models
+
+
+def migrate_catalog(engine):
+    # migration 1 made user_movies already; this only covers a database that
+    # predates the schema_version table. Only this table, never create_all:
+    # tables that later migrations add must be left to those migrations.
+    models.UserMovie.__table__.create(bind=engine, checkfirst=True)
+
+    columns = [c["name"] for c in inspect(engine).get_columns("movies")]
+    if "user_id" not in columns:
+        print("movies.user_id already gone, nothing to migrate")
+        return
+
+    with engine.begin() as conn:
+        # canonical row per TMDb id = the oldest one
+        canonical_sql = """
+            SELECT external_id, MIN(id) AS id
+            FROM movies
+            GROUP BY external_id
+        """
+
+        # 1) copy ownership into the watchlist table
+        conn.execute(text(f"""
+            INSERT INTO user_movies (user_id, movie_id)
+            SELECT DISTINCT m.user_id, canon.id
+            FROM movies m
+            JOIN ({canonical_sql}) canon ON canon.external_id = m.external_id
+            WHERE m.user_id IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM user_movies um
+                  WHERE um.user_id = m.user_id AND um.movie_id = canon.id
+              );
+        """))
+
+        # 2) a user may have reviewed several duplicates of one film; keep their latest
+        conn.execute(text("""
+            DELETE FROM reviews
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT DISTINCT r1.id
+                    FROM reviews r1
+                    JOIN movies m1 ON m1.id = r1.movie_id
+                    JOIN reviews r2 ON r2.user_id = r1.user_id AND r2.id > r1.id
+                    JOIN movies m2 ON m2.id = r2.movie_id AND m2.external_id = m1.external_id
+                ) dup
+            );
+        """))
+
+        # 3) point reviews of duplicate rows at the canonical row
+        conn.execute(text("""
+            UPDATE reviews
+            SET movie_id = (
+                SELECT MIN(m2.id)
+                FROM movies m1
+                JOIN movies m2 ON m2.external_id = m1.external_id
+                WHERE m1.id = reviews.movie_id
+            )
+            WHERE movie_id IN (
+                SELECT id FROM movies
+            );
+        """))
+
+        # 4) drop the duplicates
+        conn.execute(text(f"""
+            DELETE FROM movies
+            WHERE id NOT IN (
+                SELECT id FROM ({canonical_sql}) keep
+            );
+        """))
+
+    # 5) drop the old column (its foreign key has to go first on MySQL)
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "mysql":
+                for fk in inspect(engine).get_foreign_keys("movies"):
+                    if fk["constrained_columns"] == ["user_id"] and fk.get("name"):
+                        conn.execute(text(f"ALTER TABLE movies DROP FOREIGN KEY {fk['name']};"))
+            conn.execute(text("ALTER TABLE movies DROP COLUMN user_id;"))
+    except Exception as e:
+        # SQLite can't drop a column that has a foreign key; it's nullable and unused now
+        print("Could not drop movies.user_id, leaving it in place:", e)
+
+    print("Catalog migration done")
+
+
+if __name__ == "__main__":
+    from migrations import migrate  # migrations imports this module
+
+    migrate(engine)
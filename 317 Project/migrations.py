@@ -0,0 +1,400 @@
+"""
+Versioned schema migrations and an index advisor.
+
+Applied versions are recorded in the schema_version table. Every migration
+is written to be safe on a database that already has some of its changes
+(tables created by the old create_all-at-import, indexes added by hand), so
+existing databases can adopt this without a special first step.
+
+    python migrations.py            apply pending migrations
+    python migrations.py --status   list applied / pending versions
+    python migrations.py --advise   compare the app's queries with existing indexes
+
+Run `python migrations.py` once per deploy: worker startup does no schema
+work unless AUTO_MIGRATE=true, which dev setups and the tests turn on.
+migrate() takes a cross-process lock first: a Postgres advisory lock,
+MySQL GET_LOCK, or an flock next to the SQLite file. Workers that start
+together with AUTO_MIGRATE on therefore queue up, and the first one
+applies the pending versions while the rest find nothing left to do.
+"""
+import ast
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.sql import func
+
+try:
+    import fcntl
+except ImportError:  # Windows: the SQLite lock is skipped, run one worker there
+    fcntl = None
+
+from database import Base, engine
+import models
+from migrate_catalog import migrate_catalog
+from search import create_fulltext_index
+from genres import backfill_genres
+from stats import backfill_movie_stats
+
+# kept out of Base.metadata: it belongs to the migration runner, not the app
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# --------------------- HELPERS ---------------------
+def index_columns(engine, table: str) -> List[Tuple[str, ...]]:
+    """Column lists of every index, unique constraint and primary key on `table`."""
+    insp = inspect(engine)
+    out = [tuple(ix["column_names"]) for ix in insp.get_indexes(table)]
+    out += [tuple(uq["column_names"]) for uq in insp.get_unique_constraints(table)]
+    pk = insp.get_pk_constraint(table).get("constrained_columns")
+    if pk:
+        out.append(tuple(pk))
+    return out
+
+
+def ensure_index(engine, table: str, name: str, columns: List[str], unique: bool = False) -> bool:
+    if tuple(columns) in index_columns(engine, table):
+        return False
+
+    unique_sql = "UNIQUE " if unique else ""
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE {unique_sql}INDEX {name} ON {table} ({', '.join(columns)});"))
+    print(f"  created index {name} on {table} ({', '.join(columns)})")
+    return True
+
+
+def add_column(engine, table: str, column_sql: str) -> bool:
+    """`column_sql` is the column definition, e.g. "version INTEGER NOT NULL DEFAULT 0"."""
+    name = column_sql.split()[0]
+    if name in {c["name"] for c in inspect(engine).get_columns(table)}:
+        return False
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_sql};"))
+    print(f"  added column {table}.{name}")
+    return True
+
+
+# --------------------- MIGRATIONS ---------------------
+def _baseline(engine):
+    # checkfirst: a no-op for tables the old create_all already made
+    Base.metadata.create_all(
+        bind=engine,
+        tables=[
+            models.User.__table__,
+            models.Movie.__table__,
+            models.UserMovie.__table__,
+            models.Review.__table__,
+            models.MovieStats.__table__,
+        ],
+    )
+
+
+def _indexes(engine):
+    # create_all never adds indexes to a table that already exists
+    ensure_index(engine, "users", "ix_users_username", ["username"], unique=True)
+    ensure_index(engine, "users", "ix_users_email", ["email"], unique=True)
+    ensure_index(engine, "movies", "ix_movies_external_id", ["external_id"], unique=True)
+    ensure_index(engine, "reviews", "uq_user_movie_review", ["user_id", "movie_id"], unique=True)
+    ensure_index(engine, "reviews", "ix_reviews_movie_created_id", ["movie_id", "created_at", "id"])
+    ensure_index(engine, "reviews", "ix_reviews_created_at", ["created_at"])
+    ensure_index(engine, "user_movies", "ix_user_movies_movie_id", ["movie_id"])
+
+
+def _genres(engine):
+    backfill_genres(engine)
+    ensure_index(engine, "movies", "ix_movies_year", ["year"])
+
+
+def _review_likes(engine):
+    Base.metadata.create_all(bind=engine, tables=[models.ReviewLike.__table__])
+
+
+def _stats_version(engine):
+    add_column(engine, "movie_stats", "version INTEGER NOT NULL DEFAULT 0")
+
+
+def _movie_refresh(engine):
+    add_column(engine, "movies", "refreshed_at TIMESTAMP NULL")
+    add_column(engine, "movies", "updated_at TIMESTAMP NULL")
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # the refresher stamps refreshed_at on every movie; only title /
+            # overview / genres changes should rewrite the FTS rows
+            conn.execute(text("DROP TRIGGER IF EXISTS movies_fts_update;"))
+        conn.execute(text("UPDATE movies SET refreshed_at = created_at WHERE refreshed_at IS NULL;"))
+    if engine.dialect.name == "sqlite":
+        create_fulltext_index(engine)
+    ensure_index(engine, "movies", "ix_movies_refreshed_at", ["refreshed_at"])
+
+
+# (version, name, fn(engine)); append only, never renumber
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline tables", _baseline),
+    (2, "shared movie catalog", migrate_catalog),
+    (3, "unique keys and query indexes", _indexes),
+    (4, "full-text index for movie search", create_fulltext_index),
+    (5, "normalized genres", _genres),
+    (6, "review likes", _review_likes),
+    (7, "movie_stats.version for ETags", _stats_version),
+    (8, "movie refresh timestamps", _movie_refresh),
+    (9, "movie_stats backfill from existing reviews", backfill_movie_stats),
+]
+
+
+def applied_versions(engine) -> Set[int]:
+    schema_version.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_version;"))}
+
+
+def pending_migrations(engine) -> List[Tuple[int, str, Callable]]:
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+MIGRATION_LOCK_NAME = "movies_schema_migrate"
+MIGRATION_LOCK_KEY = 317_000_001  # pg_advisory_lock takes a bigint
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "600"))
+
+
+@contextmanager
+def migration_lock(engine):
+    """Held for the whole of migrate(), on its own connection / file."""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}s';"))
+            conn.execute(text("SELECT pg_advisory_lock(:key);"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()  # the lock is session-level and outlives this; lock_timeout doesn't
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key);"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+    elif dialect == "mysql":
+        with engine.connect() as conn:
+            got = conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout);"),
+                {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT},
+            ).scalar()
+            if got != 1:
+                raise RuntimeError(f"Timed out waiting for the {MIGRATION_LOCK_NAME} lock")
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT RELEASE_LOCK(:name);"), {"name": MIGRATION_LOCK_NAME})
+                conn.commit()
+    elif dialect == "sqlite" and engine.url.database not in (None, "", ":memory:") and fcntl is not None:
+        with open(engine.url.database + ".migrate.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        # in-memory SQLite lives in one process anyway
+        yield
+
+
+def migrate(engine=engine) -> List[int]:
+    applied = []
+    with migration_lock(engine):
+        # read under the lock: another process may have just applied them
+        for version, name, fn in pending_migrations(engine):
+            start = time.perf_counter()
+            fn(engine)
+            with engine.begin() as conn:
+                conn.execute(schema_version.insert().values(version=version, name=name))
+            print(f"Applied migration {version}: {name} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            applied.append(version)
+    return applied
+
+
+# --------------------- INDEX ADVISOR ---------------------
+ADVISOR_SOURCES = ["main.py", "stats.py", "leaderboard.py", "export.py", "search.py", "catalog_refresh.py"]
+
+# (table, column) filters that scan on purpose
+ADVISOR_IGNORE = {
+    ("movie_stats", "review_count"),  # leaderboard rebuild; nearly every row matches
+}
+
+_STATEMENT_START = re.compile(r"^\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b", re.I)
+_TABLE_RE = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE)\s+(\w+)"
+    r"(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ON|LEFT|INNER|SET|ORDER|GROUP|LIMIT|RETURNING)\b)(\w+))?",
+    re.I,
+)
+_CONDITION_RE = re.compile(
+    r"\b(?:WHERE|ON)\b(.*?)(?=\bORDER\s+BY\b|\bGROUP\s+BY\b|\bLIMIT\b|\bJOIN\b|\bLEFT\b"
+    r"|\bINNER\b|\bRETURNING\b|\bWHERE\b|$)",
+    re.I,
+)
+_PREDICATE_RE = re.compile(
+    r"(?:(\w+)\.)?(\w+)\s*(=|<=|>=|<|>|\bIN\b)\s*(?:(\w+)\.(\w+)\b)?",
+    re.I,
+)
+_ORDER_RE = re.compile(r"\bORDER\s+BY\b(.*?)(?=\bLIMIT\b|;|$)", re.I)
+
+
+def _sql_strings(path: str) -> List[str]:
+    """SQL statements written as string literals (f-string holes become '?')."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+
+    in_fstring = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            in_fstring.update(id(v) for v in node.values)
+
+    out = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            sql = "".join(v.value if isinstance(v, ast.Constant) else " ? " for v in node.values)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in in_fstring:
+            sql = node.value
+        else:
+            continue
+        if _STATEMENT_START.match(sql) and re.search(r"\b(FROM|UPDATE)\b", sql, re.I):
+            out.append(" ".join(sql.split()))
+    return out
+
+
+def _query_shapes(sql: str, columns: Dict[str, Set[str]]) -> List[Dict[str, Any]]:
+    """
+    Per table: columns compared to a value with = / IN, columns joined to
+    another table, range comparisons and ORDER BY columns.
+    """
+    aliases: Dict[str, str] = {}
+    for table, alias in _TABLE_RE.findall(sql):
+        if table in columns:
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+    tables = list(OrderedDict.fromkeys(aliases.values()))
+    if not tables:
+        return []
+
+    def resolve(alias: str, column: str) -> Optional[str]:
+        if alias:
+            return aliases.get(alias)
+        owners = [t for t in tables if column in columns[t]]
+        return owners[0] if len(owners) == 1 else None
+
+    shapes = {t: {"table": t, "eq": [], "join": [], "range": [], "order": []} for t in tables}
+
+    def add(kind: str, alias: str, column: str):
+        table = resolve(alias, column)
+        if table and column in columns[table] and (table, column) not in ADVISOR_IGNORE:
+            if column not in shapes[table][kind]:
+                shapes[table][kind].append(column)
+
+    for condition in _CONDITION_RE.findall(sql):
+        for left_alias, left, op, right_alias, right in _PREDICATE_RE.findall(condition):
+            if right:
+                add("join", left_alias, left)
+                add("join", right_alias, right)
+            else:
+                add("eq" if op.upper() in ("=", "IN") else "range", left_alias, left)
+
+    for order in _ORDER_RE.findall(sql):
+        for part in order.split(","):
+            words = part.strip().split()
+            if words:
+                alias, _, column = words[0].rpartition(".")
+                add("order", alias, column)
+
+    return [s for s in shapes.values() if s["eq"] or s["join"] or s["range"]]
+
+
+def _usable_prefix(index: Tuple[str, ...], shape: Dict[str, Any]) -> int:
+    n = 0
+    for column in index:
+        if column in shape["eq"] or column in shape["join"]:
+            n += 1
+            continue
+        if column in shape["range"] or column in shape["order"]:
+            n += 1
+        break
+    return n
+
+
+def advise(engine=engine, sources: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    insp = inspect(engine)
+    existing = set(insp.get_table_names())
+    columns = {t: {c["name"] for c in insp.get_columns(t)} for t in existing}
+    indexes = {t: index_columns(engine, t) for t in existing}
+
+    report: Dict[Tuple, Dict[str, Any]] = OrderedDict()
+    for source in sources or ADVISOR_SOURCES:
+        for sql in _sql_strings(os.path.join(here, source)):
+            for shape in _query_shapes(sql, columns):
+                key = (shape["table"], tuple(shape["eq"]), tuple(shape["range"]), tuple(shape["order"]))
+                if key in report:
+                    report[key]["queries"] += 1
+                    continue
+
+                def score(ix):
+                    used = ix[:_usable_prefix(ix, shape)]
+                    return len(set(used) & set(shape["eq"])), len(used)
+
+                best = max(indexes[shape["table"]], key=score, default=())
+                prefix = _usable_prefix(best, shape) if best else 0
+                entry = {**shape, "queries": 1, "index": list(best[:prefix]) if prefix else None}
+                if not prefix:
+                    entry["status"] = "missing"
+                elif not set(shape["eq"]) <= set(best[:prefix]):
+                    entry["status"] = "partial"
+                else:
+                    entry["status"] = "ok"
+
+                if entry["status"] != "ok":
+                    wanted = (shape["eq"] or shape["join"]) + (shape["range"] or shape["order"])[:1]
+                    entry["suggest"] = (
+                        f"CREATE INDEX ix_{shape['table']}_{'_'.join(wanted)} "
+                        f"ON {shape['table']} ({', '.join(wanted)});"
+                    )
+                report[key] = entry
+
+    return list(report.values())
+
+
+def _print_advice(entries: List[Dict[str, Any]]):
+    for e in entries:
+        where = " ".join(
+            [f"{c}=" for c in e["eq"]] + [f"{c}=join" for c in e["join"]] + [f"{c}<>" for c in e["range"]]
+        )
+        order = f" order by {','.join(e['order'])}" if e["order"] else ""
+        line = f"{e['status']:8} {e['table']:12} {where}{order}  ({e['queries']} queries)"
+        if e["index"]:
+            line += f"  uses ({', '.join(e['index'])})"
+        if e.get("suggest"):
+            line += f"\n{'':21}suggest: {e['suggest']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        done = applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:4}  {'applied' if version in done else 'pending':8} {name}")
+    elif "--advise" in sys.argv:
+        entries = advise(engine)
+        _print_advice(entries)
+        sys.exit(1 if any(e["status"] == "missing" for e in entries) else 0)
+    else:
+        applied = migrate(engine)
+        print(f"{len(applied)} migration(s) applied" if applied else "Schema is up to date")
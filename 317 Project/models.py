@@ -7,6 +7,7 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     UniqueConstraint,
+    Index,
 )
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -28,8 +29,8 @@ class User(Base):
     # One user -> many reviews
     reviews = relationship("Review", back_populates="user")
 
-    # 🔥 One user -> many movies they “added/clicked”
-    movies = relationship("Movie", back_populates="user")
+    # 🔥 One user -> many movies they “added/clicked” (via user_movies)
+    movies = relationship("Movie", secondary="user_movies", back_populates="users")
 
 
 class Movie(Base):
@@ -37,18 +38,53 @@ class Movie(Base):
 
     id = Column(Integer, primary_key=True, index=True)
 
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # one catalog row per TMDb movie, shared by every user
     external_id = Column(String(50), unique=True, index=True)  # from TMDb
     title = Column(String(255), nullable=False)
-    year = Column(Integer, nullable=True)
+    year = Column(Integer, nullable=True, index=True)
     poster_url = Column(String(500), nullable=True)
     overview = Column(Text, nullable=True)
     genres = Column(String(255), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # last TMDb check / last time the metadata actually changed (catalog_refresh.py)
+    refreshed_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
 
     # relationships
-    user = relationship("User", back_populates="movies")
+    users = relationship("User", secondary="user_movies", back_populates="movies")
     reviews = relationship("Review", back_populates="movie")
+    genre_rows = relationship("Genre", secondary="movie_genres", back_populates="movies")
+
+
+class Genre(Base):
+    __tablename__ = "genres"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, index=True, nullable=False)
+
+    movies = relationship("Movie", secondary="movie_genres", back_populates="genre_rows")
+
+
+class MovieGenre(Base):
+    # movies.genres stays as the display string; filtering goes through here
+    __tablename__ = "movie_genres"
+
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True)
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+
+    __table_args__ = (
+        # "movies in genre X", newest first
+        Index("ix_movie_genres_genre_movie", "genre_id", "movie_id"),
+    )
+
+
+class UserMovie(Base):
+    # a user's watchlist: which catalog movies they added
+    __tablename__ = "user_movies"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
 class Review(Base):
@@ -72,4 +108,42 @@ class Review(Base):
 
     __table_args__ = (
         UniqueConstraint("user_id", "movie_id", name="uq_user_movie_review"),
+        # keyset pagination of a movie's reviews, newest first
+        Index("ix_reviews_movie_created_id", "movie_id", "created_at", "id"),
+        # the trending rebuild's "reviews since" window
+        Index("ix_reviews_created_at", "created_at"),
     )
+
+
+class ReviewLike(Base):
+    # who liked which review; reviews.likes is a cached count of these rows
+    __tablename__ = "review_likes"
+
+    review_id = Column(Integer, ForeignKey("reviews.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class MovieStats(Base):
+    # running review aggregates per movie, kept in step by the review endpoints
+    __tablename__ = "movie_stats"
+
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0)
+
+    # rating histogram: hist_n counts ratings in (n-1, n], clamped to 1..10
+    hist_1 = Column(Integer, nullable=False, default=0)
+    hist_2 = Column(Integer, nullable=False, default=0)
+    hist_3 = Column(Integer, nullable=False, default=0)
+    hist_4 = Column(Integer, nullable=False, default=0)
+    hist_5 = Column(Integer, nullable=False, default=0)
+    hist_6 = Column(Integer, nullable=False, default=0)
+    hist_7 = Column(Integer, nullable=False, default=0)
+    hist_8 = Column(Integer, nullable=False, default=0)
+    hist_9 = Column(Integer, nullable=False, default=0)
+    hist_10 = Column(Integer, nullable=False, default=0)
+
+    # bumped by every write that changes the movie's review list (reviews,
+    # like counts); the review and detail endpoints derive their ETags from it
+    version = Column(Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+# Keyset cursors for lists ordered by (created_at DESC, id DESC).
+# The cursor is the (created_at, id) of the last row the client saw.
+def encode_cursor(created_at: Any, row_id: int) -> str:
+    raw = json.dumps([str(created_at), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        # a datetime, not the string: PostgreSQL won't compare a timestamp to text
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# appended to a WHERE clause; expects :cursor_created_at / :cursor_id params
+def keyset_condition(table: str = "") -> str:
+    # `table` qualifies the columns when the query joins other tables
+    p = f"{table}." if table else ""
+    return f"""
+          AND ({p}created_at < :cursor_created_at
+               OR ({p}created_at = :cursor_created_at AND {p}id < :cursor_id))
+"""
+
+
+KEYSET_CONDITION = keyset_condition()
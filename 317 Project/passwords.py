@@ -0,0 +1,114 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+# --------------------- HASHING CONFIG ---------------------
+# changing the rounds makes old hashes "need update"; they get rehashed on next login
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+# "thread" works because hashlib's pbkdf2 releases the GIL; "process" for pure-python backends
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS * 2)))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__rounds=PASSWORD_HASH_ROUNDS,
+)
+
+
+# these run inside the worker pool (module level so a process pool can pickle them)
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_rehash(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, None
+
+    if pwd_context.needs_update(hashed_password):
+        return True, pwd_context.hash(plain_password)
+
+    return True, None
+
+
+class PasswordHasher:
+    """
+    Runs hashing on a bounded worker pool so a burst of signups / logins
+    doesn't pin the event loop. At most `concurrency` jobs are submitted at
+    once; the rest wait on the semaphore (that's the queue depth).
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        concurrency: int = PASSWORD_HASH_CONCURRENCY,
+        executor: str = PASSWORD_HASH_EXECUTOR,
+    ):
+        self.workers = workers
+        self.executor_kind = executor
+        self.concurrency = concurrency
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rehashed = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="password-hash",
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Returns (ok, new_hash). new_hash is set when the stored hash was made
+        with old settings and should be written back.
+        """
+        ok, new_hash = await self._run(_verify_and_rehash, plain_password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rehashed": self.rehashed,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
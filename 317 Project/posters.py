@@ -0,0 +1,280 @@
+"""
+Poster proxy with a content-addressed disk cache.
+
+Movie.poster_url points at TMDb's CDN, so every page load used to fetch
+from image.tmdb.org. GET /posters/{size}/{file}, where `file` is the last
+part of poster_url, serves the same image from local disk instead. The
+poster is downloaded once, and the file is sent with a year-long immutable
+Cache-Control header. FileResponse hands the path to the server when it
+supports zero-copy sends (the ASGI pathsend extension) and streams it in
+chunks otherwise.
+
+Layout under POSTER_CACHE_DIR:
+
+    blobs/ab/ab12...ef       image bytes named by their sha256; identical
+                             images (e.g. the same poster at two sizes TMDb
+                             doesn't distinguish) are stored once
+    refs/w185/xyz.jpg        the sha256 of the blob for that size + file
+
+Sizes below POSTER_SOURCE_SIZE are thumbnails. They are resized locally
+from the source image when Pillow is installed, otherwise fetched as TMDb's
+own size variant.
+
+Blobs are kept in an LRU loaded from their mtimes at startup. A hit touches
+the mtime at most every POSTER_TOUCH_SECONDS, so recency survives restarts.
+Past POSTER_CACHE_MAX_BYTES the least recently used blobs are deleted. A
+ref to a deleted blob is a miss. A blob handed out in the last
+POSTER_EVICT_GRACE_SECONDS is never deleted: its path may be on its way to
+a FileResponse (or to the resizer) that hasn't opened it yet. Once a file
+is open, deleting it doesn't disturb the send. So the cache can sit over
+its limit for that long under a burst of new posters.
+
+POSTER_CACHE_MAX_BYTES=0 turns the cache off, and every request is proxied
+to TMDb. That is the baseline for `python bench.py --preset posters`.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from cache import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:  # optional: thumbnails then come from TMDb's size variants
+    Image = None
+
+POSTER_CACHE_DIR = os.getenv("POSTER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "poster_cache"))
+POSTER_CACHE_MAX_BYTES = int(float(os.getenv("POSTER_CACHE_MAX_BYTES", str(1 << 30))))
+POSTER_IMAGE_BASE = os.getenv("POSTER_IMAGE_BASE", "https://image.tmdb.org/t/p")
+POSTER_SOURCE_SIZE = "w500"  # what Movie.poster_url stores
+POSTER_SIZES = ("w92", "w154", "w185", "w342", "w500", "w780", "original")
+POSTER_JPEG_QUALITY = int(os.getenv("POSTER_JPEG_QUALITY", "85"))
+POSTER_TOUCH_SECONDS = float(os.getenv("POSTER_TOUCH_SECONDS", "3600"))
+POSTER_EVICT_GRACE_SECONDS = float(os.getenv("POSTER_EVICT_GRACE_SECONDS", "30"))
+POSTER_TIMEOUT = float(os.getenv("POSTER_TIMEOUT", "10"))
+
+# TMDb file names; anything else never reaches the filesystem or the CDN
+POSTER_FILE_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}\.(jpg|jpeg|png|webp)$")
+MEDIA_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+
+def media_type(filename: str) -> str:
+    return MEDIA_TYPES[filename.rsplit(".", 1)[-1]]
+
+
+def _width(size: str) -> Optional[int]:
+    return int(size[1:]) if size.startswith("w") else None
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _thumbnail(data: bytes, width: int) -> bytes:
+    # same format as the source, so the file name's media type still fits
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format or "JPEG"
+        img.thumbnail((width, width * 10))
+        out = io.BytesIO()
+        if fmt == "JPEG":
+            img.convert("RGB").save(out, fmt, quality=POSTER_JPEG_QUALITY, optimize=True)
+        else:
+            img.save(out, fmt)
+        return out.getvalue()
+
+
+class PosterCache:
+    def __init__(
+        self,
+        cache_dir: str = POSTER_CACHE_DIR,
+        max_bytes: int = POSTER_CACHE_MAX_BYTES,
+        base_url: str = POSTER_IMAGE_BASE,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=POSTER_TIMEOUT, transport=transport)
+        self.singleflight = SingleFlight()
+
+        self._blobs: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, least recent first
+        self._touched: Dict[str, float] = {}
+        self._handed_out: Dict[str, float] = {}  # digest -> monotonic time its path was last returned
+        # (size, file) -> digest, only for blobs in the cache; dropped with the blob
+        self._refs: Dict[Tuple[str, str], str] = {}
+        self._refs_by_digest: Dict[str, Set[Tuple[str, str]]] = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.upstream_fetches = 0
+        self.thumbnails = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    def _ref_path(self, size: str, filename: str) -> str:
+        return os.path.join(self.cache_dir, "refs", size, filename)
+
+    def load(self):
+        """Index the blobs already on disk (blocking; run it in a thread)."""
+        found = []
+        blob_root = os.path.join(self.cache_dir, "blobs")
+        for root, _, files in os.walk(blob_root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                st = os.stat(os.path.join(root, name))
+                found.append((st.st_mtime, name, st.st_size))
+        found.sort()
+        self._blobs = OrderedDict((digest, size) for _, digest, size in found)
+        self.bytes = sum(self._blobs.values())
+        self._evict()
+        print(f"Poster cache loaded: {len(self._blobs)} files, {self.bytes / 1e6:.1f} MB")
+
+    # --------------------- LOOKUP ---------------------
+    def _cached(self, size: str, filename: str) -> Optional[str]:
+        digest = self._refs.get((size, filename))
+        if digest is None:
+            try:
+                with open(self._ref_path(size, filename)) as f:
+                    digest = f.read().strip()
+            except FileNotFoundError:
+                return None
+            if digest not in self._blobs:
+                return None
+            self._remember_ref(size, filename, digest)
+        if digest not in self._blobs:
+            return None
+        self._blobs.move_to_end(digest)
+        self._handed_out[digest] = time.monotonic()
+        return digest
+
+    def _touch(self, digest: str, path: str):
+        now = time.monotonic()
+        if now - self._touched.get(digest, 0.0) >= POSTER_TOUCH_SECONDS:
+            self._touched[digest] = now
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    async def get(self, size: str, filename: str) -> Tuple[str, str]:
+        """(path, sha256) of the cached file, downloading / resizing on a miss."""
+        if size not in POSTER_SIZES or not POSTER_FILE_RE.match(filename):
+            raise HTTPException(status_code=404, detail="Poster not found")
+
+        digest = self._cached(size, filename)
+        if digest is not None:
+            self.hits += 1
+            path = self._blob_path(digest)
+            self._touch(digest, path)
+            return path, digest
+
+        self.misses += 1
+        digest = await self.singleflight.do(f"{size}/{filename}", lambda: self._fill(size, filename))
+        return self._blob_path(digest), digest
+
+    async def _fill(self, size: str, filename: str) -> str:
+        width = _width(size)
+        if Image is not None and width and width < _width(POSTER_SOURCE_SIZE):
+            source_path, _ = await self.get(POSTER_SOURCE_SIZE, filename)
+            data = await asyncio.to_thread(self._resize, source_path, width)
+            self.thumbnails += 1
+        else:
+            data = await self.fetch(size, filename)
+        return await self._store(size, filename, data)
+
+    def _resize(self, path: str, width: int) -> bytes:
+        with open(path, "rb") as f:
+            return _thumbnail(f.read(), width)
+
+    async def fetch(self, size: str, filename: str) -> bytes:
+        """The image straight from TMDb (also the whole story when the cache is off)."""
+        if size not in POSTER_SIZES or not POSTER_FILE_RE.match(filename):
+            raise HTTPException(status_code=404, detail="Poster not found")
+        self.upstream_fetches += 1
+        try:
+            resp = await self.client.get(f"/{size}/{filename}")
+        except httpx.HTTPError as e:
+            print("Poster fetch error:", size, filename, e)
+            raise HTTPException(status_code=502, detail="Poster upstream error")
+        if resp.status_code == 404:
+            raise HTTPException(status_code=404, detail="Poster not found")
+        if resp.status_code != 200:
+            raise HTTPException(status_code=502, detail="Poster upstream error")
+        return resp.content
+
+    async def _store(self, size: str, filename: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._blobs:
+            await asyncio.to_thread(_write_atomic, self._blob_path(digest), data)
+            self._blobs[digest] = len(data)
+            self.bytes += len(data)
+        self._blobs.move_to_end(digest)
+        self._handed_out[digest] = time.monotonic()
+        await asyncio.to_thread(_write_atomic, self._ref_path(size, filename), digest.encode())
+        self._remember_ref(size, filename, digest)
+        self._evict()
+        return digest
+
+    def _remember_ref(self, size: str, filename: str, digest: str):
+        key = (size, filename)
+        old = self._refs.get(key)
+        if old is not None and old != digest:
+            self._refs_by_digest[old].discard(key)
+        self._refs[key] = digest
+        self._refs_by_digest.setdefault(digest, set()).add(key)
+
+    def _evict(self):
+        # the newest blob stays even if it alone is over the limit
+        grace_start = time.monotonic() - POSTER_EVICT_GRACE_SECONDS
+        while self.bytes > self.max_bytes and len(self._blobs) > 1:
+            digest = next(iter(self._blobs))
+            # in LRU order, so if the oldest is still in its grace period all are
+            if self._handed_out.get(digest, float("-inf")) > grace_start:
+                break
+            size = self._blobs.pop(digest)
+            self.bytes -= size
+            self._touched.pop(digest, None)
+            self._handed_out.pop(digest, None)
+            for key in self._refs_by_digest.pop(digest, ()):
+                del self._refs[key]
+            self.evictions += 1
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._blobs),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "upstream_fetches": self.upstream_fetches,
+            "thumbnails": self.thumbnails,
+            "evictions": self.evictions,
+            "pillow": Image is not None,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,110 @@
+"""
+On-demand sampling profiler.
+
+When enabled, one request in every `every` is profiled: a background thread
+samples the event loop thread's Python stack every PROFILE_INTERVAL_MS while
+that request is running, and the samples are written to PROFILE_DIR in
+"folded" format (func;func;func count per line), which flamegraph.pl and
+speedscope read directly.
+
+The event loop interleaves requests, so a sample can land in another
+request's code; with sampling every N requests that's noise, not bias.
+When disabled, the only cost per request is one integer check.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))  # 0 = off
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+def _folded(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_folded(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def signal_stop(self):
+        # stop sampling now; stop() can then join without waiting long
+        self._stop.set()
+
+
+class SamplingProfiler:
+    def __init__(self, every: int = PROFILE_SAMPLE_EVERY, out_dir: str = PROFILE_DIR):
+        self.every = every
+        self.out_dir = out_dir
+        self._seen = 0
+        self.profiles_written = 0
+
+    def configure(self, every: int):
+        self.every = max(every, 0)
+        self._seen = 0
+
+    def maybe_start(self) -> Optional[StackSampler]:
+        if not self.every:
+            return None
+
+        self._seen += 1
+        if self._seen % self.every:
+            return None
+
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+        return sampler
+
+    async def finish(self, sampler: StackSampler, route: str, elapsed: float) -> Optional[str]:
+        """Joins the sampler and writes its profile off the event loop."""
+        sampler.signal_stop()
+        return await asyncio.get_running_loop().run_in_executor(None, self._write, sampler, route, elapsed)
+
+    def _write(self, sampler: StackSampler, route: str, elapsed: float) -> Optional[str]:
+        samples = sampler.stop()
+        if not samples:
+            return None
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe_route = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = os.path.join(
+            self.out_dir,
+            f"{safe_route}-{int(time.time() * 1000)}-{elapsed * 1000:.0f}ms.folded",
+        )
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        self.profiles_written += 1
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        return {"every": self.every, "profiles_written": self.profiles_written}
@@ -1,5 +1,15 @@
-from pydantic import BaseModel, EmailStr, HttpUrl,Field
-from typing import Optional,List
+from datetime import datetime
+from pydantic import BaseModel, EmailStr, HttpUrl,Field, BeforeValidator
+from typing import Optional,List,Dict,Annotated
+
+
+def _timestamp_str(value):
+    # SQLite hands back strings; MySQL and PostgreSQL drivers return datetimes
+    return str(value) if isinstance(value, datetime) else value
+
+
+Timestamp = Annotated[Optional[str], BeforeValidator(_timestamp_str)]
+
 
 class UserCreate(BaseModel):
     username: str
@@ -21,7 +31,7 @@ class UserRead(BaseModel):
     full_name: Optional[str]
     bio: Optional[str]
     profile_picture: Optional[str]
-    created_at: Optional[str]
+    created_at: Timestamp
 
     class Config:
         from_attributes = True
@@ -69,17 +79,65 @@ class ReviewRead(BaseModel):
     rating: float
     comment: Optional[str]
     likes: int
-    created_at: Optional[str]
+    created_at: Timestamp
 
     class Config:
         from_attributes = True
 
 
-class MovieDetail(MovieRead):
-    reviews: List[ReviewRead] = Field(default_factory=list)
-
 class UserUpdateProfile(BaseModel):
     username: Optional[str] = None
     full_name: Optional[str] = None
     bio: Optional[str] = None
-    profile_picture: Optional[HttpUrl] = None
\ No newline at end of file
+    profile_picture: Optional[HttpUrl] = None
+
+
+class MovieStatsRead(BaseModel):
+    movie_id: int
+    review_count: int
+    average_rating: Optional[float]
+    histogram: Dict[int, int]
+
+
+class MovieDetail(MovieRead):
+    stats: Optional[MovieStatsRead] = None
+    reviews: List[ReviewRead] = Field(default_factory=list)
+    # ?cursor= for /movies/tmdb/{id}/reviews to continue after `reviews`
+    next_reviews_cursor: Optional[str] = None
+
+
+class LeaderboardEntry(BaseModel):
+    movie_id: int
+    score: float
+    review_count: Optional[int] = None
+    average_rating: Optional[float] = None
+
+
+class MovieBatchImport(BaseModel):
+    tmdb_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+
+class MovieImportResult(BaseModel):
+    tmdb_id: int
+    status: str  # "added", "already_saved" or "failed"
+    movie_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class MovieSearchResult(MovieBase):
+    id: int
+    external_id: str
+    score: float
+
+
+class MovieFilterResult(MovieBase):
+    id: int
+    external_id: str
+    review_count: int = 0
+    average_rating: Optional[float] = None
+
+
+class ReviewLikeRead(BaseModel):
+    review_id: int
+    liked: bool
+    likes: int
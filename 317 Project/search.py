@@ -0,0 +1,488 @@
+"""
+Movie search over title, overview and genres.
+
+SearchIndex is an in-process inverted index: every term maps to two parallel
+arrays (document numbers in ascending order, weighted term frequency), so a
+million titles fit in tens of MB instead of one dict entry per posting.
+Queries are ANDed; the last word is treated as a prefix for typeahead
+("the godf" -> godfather) and expanded to its most common completions.
+Results are ranked with BM25 over field-weighted term frequencies. Every
+posting can rank: postings are split into blocks with a score bound, and
+blocks whose bound can't reach the current top results are skipped.
+
+The index is rebuilt from the movies table at startup, updated in place when
+this worker inserts a movie, and catches up on other workers' inserts every
+SEARCH_REFRESH_SECONDS. Every SEARCH_REBUILD_SECONDS it is rebuilt from
+scratch (briefly holding two copies) to pick up everything else.
+SEARCH_BACKEND=database skips all of this and uses the database's own
+full-text index instead (see search_database).
+
+Benchmark typeahead latency with:  python search.py [n_titles]
+"""
+import asyncio
+import bisect
+import heapq
+import itertools
+import math
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "memory")  # "memory" or "database"
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "60"))
+# full document evaluations per query, spent best bound first. Queries that
+# reach it (two very common words ANDed) return the best of the highest-bound
+# documents instead of an exact top `limit`; see stats()["truncated"]
+SEARCH_MAX_SCORED = int(os.getenv("SEARCH_MAX_SCORED", "5000"))
+# catch-up only reads ids above the newest one seen; a full rebuild also
+# picks up rows that committed out of id order and catalog edits
+SEARCH_REBUILD_SECONDS = float(os.getenv("SEARCH_REBUILD_SECONDS", "3600"))
+# completions tried for the word being typed, most common first
+SEARCH_PREFIX_EXPANSIONS = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", "8"))
+
+FIELD_WEIGHTS = {"title": 3.0, "genres": 1.5, "overview": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# postings per block; each block keeps its best tf and shortest document,
+# which bound the BM25 score of everything in it
+SEARCH_BLOCK_SIZE = 128
+
+_WORD_RE = re.compile(r"\w+")
+
+# doc numbers (ascending), weighted term frequencies, per-block max tf, per-block min doc length
+Postings = Tuple[array, array, array, array]
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    # lowercase and strip accents so "Amélie" matches "amelie"
+    folded = unicodedata.normalize("NFKD", value.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _WORD_RE.findall(folded)
+
+
+class SearchIndex:
+    def __init__(self, field_weights: Dict[str, float] = FIELD_WEIGHTS):
+        self.field_weights = field_weights
+
+        self._postings: Dict[str, Postings] = {}
+        self._vocab: List[str] = []  # sorted, for prefix lookups
+        self._vocab_dirty = False
+        self._expansions: Dict[str, List[Postings]] = {}  # prefix -> cached _expand
+
+        self._movie_ids = array("i")  # doc number -> movie id
+        self._doc_len = array("f")    # doc number -> weighted length
+        self._docno: Dict[int, int] = {}  # movie id -> live doc number
+        self._deleted: Set[int] = set()
+        self._total_len = 0.0
+
+        self.max_movie_id = 0
+        self.ready = False
+        self.truncated = 0
+        self._replay: Optional[List[Tuple[int, Mapping[str, Any]]]] = None  # adds during a rebuild
+
+    # --------------------- WRITES ---------------------
+    def add(self, movie_id: int, movie: Mapping[str, Any], _bulk: bool = False):
+        """Index (or re-index) one movie; `movie` needs title/overview/genres."""
+        if self._replay is not None:
+            self._replay.append((movie_id, movie))
+        old = self._docno.pop(movie_id, None)
+        if old is not None:
+            # postings are append-only; the old version is skipped at query time
+            self._deleted.add(old)
+            self._total_len -= self._doc_len[old]
+
+        weights: Dict[str, float] = {}
+        for field, weight in self.field_weights.items():
+            for term in tokenize(movie.get(field)):
+                weights[term] = weights.get(term, 0.0) + weight
+
+        docno = len(self._movie_ids)
+        length = sum(weights.values())
+        self._movie_ids.append(movie_id)
+        self._doc_len.append(length)
+        self._docno[movie_id] = docno
+        self._total_len += length
+        self.max_movie_id = max(self.max_movie_id, movie_id)
+
+        for term, tf in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("f"), array("f"), array("f"))
+                self._expansions.clear()
+                if _bulk:
+                    self._vocab_dirty = True
+                else:
+                    bisect.insort(self._vocab, term)
+            ids, tfs, block_tf, block_len = postings
+            if len(ids) % SEARCH_BLOCK_SIZE == 0:
+                block_tf.append(tf)
+                block_len.append(length)
+            else:
+                block_tf[-1] = max(block_tf[-1], tf)
+                block_len[-1] = min(block_len[-1], length)
+            ids.append(docno)
+            tfs.append(tf)
+
+    def add_many(self, rows: Iterable[Mapping[str, Any]]):
+        for row in rows:
+            self.add(row["id"], row, _bulk=True)
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+
+    # --------------------- QUERIES ---------------------
+    def __len__(self):
+        return len(self._docno)
+
+    def _expand(self, prefix: str) -> List[Postings]:
+        # typeahead asks for the same short prefixes over and over; the cache is
+        # dropped whenever a new term could add a completion
+        cached = self._expansions.get(prefix)
+        if cached is not None:
+            return cached
+
+        lo = bisect.bisect_left(self._vocab, prefix)
+        hi = bisect.bisect_left(self._vocab, prefix + "￿", lo)
+        terms = self._vocab[lo:hi]
+        if len(terms) > SEARCH_PREFIX_EXPANSIONS:
+            terms = heapq.nlargest(
+                SEARCH_PREFIX_EXPANSIONS, terms, key=lambda t: len(self._postings[t][0])
+            )
+        if len(self._expansions) >= 10000:
+            self._expansions.clear()
+        expansion = self._expansions[prefix] = [self._postings[t] for t in terms]
+        return expansion
+
+    def search(self, query: str, limit: int = 10, prefix: bool = True) -> List[Tuple[int, float]]:
+        """Best `limit` (movie_id, score) pairs; every word has to match."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._docno or limit < 1:
+            return []
+
+        # each group is a list of postings; a document must be in one of them
+        groups: List[List[Postings]] = []
+        typing_last = prefix and not query[-1:].isspace()
+        for i, term in enumerate(tokens):
+            if typing_last and i == len(tokens) - 1:
+                group = self._expand(term)
+            else:
+                postings = self._postings.get(term)
+                group = [postings] if postings else []
+            if not group:
+                return []
+            groups.append(group)
+
+        n_docs = len(self._docno)
+        avg_len = self._total_len / n_docs
+        doc_len = self._doc_len
+        deleted = self._deleted
+        k1, b = BM25_K1, BM25_B
+
+        def idf(ids) -> float:
+            df = len(ids)
+            return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+        def bm25(weight: float, tf: float, length: float) -> float:
+            # rises with tf, falls with length: (max tf, min length) bounds a block
+            return weight * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+
+        # drive from the group with the fewest postings, check the others by bisect
+        groups.sort(key=lambda g: sum(len(p[0]) for p in g))
+        weighted = [[(p[0], p[1], idf(p[0]), max(p[2])) for p in group] for group in groups]
+
+        # the most a document of a given length could score in each group, and in all
+        group_bounds: Dict[float, List[float]] = {}
+
+        def bounds(length: float) -> List[float]:
+            ub = group_bounds.get(length)
+            if ub is None:
+                ub = [max(bm25(w, tf_max, length) for _, _, w, tf_max in lists) for lists in weighted]
+                ub = group_bounds[length] = ub + [sum(ub)]
+            return ub
+
+        bisect_left = bisect.bisect_left
+
+        def score(docno: int, length: float) -> float:
+            # the sum over groups of the document's best posting in each
+            total = 0.0
+            for lists in weighted:
+                best = 0.0
+                for ids, tfs, weight, _ in lists:
+                    i = bisect_left(ids, docno)
+                    if i < len(ids) and ids[i] == docno:
+                        best = max(best, bm25(weight, tfs[i], length))
+                if not best:
+                    return 0.0
+                total += best
+            return total
+
+        # every posting can rank. The smallest group's blocks are visited best
+        # bound first (its own block bound plus the other groups' best at that
+        # length); once the next bound can't beat the current top `limit`,
+        # nothing left can get in
+        blocks = []
+        for n, (_, _, block_tf, block_len) in enumerate(groups[0]):
+            weight = weighted[0][n][2]
+            for j, (tf, length) in enumerate(zip(block_tf, block_len)):
+                ub = bounds(length)
+                blocks.append((bm25(weight, tf, length) + ub[-1] - ub[0], n, j))
+        blocks.sort(reverse=True)
+
+        top: List[Tuple[float, int]] = []  # min-heap of (score, docno)
+        seen: Set[int] = set()
+        for bound, n, j in blocks:
+            if len(top) == limit and bound <= top[0][0]:
+                break
+            if len(seen) >= SEARCH_MAX_SCORED:
+                self.truncated += 1
+                break
+            ids = groups[0][n][0]
+            for docno in ids[j * SEARCH_BLOCK_SIZE:(j + 1) * SEARCH_BLOCK_SIZE]:
+                if docno in seen or docno in deleted:
+                    continue
+                length = doc_len[docno]
+                full = len(top) == limit
+                if full and bounds(length)[-1] <= top[0][0]:
+                    continue
+                seen.add(docno)
+                total = score(docno, length)
+                if not total:
+                    continue
+                if not full:
+                    heapq.heappush(top, (total, docno))
+                elif total > top[0][0]:
+                    heapq.heapreplace(top, (total, docno))
+
+        return [(self._movie_ids[docno], total) for total, docno in sorted(top, reverse=True)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._docno),
+            "terms": len(self._postings),
+            "postings": sum(len(p[0]) for p in self._postings.values()),
+            "deleted": len(self._deleted),
+            "truncated": self.truncated,
+            "ready": self.ready,
+        }
+
+    # --------------------- LOADING ---------------------
+    async def load_since(self, db: AsyncSession, after_id: int = 0) -> int:
+        sql = text("""
+            SELECT id, title, overview, genres
+            FROM movies
+            WHERE id > :after_id
+            ORDER BY id;
+        """)
+        result = await db.stream(sql, {"after_id": after_id})
+        n = 0
+        async for rows in result.mappings().partitions(1000):
+            self.add_many(rows)
+            n += len(rows)
+            await asyncio.sleep(0)  # let requests run between chunks
+        return n
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        fresh = SearchIndex(self.field_weights)
+        replay = self._replay = []
+        try:
+            n = await fresh.load_since(db)
+            # inserts this worker made meanwhile may have missed the scan
+            for movie_id, movie in replay:
+                fresh.add(movie_id, movie)
+        finally:
+            self._replay = None
+        fresh.ready = True
+        # swap everything at once so queries never see a half-built index
+        self.__dict__.update(fresh.__dict__)
+        return n
+
+    async def run(self, session_factory, interval: float = SEARCH_REFRESH_SECONDS):
+        # started from the app lifespan: full build, then pick up other workers' inserts
+        last_rebuild: Optional[float] = None
+        while True:
+            try:
+                async with session_factory() as db:
+                    if last_rebuild is None or time.monotonic() - last_rebuild >= SEARCH_REBUILD_SECONDS:
+                        start = time.perf_counter()
+                        n = await self.rebuild(db)
+                        last_rebuild = time.monotonic()
+                        print(f"Search index built: {n} movies in {time.perf_counter() - start:.1f}s")
+                    else:
+                        await self.load_since(db, self.max_movie_id)
+            except Exception as e:
+                print("Search index load error:", e)
+            await asyncio.sleep(interval)
+
+
+# --------------------- DATABASE FULL-TEXT ---------------------
+def _fulltext_terms(query: str, prefix: bool) -> List[str]:
+    tokens = tokenize(query)
+    if prefix and tokens and not query[-1:].isspace():
+        tokens[-1] += "*"
+    return tokens
+
+
+async def search_database(db: AsyncSession, query: str, limit: int = 10, prefix: bool = True) -> List[Tuple[int, float]]:
+    """
+    Same contract as SearchIndex.search, answered by the database's own
+    full-text index (created by migration 4): FULLTEXT on MySQL, a GIN
+    tsvector index on PostgreSQL, an FTS5 table on SQLite.
+    """
+    terms = _fulltext_terms(query, prefix)
+    if not terms:
+        return []
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        sql = """
+            SELECT id, MATCH(title, overview, genres) AGAINST (:q IN BOOLEAN MODE) AS score
+            FROM movies
+            WHERE MATCH(title, overview, genres) AGAINST (:q IN BOOLEAN MODE)
+            ORDER BY score DESC
+            LIMIT :limit;
+        """
+        q = " ".join("+" + t for t in terms)
+    elif dialect == "postgresql":
+        sql = f"""
+            SELECT id, ts_rank({PG_SEARCH_VECTOR}, to_tsquery('simple', :q)) AS score
+            FROM movies
+            WHERE {PG_SEARCH_VECTOR} @@ to_tsquery('simple', :q)
+            ORDER BY score DESC
+            LIMIT :limit;
+        """
+        q = " & ".join(t[:-1] + ":*" if t.endswith("*") else t for t in terms)
+    else:
+        # bm25() is "lower is better" in FTS5
+        sql = """
+            SELECT rowid AS id, -bm25(movies_fts) AS score
+            FROM movies_fts
+            WHERE movies_fts MATCH :q
+            ORDER BY bm25(movies_fts)
+            LIMIT :limit;
+        """
+        q = " ".join(f'"{t[:-1]}"*' if t.endswith("*") else f'"{t}"' for t in terms)
+
+    rows = (await db.execute(text(sql), {"q": q, "limit": limit})).all()
+    return [(row[0], float(row[1] or 0)) for row in rows]
+
+
+# the expression the PostgreSQL GIN index is built on; queries must match it exactly
+PG_SEARCH_VECTOR = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(overview, '') "
+    "|| ' ' || coalesce(genres, ''))"
+)
+
+
+def create_fulltext_index(engine):
+    """Migration 4. Idempotent; skipped with a message where unsupported."""
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "mysql":
+            exists = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = 'movies'
+                  AND index_name = 'ft_movies_search';
+            """)).scalar()
+            if not exists:
+                conn.execute(text("ALTER TABLE movies ADD FULLTEXT INDEX ft_movies_search (title, overview, genres);"))
+        elif dialect == "postgresql":
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_movies_search ON movies USING GIN ({PG_SEARCH_VECTOR});"))
+        elif dialect == "sqlite":
+            try:
+                conn.execute(text("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts
+                    USING fts5(title, overview, genres, content='movies', content_rowid='id');
+                """))
+            except Exception as e:
+                print("SQLite FTS5 not available, skipping full-text index:", e)
+                return
+            # external-content table: keep it in step with movies
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN
+                    INSERT INTO movies_fts (rowid, title, overview, genres)
+                    VALUES (new.id, new.title, new.overview, new.genres);
+                END;
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN
+                    INSERT INTO movies_fts (movies_fts, rowid, title, overview, genres)
+                    VALUES ('delete', old.id, old.title, old.overview, old.genres);
+                END;
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS movies_fts_update
+                AFTER UPDATE OF title, overview, genres ON movies BEGIN
+                    INSERT INTO movies_fts (movies_fts, rowid, title, overview, genres)
+                    VALUES ('delete', old.id, old.title, old.overview, old.genres);
+                    INSERT INTO movies_fts (rowid, title, overview, genres)
+                    VALUES (new.id, new.title, new.overview, new.genres);
+                END;
+            """))
+            conn.execute(text("INSERT INTO movies_fts (movies_fts) VALUES ('rebuild');"))
+
+
+# --------------------- BENCHMARK ---------------------
+def _synthetic_titles(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ra", "the", "nor", "vel", "ta", "sin", "dor", "an", "gel", "mar", "o", "zu", "bel"]
+    # zipf-ish vocabulary, like real titles: a few very common words, a long tail
+    vocab = list(dict.fromkeys(
+        "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(60000)
+    ))
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocab))))
+    genres = ["Drama", "Comedy", "Action", "Horror", "Romance", "Thriller", "Documentary", "Animation"]
+    for i in range(n):
+        words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(1, 5))
+        yield {
+            "id": i + 1,
+            "title": " ".join(words).title(),
+            "genres": ", ".join(rng.sample(genres, 2)),
+            "overview": None,
+        }, words
+
+
+def _benchmark(n: int, queries: int = 2000):
+    index = SearchIndex()
+    start = time.perf_counter()
+    samples = []
+    rows = []
+    for row, words in _synthetic_titles(n):
+        rows.append(row)
+        if len(samples) < queries and row["id"] % 7 == 0:
+            samples.append(words)
+        if len(rows) == 10000:
+            index.add_many(rows)
+            rows = []
+    index.add_many(rows)
+    print(f"indexed {len(index)} titles in {time.perf_counter() - start:.1f}s: {index.stats()}")
+
+    rng = random.Random(2)
+    for label, make in [
+        ("typeahead, 1 word", lambda w: w[0][: rng.randint(1, len(w[0]))]),
+        ("typeahead, 2 words", lambda w: " ".join(w[:2])[: rng.randint(len(w[0]) + 2, len(" ".join(w[:2])))] if len(w) > 1 else w[0][:3]),
+        ("full words", lambda w: " ".join(w[:3]) + " "),
+    ]:
+        latencies = []
+        for words in samples:
+            q = make(words)
+            t0 = time.perf_counter()
+            index.search(q, limit=10)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        pct = lambda p: latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+        print(f"{label:20} p50 {pct(0.5):6.2f} ms   p95 {pct(0.95):6.2f} ms   p99 {pct(0.99):6.2f} ms   max {latencies[-1] * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
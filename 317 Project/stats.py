@@ -0,0 +1,214 @@
+"""
+Per-movie rating aggregates (movie_stats).
+
+add_review / update_review / delete_review call apply_rating_change inside
+their own transaction, so the aggregate commits or rolls back with the
+review itself. check_movie_stats recomputes everything from reviews and
+reports (optionally fixes) any drift. Migration 9 (backfill_movie_stats)
+fills in movies that were reviewed before movie_stats existed.
+
+Run the checker with:  python stats.py [--fix]
+"""
+import asyncio
+import math
+import sys
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text, bindparam, Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+RATING_BUCKETS = 10
+HIST_COLUMNS = [f"hist_{n}" for n in range(1, RATING_BUCKETS + 1)]
+STATS_COLUMNS = ["review_count", "rating_sum"] + HIST_COLUMNS
+
+
+def rating_bucket(rating: float) -> int:
+    if not math.isfinite(rating):
+        # ratings aren't range-checked; ceil() can't take inf / NaN
+        return RATING_BUCKETS if rating > 0 else 1
+    return min(max(math.ceil(rating), 1), RATING_BUCKETS)
+
+
+def _bucket_condition(n: int) -> str:
+    # same as rating_bucket(), in SQL every dialect understands
+    if n == 1:
+        return "rating <= 1"
+    if n == RATING_BUCKETS:
+        return f"rating > {n - 1}"
+    return f"rating > {n - 1} AND rating <= {n}"
+
+
+# aggregates recomputed from scratch, one row per movie
+RECOMPUTE_SELECT = ",\n".join(
+    ["COUNT(*) AS review_count", "COALESCE(SUM(rating), 0) AS rating_sum"]
+    + [
+        f"COALESCE(SUM(CASE WHEN {_bucket_condition(n)} THEN 1 ELSE 0 END), 0) AS hist_{n}"
+        for n in range(1, RATING_BUCKETS + 1)
+    ]
+)
+
+
+async def _insert_recomputed(db: AsyncSession, movie_id: int, version: int = 1):
+    insert_sql = text(f"""
+        INSERT INTO movie_stats (movie_id, {", ".join(STATS_COLUMNS)}, version)
+        SELECT :movie_id, {RECOMPUTE_SELECT}, :version
+        FROM reviews
+        WHERE movie_id = :movie_id;
+    """).bindparams(  # typed for the SELECT list on PostgreSQL
+        bindparam("movie_id", type_=Integer),
+        bindparam("version", type_=Integer),
+    )
+    await db.execute(insert_sql, {"movie_id": movie_id, "version": version})
+
+
+async def apply_rating_change(
+    db: AsyncSession,
+    movie_id: int,
+    removed: Optional[float] = None,
+    added: Optional[float] = None,
+):
+    """
+    Adjust movie_stats for one review write: added only = new review,
+    removed only = deleted review, both = rating changed. Call it after the
+    review write, before commit.
+    """
+    count_delta = (added is not None) - (removed is not None)
+    sum_delta = (added or 0) - (removed or 0)
+
+    hist_delta: Dict[int, int] = {}
+    if removed is not None:
+        hist_delta[rating_bucket(removed)] = hist_delta.get(rating_bucket(removed), 0) - 1
+    if added is not None:
+        hist_delta[rating_bucket(added)] = hist_delta.get(rating_bucket(added), 0) + 1
+
+    sets = [
+        "review_count = review_count + :count_delta",
+        "rating_sum = rating_sum + :sum_delta",
+        "version = version + 1",
+    ]
+    params: Dict[str, Any] = {
+        "movie_id": movie_id,
+        "count_delta": count_delta,
+        "sum_delta": sum_delta,
+    }
+    for bucket, delta in hist_delta.items():
+        if delta:
+            sets.append(f"hist_{bucket} = hist_{bucket} + :hist_{bucket}_delta")
+            params[f"hist_{bucket}_delta"] = delta
+
+    update_sql = text(f"""
+        UPDATE movie_stats
+        SET {", ".join(sets)}
+        WHERE movie_id = :movie_id;
+    """)
+
+    result = await db.execute(update_sql, params)
+    if result.rowcount:
+        return
+
+    # no stats row yet: build it from the reviews table, which already
+    # includes this write because we're in the same transaction
+    try:
+        async with db.begin_nested():
+            await _insert_recomputed(db, movie_id)
+    except IntegrityError:
+        # a concurrent request created the row first
+        await db.execute(update_sql, params)
+
+
+def stats_to_read(movie_id: int, row: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    count = row["review_count"] if row and row["review_count"] is not None else 0
+    total = row["rating_sum"] if row and row["rating_sum"] is not None else 0
+
+    return {
+        "movie_id": movie_id,
+        "review_count": count,
+        "average_rating": (total / count) if count else None,
+        "histogram": {
+            n: (row[f"hist_{n}"] or 0) if row else 0
+            for n in range(1, RATING_BUCKETS + 1)
+        },
+    }
+
+
+# --------------------- CONSISTENCY CHECK ---------------------
+async def check_movie_stats(db: AsyncSession, fix: bool = False) -> List[Dict[str, Any]]:
+    """
+    Recompute every movie's aggregates from reviews and compare them with
+    movie_stats. Returns one entry per drifted movie; fix=True rewrites them.
+    """
+    expected_sql = text(f"""
+        SELECT movie_id, {RECOMPUTE_SELECT}
+        FROM reviews
+        GROUP BY movie_id;
+    """)
+    actual_sql = text(f"""
+        SELECT movie_id, {", ".join(STATS_COLUMNS)}, version
+        FROM movie_stats;
+    """)
+
+    expected = {
+        row["movie_id"]: dict(row)
+        for row in (await db.execute(expected_sql)).mappings()
+    }
+    actual = {
+        row["movie_id"]: dict(row)
+        for row in (await db.execute(actual_sql)).mappings()
+    }
+
+    empty = {col: 0 for col in STATS_COLUMNS}
+    drift = []
+    for movie_id in set(expected) | set(actual):
+        want = expected.get(movie_id, empty)
+        have = actual.get(movie_id, empty)
+
+        diff = {
+            col: {"expected": want[col], "actual": have[col]}
+            for col in STATS_COLUMNS
+            if not math.isclose(want[col] or 0, have[col] or 0, abs_tol=1e-6)
+        }
+        if diff:
+            drift.append({"movie_id": movie_id, "diff": diff})
+
+    if fix and drift:
+        for entry in drift:
+            await db.execute(
+                text("DELETE FROM movie_stats WHERE movie_id = :movie_id;"),
+                {"movie_id": entry["movie_id"]},
+            )
+            # keep counting up, so ETags handed out before the fix go stale
+            old_version = actual.get(entry["movie_id"], {}).get("version") or 0
+            await _insert_recomputed(db, entry["movie_id"], old_version + 1)
+        await db.commit()
+
+    return drift
+
+
+# --------------------- BACKFILL ---------------------
+def backfill_movie_stats(engine):
+    """Migration 9: movie_stats rows for movies reviewed before the table existed."""
+    with engine.begin() as conn:
+        result = conn.execute(text(f"""
+            INSERT INTO movie_stats (movie_id, {", ".join(STATS_COLUMNS)}, version)
+            SELECT movie_id, {RECOMPUTE_SELECT}, 1
+            FROM reviews
+            WHERE NOT EXISTS (SELECT 1 FROM movie_stats s WHERE s.movie_id = reviews.movie_id)
+            GROUP BY movie_id;
+        """))
+    print(f"  {result.rowcount} movie_stats rows backfilled from reviews")
+
+
+async def _main(fix: bool):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        drift = await check_movie_stats(db, fix=fix)
+
+    for entry in drift:
+        print("movie", entry["movie_id"], entry["diff"])
+    print(f"{len(drift)} movie(s) drifted" + (" (fixed)" if fix and drift else ""))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main("--fix" in sys.argv))
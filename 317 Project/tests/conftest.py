@@ -0,0 +1,61 @@
+"""
+Shared fixtures. The app reads its configuration at import time, so the
+environment is set up here, before anything imports main: a throwaway
+SQLite database migrated at startup, a fake TMDb (bench.py's) and no
+background catalog refresh.
+"""
+import itertools
+import os
+import re
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="movie-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["AUTO_MIGRATE"] = "true"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("TMDB_API_KEY", "test-key")
+os.environ.setdefault("CATALOG_REFRESH", "false")
+os.environ.setdefault("PROFILE_DIR", os.path.join(TEST_DIR, "profiles"))
+os.environ.setdefault("POSTER_CACHE_DIR", os.path.join(TEST_DIR, "posters"))
+os.environ.setdefault("INTERNAL_API_TOKEN", "test-internal-token")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import bench
+import main
+from tmdb import RequestBudget, TMDbClient
+
+_usernames = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        main.app.state.tmdb = TMDbClient(
+            api_key="test-key",
+            transport=bench.fake_tmdb_transport(0),
+            budget=RequestBudget(rate=0),
+        )
+        yield c
+
+
+def sign_up(client) -> dict:
+    """Auth headers for a fresh user, signed up and logged in."""
+    username = f"user{next(_usernames)}"
+    client.post("/signup", json={"username": username, "email": f"{username}@example.com", "password": "pw"})
+    token = client.post("/login", json={"username": username, "password": "pw"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def auth_headers(client):
+    return sign_up(client)
+
+
+def query_count(response) -> int:
+    """SQL statements the request ran, from its Server-Timing header."""
+    return int(re.search(r'desc="(\d+) queries"', response.headers["Server-Timing"]).group(1))
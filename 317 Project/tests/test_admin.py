@@ -0,0 +1,37 @@
+"""
+/metrics and /debug/* are for operators: the INTERNAL_API_TOKEN bearer or
+an ADMIN_USER_IDS user. Anyone else is turned away.
+"""
+import os
+
+import pytest
+
+import main
+
+INTERNAL = {"Authorization": f"Bearer {os.environ['INTERNAL_API_TOKEN']}"}
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/debug/latency", "/debug/search-index"])
+def test_anonymous_is_rejected(client, path):
+    assert client.get(path).status_code == 401
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/debug/latency", "/debug/search-index"])
+def test_plain_user_is_forbidden(client, auth_headers, path):
+    assert client.get(path, headers=auth_headers).status_code == 403
+
+
+def test_profiler_is_admin_only(client, auth_headers):
+    assert client.post("/debug/profiler", params={"every": 0}, headers=auth_headers).status_code == 403
+    assert client.post("/debug/profiler", params={"every": 0}, headers=INTERNAL).status_code == 200
+
+
+def test_internal_token_is_allowed(client):
+    assert client.get("/metrics", headers=INTERNAL).status_code == 200
+    assert client.get("/debug/latency", headers=INTERNAL).status_code == 200
+
+
+def test_admin_user_is_allowed(client, auth_headers, monkeypatch):
+    user_id = client.get("/me", headers=auth_headers).json()["id"]
+    monkeypatch.setattr(main, "ADMIN_USER_IDS", {user_id})
+    assert client.get("/debug/latency", headers=auth_headers).status_code == 200
@@ -0,0 +1,30 @@
+"""
+PrincipalCache drops a user's cached rows when the user is invalidated,
+and forgets invalidations once the rows they covered have expired.
+"""
+import time
+
+from auth_cache import PrincipalCache
+
+USER = {"id": 1, "username": "alice"}
+
+
+def test_invalidate_makes_cached_user_stale():
+    cache = PrincipalCache(ttl=30)
+    cache.put("alice", USER)
+    assert cache.get("alice") == USER
+
+    cache.invalidate(USER["id"])
+    assert cache.get("alice") is None
+
+    cache.put("alice", {**USER, "username": "alice2"})
+    assert cache.get("alice")["username"] == "alice2"
+
+
+def test_invalidations_are_forgotten_after_ttl():
+    cache = PrincipalCache(ttl=0.05)
+    for user_id in range(1000):
+        cache.invalidate(user_id)
+    time.sleep(0.1)
+    cache.invalidate(-1)
+    assert list(cache._invalidated) == [-1]
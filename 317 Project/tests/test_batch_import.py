@@ -0,0 +1,61 @@
+"""
+POST /movies/batch reports every requested id, in request order: added
+to the user's list, already on it, or failed with TMDb's reason.
+"""
+import itertools
+
+import httpx
+import pytest
+
+import bench
+import main
+from conftest import sign_up
+from tmdb import RequestBudget, TMDbClient
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 5_000_000)
+
+
+@pytest.fixture
+def tmdb_missing(client, monkeypatch):
+    """A TMDb that 404s the ids in the returned set."""
+    missing = set()
+
+    def handler(request):
+        tmdb_id = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+        if tmdb_id in missing:
+            return httpx.Response(404, json={"status_message": "The resource you requested could not be found."})
+        return httpx.Response(200, json=bench.fake_tmdb_payload(request.url.path))
+
+    tmdb = TMDbClient(api_key="test-key", transport=httpx.MockTransport(handler), budget=RequestBudget(rate=0))
+    monkeypatch.setattr(main.app.state, "tmdb", tmdb)
+    yield missing
+    client.portal.call(tmdb.aclose)
+
+
+def test_batch_statuses(client, auth_headers, tmdb_missing):
+    saved, new, gone = next(_tmdb_ids), next(_tmdb_ids), next(_tmdb_ids)
+    tmdb_missing.add(str(gone))
+    assert client.post(f"/movies/{saved}", headers=auth_headers).status_code == 200
+
+    resp = client.post("/movies/batch", json={"tmdb_ids": [gone, saved, new]}, headers=auth_headers)
+    assert resp.status_code == 200
+    results = resp.json()
+
+    assert [r["tmdb_id"] for r in results] == [gone, saved, new]
+    assert [r["status"] for r in results] == ["failed", "already_saved", "added"]
+    assert results[0]["movie_id"] is None and "404" in results[0]["detail"]
+    assert results[1]["movie_id"] and results[2]["movie_id"]
+
+    again = client.post("/movies/batch", json={"tmdb_ids": [new]}, headers=auth_headers).json()
+    assert again == [{"tmdb_id": new, "status": "already_saved", "movie_id": results[2]["movie_id"], "detail": None}]
+
+
+def test_batch_movie_saved_by_another_user_is_added(client, auth_headers):
+    tmdb_id = next(_tmdb_ids)
+    client.post(f"/movies/{tmdb_id}", headers=auth_headers)
+
+    other = sign_up(client)
+    [result] = client.post("/movies/batch", json={"tmdb_ids": [tmdb_id]}, headers=other).json()
+    assert result["status"] == "added"
+    [again] = client.post("/movies/batch", json={"tmdb_ids": [tmdb_id]}, headers=other).json()
+    assert again["status"] == "already_saved"
@@ -0,0 +1,87 @@
+"""
+MemoryCache evicts the least recently used entry past max_size and drops
+entries after their TTL; SingleFlight runs one fetch per key for any number
+of concurrent callers, and survives the first caller being cancelled.
+"""
+import asyncio
+import time
+
+import pytest
+
+from cache import MemoryCache, SingleFlight
+
+
+def test_lru_eviction():
+    cache = MemoryCache(max_size=2, ttl=60)
+    cache.set_nowait("a", 1)
+    cache.set_nowait("b", 2)
+    assert cache.get_nowait("a") == 1  # b is now the least recent
+    cache.set_nowait("c", 3)
+
+    assert cache.get_nowait("b") is None
+    assert cache.get_nowait("a") == 1
+    assert cache.get_nowait("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    cache = MemoryCache(max_size=10, ttl=60)
+    cache.set_nowait("short", 1, ttl=0.05)
+    cache.set_nowait("long", 2)
+    time.sleep(0.1)
+
+    assert cache.get_nowait("short") is None
+    assert cache.get_nowait("long") == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    async def many():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(10)))
+
+    assert asyncio.run(many()) == [1] * 10
+    assert calls == 1
+    assert flight.coalesced == 9
+    assert flight._inflight == {}
+
+
+def test_singleflight_outlives_cancelled_first_caller():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def cancel_first():
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(cancel_first()) == "done"
+
+
+def test_singleflight_error_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def many():
+        return await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(many())
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,49 @@
+"""
+Conditional GETs: a matching If-None-Match gets an empty 304, and a write
+to what the response shows changes its ETag.
+"""
+import itertools
+
+import bench
+from conftest import sign_up
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 8_000_000)
+
+
+def test_reviews_304_until_a_review_is_added(client, auth_headers):
+    tmdb_id = next(_tmdb_ids)
+    movie_id = client.post(f"/movies/{tmdb_id}", headers=auth_headers).json()["id"]
+    client.post("/reviews", json={"movie_id": movie_id, "rating": 6, "comment": "first"}, headers=auth_headers)
+    url = f"/movies/tmdb/{tmdb_id}/reviews"
+
+    first = client.get(url, headers=auth_headers)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    cached = client.get(url, headers={**auth_headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+    # weak comparison, and any tag in the list
+    assert client.get(url, headers={**auth_headers, "If-None-Match": f'"other", W/{etag}'}).status_code == 304
+
+    other = sign_up(client)
+    client.post("/reviews", json={"movie_id": movie_id, "rating": 9, "comment": "second"}, headers=other)
+
+    changed = client.get(url, headers={**auth_headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(changed.json()) == 2
+
+
+def test_profile_etag_changes_after_update(client, auth_headers):
+    etag = client.get("/me", headers=auth_headers).headers["ETag"]
+    assert client.get("/me", headers={**auth_headers, "If-None-Match": etag}).status_code == 304
+
+    client.put("/me", json={"full_name": "Etag Changed"}, headers=auth_headers)
+
+    changed = client.get("/me", headers={**auth_headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["full_name"] == "Etag Changed"
+    assert changed.headers["ETag"] != etag
@@ -0,0 +1,54 @@
+"""
+The bulk export streams: peak memory while exporting must stay flat as
+the table grows. export_table is driven directly, on the app's event loop,
+because TestClient buffers a whole response body before returning it.
+"""
+import tracemalloc
+
+import pytest
+from sqlalchemy import text
+
+import bench
+from database import engine
+from export import export_table
+
+SMALL_EXPORT = 10_000
+LARGE_EXPORT = 100_000
+
+
+@pytest.fixture(scope="module")
+def max_review_id(client):
+    # 200 users x 500 movies, every user reviews every movie
+    args = bench.parse_args(["--users", "200", "--movies", "500", "--reviews-per-movie", "200"])
+    bench.seed(args, engine, "not-a-real-hash")
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(id) FROM reviews;")).scalar()
+
+
+def export_peak(client, format: str, since_id: int):
+    """(rows exported, peak bytes allocated while exporting)"""
+    async def consume():
+        rows = 0
+        async for chunk in export_table("reviews", format, since_id):
+            rows += chunk.count("\n")
+        return rows
+
+    tracemalloc.start()
+    try:
+        rows = client.portal.call(consume)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return rows, peak
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_export_memory_stays_flat(client, max_review_id, format):
+    header = 1 if format == "csv" else 0
+    small_rows, small_peak = export_peak(client, format, max_review_id - SMALL_EXPORT)
+    large_rows, large_peak = export_peak(client, format, max_review_id - LARGE_EXPORT)
+
+    assert small_rows == SMALL_EXPORT + header
+    assert large_rows == LARGE_EXPORT + header
+    # 10x the rows, about the same peak: only a chunk or so is ever held
+    assert large_peak < small_peak * 1.5, f"peak {small_peak} B for {SMALL_EXPORT} rows, {large_peak} B for {LARGE_EXPORT}"
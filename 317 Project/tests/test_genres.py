@@ -0,0 +1,90 @@
+"""
+Genre ids are cached process-wide, so link() must not cache ids from a
+transaction that may still roll back; a TMDb refresh that changes a movie's
+genres replaces its links and bitmap bits.
+"""
+import itertools
+
+import httpx
+from sqlalchemy import text
+
+import bench
+from catalog_refresh import CatalogRefresher
+from database import AsyncSessionLocal
+from genres import GenreIndex
+from tmdb import RequestBudget, TMDbClient
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 3_000_000)
+
+
+def new_movie_id(client, headers) -> int:
+    return client.post(f"/movies/{next(_tmdb_ids)}", headers=headers).json()["id"]
+
+
+def test_link_rolled_back_caches_nothing(client, auth_headers):
+    index = GenreIndex()
+    movie = {"id": new_movie_id(client, auth_headers), "genres": "Rolled Back Genre"}
+
+    async def link_then_roll_back():
+        async with AsyncSessionLocal() as db:
+            new_genres = await index.link(db, [movie])
+            await db.rollback()
+            exists = (await db.execute(
+                text("SELECT COUNT(*) FROM genres WHERE name = 'Rolled Back Genre';")
+            )).scalar()
+        return new_genres, exists
+
+    new_genres, exists = client.portal.call(link_then_roll_back)
+    assert "rolled back genre" in new_genres
+    assert exists == 0
+    assert "rolled back genre" not in index.ids_by_name
+
+
+def test_link_committed_is_remembered(client, auth_headers):
+    index = GenreIndex()
+    movie = {"id": new_movie_id(client, auth_headers), "genres": "Committed Genre"}
+
+    async def link_and_commit():
+        async with AsyncSessionLocal() as db:
+            new_genres = await index.link(db, [movie])
+            await db.commit()
+        index.remember(new_genres)
+        async with AsyncSessionLocal() as db:
+            return await index.resolve(db, ["committed genre"])
+
+    [genre_id] = client.portal.call(link_and_commit)
+    assert index.ids_by_name["committed genre"] == genre_id
+
+
+def test_refresh_replaces_changed_genres(client, auth_headers):
+    tmdb_id = next(_tmdb_ids)
+    movie_id = client.post(f"/movies/{tmdb_id}", headers=auth_headers).json()["id"]  # Drama, Comedy
+
+    def handler(request):
+        # TMDb now says Horror only
+        return httpx.Response(200, json={**bench.fake_tmdb_payload(request.url.path), "genres": [{"name": "Horror"}]})
+
+    tmdb = TMDbClient(api_key="test-key", transport=httpx.MockTransport(handler), budget=RequestBudget(rate=0))
+    index = GenreIndex()
+    refresher = CatalogRefresher(index)
+
+    async def refresh():
+        async with AsyncSessionLocal() as db:
+            await index.rebuild(db)
+            # only this movie is stale
+            await db.execute(text("UPDATE movies SET refreshed_at = CURRENT_TIMESTAMP;"))
+            await db.execute(text("UPDATE movies SET refreshed_at = NULL WHERE id = :id;"), {"id": movie_id})
+            await db.commit()
+            await refresher.refresh_batch(db, tmdb)
+            rows = (await db.execute(
+                text("SELECT g.name FROM movie_genres mg JOIN genres g ON g.id = mg.genre_id WHERE mg.movie_id = :id;"),
+                {"id": movie_id},
+            )).scalars().all()
+        await tmdb.aclose()
+        return rows
+
+    assert client.portal.call(refresh) == ["Horror"]
+    ids = index.ids_by_name
+    assert index.genres_of(movie_id) == [ids["horror"]]
+    assert movie_id in index.movies_with_all([ids["horror"]], limit=10_000)
+    assert movie_id not in index.movies_with_all([ids["drama"]], limit=10_000)
@@ -0,0 +1,44 @@
+"""
+The leaderboards are rebuilt from the database while reviews keep coming
+in: writes recorded during a rebuild must survive it, and deleting a review
+older than the trending window must not take it out of trending.
+"""
+from datetime import datetime, timedelta
+
+from database import AsyncSessionLocal
+from leaderboard import Leaderboards
+
+MOVIE_ID = -1  # the boards only need an id, not a row
+
+
+def test_record_during_rebuild_is_replayed(client, monkeypatch):
+    boards = Leaderboards()
+    load = Leaderboards._load
+
+    async def load_then_write(self, db):
+        await load(self, db)
+        # a review written after the scan read past it
+        boards.record(MOVIE_ID, added=9)
+
+    monkeypatch.setattr(Leaderboards, "_load", load_then_write)
+
+    async def rebuild():
+        async with AsyncSessionLocal() as db:
+            await boards.rebuild(db)
+
+    client.portal.call(rebuild)
+    assert boards.top_rated.get(MOVIE_ID) is not None
+    assert boards.trending.get(MOVIE_ID) is not None
+    assert boards._replay is None
+
+
+def test_removing_review_older_than_window_keeps_trending():
+    boards = Leaderboards()
+    boards._totals[MOVIE_ID] = [1, 6.0]  # an old review, as a rebuild loads it: not in trending
+    boards.record(MOVIE_ID, added=8)
+    before = boards.trending.get(MOVIE_ID)
+
+    boards.record(MOVIE_ID, removed=6, created_at=datetime.utcnow() - timedelta(days=60))
+
+    assert boards.trending.get(MOVIE_ID) == before
+    assert boards._totals[MOVIE_ID] == [1, 8.0]
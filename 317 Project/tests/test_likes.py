@@ -0,0 +1,74 @@
+"""
+Likes: liking twice or unliking a review that isn't liked changes nothing,
+the counts returned along the way are exact, and once the buffer flushes
+reviews.likes equals the review_likes rows. reconcile() repairs drift.
+"""
+import itertools
+
+from sqlalchemy import text
+
+import bench
+import main
+from conftest import sign_up
+from database import AsyncSessionLocal, engine
+from likes import reconcile
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 7_000_000)
+
+
+def new_review_id(client, headers) -> int:
+    movie_id = client.post(f"/movies/{next(_tmdb_ids)}", headers=headers).json()["id"]
+    client.post("/reviews", json={"movie_id": movie_id, "rating": 7, "comment": "likeable"}, headers=headers)
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT id FROM reviews WHERE movie_id = :movie_id;"), {"movie_id": movie_id}
+        ).scalar()
+
+
+def stored_counts(review_id: int):
+    """(reviews.likes, review_likes rows)"""
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT likes, (SELECT COUNT(*) FROM review_likes WHERE review_id = :id)
+            FROM reviews WHERE id = :id;
+        """), {"id": review_id}).one()
+
+
+def flush_likes(client):
+    async def flush():
+        async with AsyncSessionLocal() as db:
+            await main.like_buffer.flush(db)
+    client.portal.call(flush)
+
+
+def test_like_and_unlike_are_idempotent(client, auth_headers):
+    review_id = new_review_id(client, auth_headers)
+    fans = [sign_up(client) for _ in range(3)]
+    url = f"/reviews/{review_id}/like"
+
+    assert [client.post(url, headers=fan).json()["likes"] for fan in fans] == [1, 2, 3]
+    again = client.post(url, headers=fans[0]).json()
+    assert again == {"review_id": review_id, "liked": True, "likes": 3}
+
+    assert client.delete(url, headers=fans[1]).json()["likes"] == 2
+    assert client.delete(url, headers=fans[1]).json()["likes"] == 2
+
+    flush_likes(client)
+    assert tuple(stored_counts(review_id)) == (2, 2)
+    assert main.like_buffer.pending(review_id) == 0
+
+
+def test_like_unknown_review_is_404(client, auth_headers):
+    assert client.post("/reviews/999999999/like", headers=auth_headers).status_code == 404
+
+
+def test_reconcile_repairs_drifted_counts(client, auth_headers):
+    review_id = new_review_id(client, auth_headers)
+    client.post(f"/reviews/{review_id}/like", headers=auth_headers)
+    flush_likes(client)
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE reviews SET likes = 42 WHERE id = :id;"), {"id": review_id})
+
+    assert reconcile(engine) >= 1
+    assert tuple(stored_counts(review_id)) == (1, 1)
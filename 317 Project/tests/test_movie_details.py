@@ -0,0 +1,33 @@
+"""
+/movies/details resolves every requested movie with IN (...) queries, so
+its statement count must not grow with the number of ids.
+"""
+import itertools
+
+import bench
+from conftest import query_count
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 2_000_000)
+
+
+def saved_movies_with_reviews(client, headers, n):
+    tmdb_ids = []
+    for _ in range(n):
+        tmdb_id = next(_tmdb_ids)
+        movie_id = client.post(f"/movies/{tmdb_id}", headers=headers).json()["id"]
+        client.post("/reviews", json={"movie_id": movie_id, "rating": 7, "comment": "seen"}, headers=headers)
+        tmdb_ids.append(tmdb_id)
+    return tmdb_ids
+
+
+def test_batch_details_query_count_is_constant(client, auth_headers):
+    tmdb_ids = saved_movies_with_reviews(client, auth_headers, 20)
+
+    one = client.get("/movies/details", params={"tmdb_ids": tmdb_ids[:1]}, headers=auth_headers)
+    twenty = client.get("/movies/details", params={"tmdb_ids": tmdb_ids}, headers=auth_headers)
+
+    assert one.status_code == twenty.status_code == 200
+    assert len(one.json()) == 1
+    assert len(twenty.json()) == 20
+    assert all(len(detail["reviews"]) == 1 for detail in twenty.json())
+    assert query_count(one) == query_count(twenty)
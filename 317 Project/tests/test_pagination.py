@@ -0,0 +1,72 @@
+"""
+Review listings page by keyset cursor: walking X-Next-Cursor visits every
+review once, newest first, and format=ndjson streams the same rows one JSON
+object per line.
+"""
+import itertools
+import json
+from datetime import datetime
+
+import bench
+from conftest import sign_up
+from pagination import decode_cursor, encode_cursor
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 4_000_000)
+
+REVIEWERS = 5
+
+
+def reviewed_movie(client, headers) -> int:
+    tmdb_id = next(_tmdb_ids)
+    movie_id = client.post(f"/movies/{tmdb_id}", headers=headers).json()["id"]
+    for i in range(REVIEWERS):
+        body = {"movie_id": movie_id, "rating": i + 1, "comment": f"review {i}"}
+        assert client.post("/reviews", json=body, headers=sign_up(client)).status_code == 200
+    return tmdb_id
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+    assert decode_cursor(None) is None
+
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    tmdb_id = reviewed_movie(client, auth_headers)
+    resp = client.get(f"/movies/tmdb/{tmdb_id}/reviews", params={"cursor": "not-a-cursor"}, headers=auth_headers)
+    assert resp.status_code == 400
+
+
+def test_cursor_pages_cover_every_review(client, auth_headers):
+    tmdb_id = reviewed_movie(client, auth_headers)
+    url = f"/movies/tmdb/{tmdb_id}/reviews"
+
+    everything = client.get(url, headers=auth_headers).json()
+    assert len(everything) == REVIEWERS
+
+    paged, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        resp = client.get(url, params=params, headers=auth_headers)
+        assert resp.status_code == 200
+        paged += resp.json()
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert [r["id"] for r in paged] == [r["id"] for r in everything]
+
+
+def test_ndjson_is_one_review_per_line(client, auth_headers):
+    tmdb_id = reviewed_movie(client, auth_headers)
+    url = f"/movies/tmdb/{tmdb_id}/reviews"
+
+    resp = client.get(url, params={"format": "ndjson"}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    assert resp.text.endswith("\n")
+
+    lines = resp.text.splitlines()
+    assert len(lines) == REVIEWERS
+    streamed = [json.loads(line) for line in lines]
+    assert streamed == client.get(url, headers=auth_headers).json()
@@ -0,0 +1,58 @@
+"""
+The poster cache serves repeat requests from disk, evicts the least
+recently used blobs past its size limit, and forgets the refs that pointed
+at an evicted blob.
+"""
+import asyncio
+
+import httpx
+
+import posters
+from posters import PosterCache
+
+IMAGE_BYTES = 100
+
+
+def upstream(calls):
+    def handler(request):
+        calls.append(request.url.path)
+        # distinct bytes per file, so each gets its own blob
+        return httpx.Response(200, content=request.url.path.encode().ljust(IMAGE_BYTES, b"\0"))
+    return httpx.MockTransport(handler)
+
+
+def test_repeat_request_is_a_hit(tmp_path):
+    calls = []
+    cache = PosterCache(str(tmp_path), max_bytes=10 * IMAGE_BYTES, transport=upstream(calls))
+
+    async def twice():
+        first = await cache.get("w500", "a.jpg")
+        second = await cache.get("w500", "a.jpg")
+        await cache.aclose()
+        return first, second
+
+    first, second = asyncio.run(twice())
+    assert first == second
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted_with_its_refs(tmp_path, monkeypatch):
+    monkeypatch.setattr(posters, "POSTER_EVICT_GRACE_SECONDS", 0)
+    calls = []
+    cache = PosterCache(str(tmp_path), max_bytes=2 * IMAGE_BYTES, transport=upstream(calls))
+
+    async def fill():
+        await cache.get("w500", "a.jpg")
+        await cache.get("w500", "b.jpg")
+        await cache.get("w500", "a.jpg")  # b is now the least recent
+        await cache.get("w500", "c.jpg")
+        await cache.aclose()
+
+    asyncio.run(fill())
+    assert cache.evictions == 1
+    assert cache.bytes == 2 * IMAGE_BYTES
+    assert set(cache._refs) == {("w500", "a.jpg"), ("w500", "c.jpg")}
+    assert set(cache._refs_by_digest) == set(cache._blobs)
+    assert cache._cached("w500", "b.jpg") is None
+    assert ("w500", "b.jpg") not in cache._refs
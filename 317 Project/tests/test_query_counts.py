@@ -0,0 +1,82 @@
+"""
+Statements per request for the mutation endpoints, read from the
+Server-Timing header that metrics.py sets. The numbers are SQLite's, whose
+BEGIN / BEGIN IMMEDIATE and savepoints go through the cursor too, so they
+count. A failure here means a round-trip was added (or saved: then lower
+the number).
+"""
+import itertools
+
+import bench
+from conftest import query_count, sign_up
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 1_000_000)
+
+
+def add_movie(client, headers):
+    resp = client.post(f"/movies/{next(_tmdb_ids)}", headers=headers)
+    assert resp.status_code == 200
+    return resp
+
+
+def test_signup(client):
+    resp = client.post("/signup", json={"username": "qc_signup", "email": "qc_signup@example.com", "password": "pw"})
+    assert resp.status_code == 200
+    # BEGIN, taken-name check, BEGIN IMMEDIATE, INSERT
+    assert query_count(resp) == 4
+
+
+def test_add_new_movie(client, auth_headers):
+    add_movie(client, auth_headers)  # genre rows exist from here on
+    resp = add_movie(client, auth_headers)
+    # BEGIN, lookup, BEGIN IMMEDIATE, savepoint + INSERT movies + release,
+    # movie_genres, user_movies; no re-read (known genres are cached)
+    assert query_count(resp) == 8
+
+
+def test_add_saved_movie(client, auth_headers):
+    tmdb_id = add_movie(client, auth_headers).json()["external_id"]
+    resp = client.post(f"/movies/{tmdb_id}", headers=auth_headers)
+    assert resp.status_code == 200
+    # BEGIN, lookup; nothing to write
+    assert query_count(resp) == 2
+
+
+def test_add_review(client, auth_headers):
+    movie_id = add_movie(client, auth_headers).json()["id"]
+    body = {"movie_id": movie_id, "rating": 8, "comment": "first"}
+    resp = client.post("/reviews", json=body, headers=auth_headers)
+    assert resp.status_code == 200
+    # BEGIN IMMEDIATE, INSERT ... SELECT, stats UPDATE (no row yet), savepoint + INSERT + release
+    assert query_count(resp) == 6
+
+
+def test_add_review_with_existing_stats(client, auth_headers):
+    movie_id = add_movie(client, auth_headers).json()["id"]
+    client.post("/reviews", json={"movie_id": movie_id, "rating": 8, "comment": "first"}, headers=auth_headers)
+
+    other = sign_up(client)
+    resp = client.post("/reviews", json={"movie_id": movie_id, "rating": 4, "comment": "second"}, headers=other)
+    assert resp.status_code == 200
+    # BEGIN IMMEDIATE, INSERT ... SELECT, stats UPDATE
+    assert query_count(resp) == 3
+
+
+def test_update_review(client, auth_headers):
+    movie_id = add_movie(client, auth_headers).json()["id"]
+    client.post("/reviews", json={"movie_id": movie_id, "rating": 8, "comment": "first"}, headers=auth_headers)
+    body = {"movie_id": movie_id, "rating": 6, "comment": "changed"}
+    resp = client.put(f"/reviews/{movie_id}", json=body, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["rating"] == 6
+    # BEGIN IMMEDIATE, locked read of the old rating, UPDATE, stats UPDATE
+    assert query_count(resp) == 4
+
+
+def test_update_profile(client, auth_headers):
+    client.get("/me", headers=auth_headers)  # the profile is cached from here on
+    resp = client.put("/me", json={"full_name": "Query Count"}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["user"]["full_name"] == "Query Count"
+    # BEGIN IMMEDIATE, UPDATE ... RETURNING
+    assert query_count(resp) == 2
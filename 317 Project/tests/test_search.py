@@ -0,0 +1,71 @@
+"""
+Catalog search: the in-memory BM25 index ranks title matches first and
+completes the word being typed, and /movies/search falls back to the
+database's full-text index while the in-memory one isn't ready.
+"""
+import itertools
+
+import pytest
+
+import bench
+import main
+from search import SearchIndex
+
+_tmdb_ids = itertools.count(bench.TMDB_ID_BASE + 6_000_000)
+
+MOVIES = {
+    1: {"title": "The Godfather", "overview": "A crime family saga.", "genres": "Crime, Drama"},
+    2: {"title": "Godzilla", "overview": "A monster attacks Tokyo.", "genres": "Action"},
+    3: {"title": "Goodfellas", "overview": "Crime, as told by the Godfather's neighbours.", "genres": "Crime"},
+    4: {"title": "Amélie", "overview": "A waitress in Paris.", "genres": "Comedy, Romance"},
+}
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.add_many({"id": movie_id, **movie} for movie_id, movie in MOVIES.items())
+    return index
+
+
+def ids(hits):
+    return [movie_id for movie_id, _ in hits]
+
+
+def test_last_word_is_a_prefix(index):
+    assert ids(index.search("godz")) == [2]
+    assert set(ids(index.search("god"))) == {1, 2, 3}
+    assert ids(index.search("godz", prefix=False)) == []
+    assert ids(index.search("family godf")) == [1]
+
+
+def test_words_are_anded_and_title_ranks_first(index):
+    assert ids(index.search("drama godfather")) == [1]
+    assert ids(index.search("monster crime")) == []
+    # the title hit outranks Goodfellas' overview mention
+    assert ids(index.search("godfather")) == [1, 3]
+
+
+def test_accents_are_folded(index):
+    assert ids(index.search("amelie")) == [4]
+
+
+def added_movie(client, headers) -> dict:
+    tmdb_id = next(_tmdb_ids)
+    assert client.post(f"/movies/{tmdb_id}", headers=headers).status_code == 200
+    return {"tmdb_id": tmdb_id, "title": bench.synthetic_title(tmdb_id)}
+
+
+@pytest.mark.parametrize("ready", [True, False], ids=["memory", "database"])
+def test_search_endpoint(client, auth_headers, monkeypatch, ready):
+    movie = added_movie(client, auth_headers)
+    monkeypatch.setattr(main.search_index, "ready", ready)
+
+    # the id is in the synthetic title; typing all but its last digit still finds it
+    typed = str(movie["tmdb_id"])[:-1]
+    resp = client.get("/movies/search", params={"q": typed, "limit": 50}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert movie["title"] in [hit["title"] for hit in resp.json()]
+
+    exact = client.get("/movies/search", params={"q": str(movie["tmdb_id"])}, headers=auth_headers).json()
+    assert [hit["title"] for hit in exact] == [movie["title"]]
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import time
+from typing import Optional, Dict, Any
+
+import httpx
+
+from cache import CacheBackend, MemoryCache, SingleFlight
+
+
+# --------------------- TMDb CONFIG ---------------------
+TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+TMDB_IMAGE_BASE = "https://image.tmdb.org/t/p/w500"
+
+TMDB_MAX_CONNECTIONS = int(os.getenv("TMDB_MAX_CONNECTIONS", "20"))
+TMDB_MAX_KEEPALIVE = int(os.getenv("TMDB_MAX_KEEPALIVE", "10"))
+TMDB_KEEPALIVE_EXPIRY = float(os.getenv("TMDB_KEEPALIVE_EXPIRY", "30"))
+TMDB_TIMEOUT = float(os.getenv("TMDB_TIMEOUT", "10"))
+TMDB_CONNECT_TIMEOUT = float(os.getenv("TMDB_CONNECT_TIMEOUT", "5"))
+TMDB_HTTP2 = os.getenv("TMDB_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# how often a 429 is retried, and the longest Retry-After we're willing to wait
+TMDB_MAX_RETRIES = int(os.getenv("TMDB_MAX_RETRIES", "3"))
+TMDB_MAX_RETRY_AFTER = float(os.getenv("TMDB_MAX_RETRY_AFTER", "10"))
+
+TMDB_CACHE_SIZE = int(os.getenv("TMDB_CACHE_SIZE", "5000"))
+TMDB_CACHE_TTL = float(os.getenv("TMDB_CACHE_TTL", "21600"))
+
+# request budget for this process, kept under TMDb's own limit (~50/s per IP;
+# split it between workers). 0 = unlimited.
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "40"))
+TMDB_BURST = float(os.getenv("TMDB_BURST", "40"))
+# share of the burst background work (catalog_refresh.py) may never touch,
+# so user requests don't queue behind it
+TMDB_BACKGROUND_RESERVE = float(os.getenv("TMDB_BACKGROUND_RESERVE", "0.5"))
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    try:
+        seconds = float(resp.headers.get("Retry-After", "1"))
+    except ValueError:
+        seconds = 1.0
+    return min(max(seconds, 0.0), TMDB_MAX_RETRY_AFTER)
+
+
+def movie_from_tmdb(external_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a TMDb /movie/{id} payload into a movies row."""
+    title = data.get("title") or data.get("name") or "Unknown"
+
+    year = None
+    if data.get("release_date"):
+        try:
+            year = int(data["release_date"].split("-")[0])
+        except Exception:
+            year = None
+
+    poster = (
+        f"{TMDB_IMAGE_BASE}{data.get('poster_path')}"
+        if data.get("poster_path")
+        else None
+    )
+
+    overview = data.get("overview") or ""
+
+    genres_list = data.get("genres") or []
+    genres = ", ".join(g["name"] for g in genres_list if g.get("name"))
+
+    return {
+        "external_id": external_id,
+        "title": title,
+        "year": year,
+        "poster_url": poster,
+        "overview": overview,
+        "genres": genres,
+    }
+
+
+class RequestBudget:
+    """Token bucket shared by every TMDb call this process makes."""
+
+    def __init__(self, rate: float = TMDB_RATE_LIMIT, burst: float = TMDB_BURST):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self.waits = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, reserve: float = 0.0):
+        """Take one token; with a reserve, only once more than that many are left."""
+        if self.rate <= 0:
+            return
+        waited = False
+        while True:
+            self._refill()
+            if self.tokens >= 1 + reserve:
+                self.tokens -= 1
+                return
+            if not waited:
+                waited = True
+                self.waits += 1
+            await asyncio.sleep((1 + reserve - self.tokens) / self.rate)
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {"tokens": round(self.tokens, 2), "rate": self.rate, "waits": self.waits}
+
+
+class TMDbError(Exception):
+    def __init__(self, status_code: int, data: Any = None):
+        super().__init__(f"TMDb returned {status_code}")
+        self.status_code = status_code
+        self.data = data
+
+
+class TMDbClient:
+    """
+    One pooled httpx client for all TMDb calls, created in the app lifespan.
+    Connections are kept alive between requests instead of redoing
+    DNS + TCP + TLS for every call.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = TMDB_API_KEY,
+        base_url: str = TMDB_BASE_URL,
+        max_connections: int = TMDB_MAX_CONNECTIONS,
+        max_keepalive: int = TMDB_MAX_KEEPALIVE,
+        keepalive_expiry: float = TMDB_KEEPALIVE_EXPIRY,
+        timeout: float = TMDB_TIMEOUT,
+        connect_timeout: float = TMDB_CONNECT_TIMEOUT,
+        http2: bool = TMDB_HTTP2,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[CacheBackend] = None,
+        budget: Optional[RequestBudget] = None,
+    ):
+        self.api_key = api_key
+        self.budget = budget if budget is not None else RequestBudget()
+        self.cache = cache if cache is not None else MemoryCache(TMDB_CACHE_SIZE, TMDB_CACHE_TTL)
+        self.singleflight = SingleFlight()
+        self.upstream_calls = 0
+        self.rate_limited = 0
+        # after a 429, every caller holds off until this monotonic time
+        self._retry_at = 0.0
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            # http2 needs the optional h2 package (httpx[http2])
+            http2=http2 and transport is None,
+            transport=transport,
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        background: bool = False,
+    ) -> Dict[str, Any]:
+        query = {"api_key": self.api_key}  # expecting v3 key here
+        if params:
+            query.update(params)
+        reserve = self.budget.burst * TMDB_BACKGROUND_RESERVE if background else 0.0
+
+        for attempt in range(TMDB_MAX_RETRIES + 1):
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            await self.budget.acquire(reserve)
+            self.upstream_calls += 1
+            resp = await self.client.get(path, params=query)
+
+            if resp.status_code == 429 and attempt < TMDB_MAX_RETRIES:
+                self.rate_limited += 1
+                self._retry_at = time.monotonic() + _retry_after(resp)
+                continue
+
+            data = resp.json()
+            if resp.status_code != 200:
+                raise TMDbError(resp.status_code, data)
+
+            return data
+
+    async def get_movie(
+        self,
+        movie_id: str,
+        language: str = "en-US",
+        background: bool = False,
+    ) -> Dict[str, Any]:
+        key = f"movie:{movie_id}:{language}"
+
+        data = await self.cache.get(key)
+        if data is not None:
+            return data
+
+        # concurrent misses for the same movie share one upstream call
+        return await self.singleflight.do(key, lambda: self._fetch_movie(key, movie_id, language, background))
+
+    async def _fetch_movie(self, key: str, movie_id: str, language: str, background: bool) -> Dict[str, Any]:
+        data = await self.get(f"/movie/{movie_id}", {"language": language}, background)
+        await self.cache.set(key, data)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cache": self.cache.stats(),
+            "coalesced": self.singleflight.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "rate_limited": self.rate_limited,
+            "budget": self.budget.stats(),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()